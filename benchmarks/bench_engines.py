@@ -0,0 +1,106 @@
+"""
+Compare extraction latency of the in-process and subprocess yt-dlp engines.
+
+A local HTTP server serves a small media file, so yt-dlp's generic extractor
+resolves it without touching the network. Every call does a full
+`--dump-json` extraction through my_mcp.run_ytdlp_json().
+
+Usage: python benchmarks/bench_engines.py [--calls 30] [--concurrency 1]
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import my_mcp  # noqa: E402
+
+
+def start_stub_server(directory):
+    """Serve `directory` on a random localhost port, returns (server, base_url)"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    httpd = QuietServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # yt-dlp's generic extractor hangs up after sniffing the first bytes
+        pass
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def bench_engine(engine, url, calls, concurrency):
+    my_mcp.YTDLP_ENGINE = engine
+    my_mcp.warm_up_extraction_engine()
+    cmd_args = my_mcp.get_base_ytdlp_args() + ["--dump-json", "--no-playlist", url]
+
+    # One untimed call so both engines start from the same state
+    await my_mcp.run_ytdlp_json(cmd_args)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_call():
+        async with semaphore:
+            start = time.perf_counter()
+            returncode, entries, stderr = await my_mcp.run_ytdlp_json(cmd_args)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if returncode != 0 or not entries:
+                raise RuntimeError(f"{engine} extraction failed: {stderr}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_call() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    return {
+        "engine": engine,
+        "calls": calls,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+        "calls_per_s": calls / elapsed,
+    }
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as media_dir:
+        with open(os.path.join(media_dir, "clip.mp4"), "wb") as f:
+            f.write(os.urandom(256 * 1024))
+        httpd, base_url = start_stub_server(media_dir)
+        try:
+            url = f"{base_url}/clip.mp4"
+            results = []
+            for engine in ("subprocess", "inprocess"):
+                results.append(await bench_engine(engine, url, args.calls, args.concurrency))
+        finally:
+            httpd.shutdown()
+
+    print(f"{'engine':<12}{'calls':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'calls/s':>10}")
+    for r in results:
+        print(f"{r['engine']:<12}{r['calls']:>7}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['mean_ms']:>10.1f}{r['calls_per_s']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""
+Compare get_video_info with the full --dump-json document against the projected
+--print template (my_mcp.INFO_PROJECTION_TEMPLATE).
+
+Runs offline on captured payloads: save one with
+    yt-dlp --dump-json "https://www.youtube.com/watch?v=..." > video.info.json
+and pass it on the command line. Without payload files a synthetic document
+shaped like a YouTube one (formats, thumbnails, automatic captions) is used.
+
+For each payload it reports, per mode:
+  - bytes yt-dlp writes to the pipe
+  - json.loads + summarize time and peak Python memory for that output
+  - wall time of a real `yt-dlp --load-info-json` run producing it
+
+Usage: python benchmarks/bench_projection.py [--runs 5] [payload.info.json ...]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import my_mcp  # noqa: E402
+from bench_engines import percentile  # noqa: E402
+
+
+def random_text(length):
+    return "".join(random.choice(string.ascii_letters + " ") for _ in range(length))
+
+
+def make_synthetic_payload():
+    """An info dict with roughly the size and shape of a YouTube --dump-json document"""
+    video_id = "SyntheticId"
+    formats = []
+    for i, height in enumerate([144, 240, 360, 480, 720, 1080, 1440, 2160] * 5):
+        formats.append({
+            "format_id": str(100 + i),
+            "url": f"https://rr1---sn-example.googlevideo.com/videoplayback?expire=1900000000&id={video_id}&itag={100 + i}&"
+                   + random_text(600).replace(" ", "x"),
+            "ext": "mp4",
+            "height": height,
+            "width": height * 16 // 9,
+            "vcodec": "avc1.640028",
+            "acodec": "none",
+            "tbr": random.uniform(100, 20000),
+            "filesize": random.randint(10**6, 10**9),
+            "protocol": "https",
+            "http_headers": {"User-Agent": "Mozilla/5.0", "Accept": "*/*", "Accept-Language": "en-us,en;q=0.5"},
+            "fragments": [{"url": f"sq/{n}", "duration": 5.0} for n in range(30)],
+        })
+    captions = {
+        f"lang{i}": [
+            {"ext": ext, "url": "https://www.youtube.com/api/timedtext?" + random_text(300).replace(" ", "x"), "name": f"Language {i}"}
+            for ext in ("json3", "srv1", "srv2", "srv3", "ttml", "vtt")
+        ]
+        for i in range(150)
+    }
+    return {
+        "id": video_id,
+        "title": "Synthetic benchmark video",
+        "uploader": "Benchmark Channel",
+        "duration": 754,
+        "duration_string": "12:34",
+        "view_count": 1234567,
+        "like_count": 45678,
+        "upload_date": "20240102",
+        "description": random_text(4000),
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "original_url": f"https://www.youtube.com/watch?v={video_id}",
+        "extractor": "youtube",
+        "extractor_key": "Youtube",
+        "formats": formats,
+        "thumbnails": [{"url": f"https://i.ytimg.com/vi/{video_id}/{i}.jpg", "preference": i, "id": str(i)} for i in range(40)],
+        "automatic_captions": captions,
+        "subtitles": {},
+        "heatmap": [{"start_time": i * 7.5, "end_time": (i + 1) * 7.5, "value": random.random()} for i in range(100)],
+        "tags": [random_text(12) for _ in range(30)],
+    }
+
+
+def measure_parse(output, runs):
+    """Median seconds and peak bytes for turning yt-dlp output into a get_video_info summary"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        my_mcp.summarize_video_info(json.loads(output))
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    my_mcp.summarize_video_info(json.loads(output))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return percentile(timings, 50), peak
+
+
+async def run_ytdlp(payload_path, output_args):
+    """Wall seconds and stdout of yt-dlp re-processing a saved info document"""
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        "yt-dlp", "--load-info-json", payload_path, *output_args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode())
+    return time.perf_counter() - start, stdout.decode().strip()
+
+
+async def bench_payload(payload_path, runs):
+    modes = {
+        "full": ["--dump-json"],
+        "projected": ["--print", my_mcp.INFO_PROJECTION_TEMPLATE],
+    }
+    results = []
+    for mode, output_args in modes.items():
+        walls = []
+        for _ in range(runs):
+            wall, output = await run_ytdlp(payload_path, output_args)
+            walls.append(wall)
+        parse_s, peak = measure_parse(output, runs)
+        results.append({
+            "payload": os.path.basename(payload_path),
+            "mode": mode,
+            "pipe_bytes": len(output.encode()),
+            "parse_ms": parse_s * 1000,
+            "peak_kib": peak / 1024,
+            "ytdlp_wall_ms": percentile(walls, 50) * 1000,
+        })
+    return results
+
+
+async def run(args):
+    payloads = list(args.payloads)
+    tmp_dir = None
+    if not payloads:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, "synthetic.info.json")
+        with open(path, "w") as f:
+            json.dump(make_synthetic_payload(), f)
+        payloads.append(path)
+
+    try:
+        results = []
+        for path in payloads:
+            results.extend(await bench_payload(path, args.runs))
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    print(f"{'payload':<24}{'mode':<11}{'pipe bytes':>12}{'parse ms':>10}{'peak KiB':>10}{'yt-dlp ms':>11}")
+    for r in results:
+        print(f"{r['payload'][:23]:<24}{r['mode']:<11}{r['pipe_bytes']:>12}{r['parse_ms']:>10.2f}"
+              f"{r['peak_kib']:>10.1f}{r['ytdlp_wall_ms']:>11.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("payloads", nargs="*", help="Saved yt-dlp --dump-json documents")
+    asyncio.run(run(parser.parse_args()))
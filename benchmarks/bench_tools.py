@@ -0,0 +1,398 @@
+"""
+Offline benchmark of every MCP tool against a stub yt-dlp (benchmarks/stub_ytdlp.py).
+
+Nothing touches YouTube: the stub answers searches and info requests with canned
+JSON, and "downloads" serve a media file from a local HTTP server with real
+progress output. A temporary HOME keeps downloads, caches and state away from
+the real ones.
+
+Three transports are measured:
+  direct   N concurrent tasks calling my_mcp.call_tool() in this process
+  stdio    N MCP clients, each talking to its own `my_mcp.main()` server over stdio
+  http     N MCP client sessions sharing one `my_mcp.main("http")` server on localhost
+
+For search_youtube, get_video_info, get_transcript, download_youtube_video and download_youtube_audio
+it reports latency percentiles, throughput, yt-dlp process spawns and in-process
+extractions per call, and peak RSS. Every call uses a fresh query or URL, so the
+numbers are for cache misses.
+
+Usage: python benchmarks/bench_tools.py [--calls 20] [--clients 1 4] [--transport direct stdio http]
+                                        [--engine inprocess] [--ytdlp-workers 6] [--fail-cookies firefox,chrome]
+                                        [--audio-format m4a]
+                                        [--media-kib 2048] [--output bench_tools.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stub_ytdlp  # noqa: E402
+
+# my_mcp (also imported by bench_engines and bench_projection) resolves its download and
+# state directories from HOME at import time, so those imports wait until run() has set it
+
+TOOLS = ("search_youtube", "get_video_info", "get_transcript", "download_youtube_video", "download_youtube_audio")
+
+# Runs my_mcp's server (stdio, or HTTP with main_args) with the stub module in place of yt_dlp
+SERVER_LAUNCHER = """
+import asyncio, os, sys
+sys.path[:0] = [{repo!r}, {bench!r}]
+import my_mcp, stub_ytdlp
+my_mcp.yt_dlp = stub_ytdlp.make_module()
+my_mcp.YTDLP_ENGINE = {engine!r}
+my_mcp.YTDLP_WORKER_MODULE = "stub_ytdlp"
+my_mcp.ytdlp_workers.max_size = {workers!r}
+with open(os.path.join(os.environ["BENCH_PID_DIR"], str(os.getpid())), "w"):
+    pass
+asyncio.run(my_mcp.main({main_args}))
+"""
+
+
+def tool_arguments(tool, n, audio_format):
+    """Arguments for the n-th call of a tool, unique so every call misses the caches"""
+    if tool == "search_youtube":
+        return {"query": f"benchmark query {n}", "max_results": 10}
+    if tool == "get_video_info":
+        return {"url": f"https://www.youtube.com/watch?v=info{n:06d}"}
+    if tool == "get_transcript":
+        return {"url": f"https://www.youtube.com/watch?v=text{n:06d}"}
+    if tool == "download_youtube_video":
+        return {"url": f"https://www.youtube.com/watch?v=video{n:06d}", "resolution": "720p", "wait": True}
+    return {"url": f"https://www.youtube.com/watch?v=audio{n:06d}", "format": audio_format, "wait": True}
+
+
+def read_spawns(log_path):
+    """The stub yt-dlp's log: one dict per process started and per command line run"""
+    try:
+        with open(log_path) as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def spawn_stats(log_path, before):
+    """
+    (processes started, largest peak RSS of a run) since `before` entries were logged.
+    Runs on warm workers are not spawns, workers count once when they start.
+    """
+    logged = read_spawns(log_path)[before:]
+    spawns = sum(1 for entry in logged if entry["event"] == "start")
+    peaks = [entry["peak_rss_kib"] for entry in logged if entry["event"] == "run" and entry["peak_rss_kib"] is not None]
+    return spawns, max(peaks) if peaks else None
+
+
+def peak_rss_kib(pid=None):
+    """Peak resident set size in KiB: of this process, or of `pid` on Linux"""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def check_result(tool, result):
+    """`result` is the CallToolResult the client received"""
+    text = result.content[0].text
+    failed = result.isError or (tool.startswith("download") and "✅" not in text)
+    if failed:
+        raise RuntimeError(f"{tool} failed: {text[:300]}")
+
+
+async def drive(calls, clients, call_one):
+    """Run `calls` (tool, arguments) pairs over `clients` concurrent callers, returns (latencies ms, wall s)"""
+    pending = list(calls)
+    latencies = []
+
+    async def client(index):
+        while pending:
+            tool, arguments = pending.pop()
+            start = time.perf_counter()
+            check_result(tool, await call_one(index, tool, arguments))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return latencies, time.perf_counter() - start
+
+
+def summarize(transport, tool, clients, latencies, wall, spawns, extractions, peak_kib, ytdlp_peak_kib):
+    from bench_engines import percentile
+    calls = len(latencies)
+    return {
+        "transport": transport,
+        "tool": tool,
+        "clients": clients,
+        "calls": calls,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+        "calls_per_s": calls / wall,
+        "spawns_per_call": spawns / calls,
+        "inprocess_extractions_per_call": None if extractions is None else extractions / calls,
+        "peak_rss_kib": peak_kib,
+        "ytdlp_peak_rss_kib": ytdlp_peak_kib,
+    }
+
+
+async def bench_direct(args, env, counter):
+    """Call my_mcp.call_tool() directly; my_mcp is imported after HOME points at the temp dir"""
+    import my_mcp
+    my_mcp.yt_dlp = stub_ytdlp.make_module()
+    my_mcp.YTDLP_ENGINE = args.engine
+    my_mcp.YTDLP_WORKER_MODULE = "stub_ytdlp"
+    my_mcp.ytdlp_workers.max_size = args.ytdlp_workers
+    my_mcp.warm_up_extraction_engine()
+    my_mcp.ytdlp_workers.fill()
+    stub_class = my_mcp.yt_dlp.YoutubeDL
+
+    async def call_one(index, tool, arguments):
+        result = await my_mcp.call_tool(tool, arguments)
+        # Handlers return a CallToolResult only for errors, the server wraps the rest
+        if isinstance(result, my_mcp.CallToolResult):
+            return result
+        return my_mcp.CallToolResult(content=result)
+
+    results = []
+    for clients in args.clients:
+        for tool in TOOLS:
+            calls = [(tool, tool_arguments(tool, next(counter), args.audio_format)) for _ in range(args.calls)]
+            spawns_before = len(read_spawns(env["STUB_YTDLP_SPAWN_LOG"]))
+            extractions_before = stub_class.calls
+            latencies, wall = await drive(calls, clients, call_one)
+            spawns, ytdlp_peak = spawn_stats(env["STUB_YTDLP_SPAWN_LOG"], spawns_before)
+            results.append(summarize(
+                "direct", tool, clients, latencies, wall, spawns,
+                stub_class.calls - extractions_before, peak_rss_kib(), ytdlp_peak
+            ))
+            print_row(results[-1])
+    return results
+
+
+async def bench_stdio(args, env, counter):
+    """One stdio server process per client, driven through the MCP client library"""
+    from contextlib import AsyncExitStack
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    launcher = SERVER_LAUNCHER.format(
+        repo=REPO_DIR, bench=BENCH_DIR, engine=args.engine, workers=args.ytdlp_workers, main_args=""
+    )
+    params = StdioServerParameters(command=sys.executable, args=["-c", launcher], env=env)
+
+    results = []
+    for clients in args.clients:
+        for tool in TOOLS:
+            pid_dir = env["BENCH_PID_DIR"]
+            for name in os.listdir(pid_dir):
+                os.remove(os.path.join(pid_dir, name))
+
+            async with AsyncExitStack() as stack:
+                sessions = []
+                for _ in range(clients):
+                    read, write = await stack.enter_async_context(stdio_client(params))
+                    session = await stack.enter_async_context(ClientSession(read, write))
+                    await session.initialize()
+                    sessions.append(session)
+
+                async def call_one(index, tool, arguments):
+                    return await sessions[index].call_tool(tool, arguments)
+
+                calls = [(tool, tool_arguments(tool, next(counter), args.audio_format)) for _ in range(args.calls)]
+                spawns_before = len(read_spawns(env["STUB_YTDLP_SPAWN_LOG"]))
+                latencies, wall = await drive(calls, clients, call_one)
+                spawns, ytdlp_peak = spawn_stats(env["STUB_YTDLP_SPAWN_LOG"], spawns_before)
+                server_peaks = [peak_rss_kib(int(pid)) for pid in os.listdir(pid_dir)]
+                server_peaks = [p for p in server_peaks if p is not None]
+
+            results.append(summarize(
+                "stdio", tool, clients, latencies, wall, spawns, None,
+                max(server_peaks) if server_peaks else None, ytdlp_peak
+            ))
+            print_row(results[-1])
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def bench_http(args, env, counter):
+    """One HTTP server process per measurement, shared by all client sessions"""
+    from contextlib import AsyncExitStack
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    results = []
+    for clients in args.clients:
+        for tool in TOOLS:
+            port = free_port()
+            launcher = SERVER_LAUNCHER.format(
+                repo=REPO_DIR, bench=BENCH_DIR, engine=args.engine, workers=args.ytdlp_workers,
+                main_args=f"'http', '127.0.0.1', {port}"
+            )
+            server = await asyncio.create_subprocess_exec(sys.executable, "-c", launcher, env=env)
+            try:
+                await wait_for_port(port)
+                async with AsyncExitStack() as stack:
+                    sessions = []
+                    for _ in range(clients):
+                        read, write, _ = await stack.enter_async_context(
+                            streamablehttp_client(f"http://127.0.0.1:{port}/mcp")
+                        )
+                        session = await stack.enter_async_context(ClientSession(read, write))
+                        await session.initialize()
+                        sessions.append(session)
+
+                    async def call_one(index, tool, arguments):
+                        return await sessions[index].call_tool(tool, arguments)
+
+                    calls = [(tool, tool_arguments(tool, next(counter), args.audio_format)) for _ in range(args.calls)]
+                    spawns_before = len(read_spawns(env["STUB_YTDLP_SPAWN_LOG"]))
+                    latencies, wall = await drive(calls, clients, call_one)
+                    spawns, ytdlp_peak = spawn_stats(env["STUB_YTDLP_SPAWN_LOG"], spawns_before)
+                    server_peak = peak_rss_kib(server.pid)
+            finally:
+                server.terminate()
+                await server.wait()
+
+            results.append(summarize(
+                "http", tool, clients, latencies, wall, spawns, None, server_peak, ytdlp_peak
+            ))
+            print_row(results[-1])
+    return results
+
+
+def print_header():
+    print(f"{'transport':<10}{'tool':<24}{'clients':>8}{'calls':>7}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'calls/s':>9}{'spawns':>8}{'peak KiB':>10}")
+
+
+def print_row(r):
+    peak = "-" if r["peak_rss_kib"] is None else r["peak_rss_kib"]
+    print(f"{r['transport']:<10}{r['tool']:<24}{r['clients']:>8}{r['calls']:>7}{r['p50_ms']:>9.1f}"
+          f"{r['p90_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['calls_per_s']:>9.2f}{r['spawns_per_call']:>8.2f}{peak:>10}",
+          flush=True)
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        home = os.path.join(work_dir, "home")
+        os.makedirs(home)
+        os.environ["HOME"] = os.environ["USERPROFILE"] = home
+        from bench_engines import start_stub_server
+        from bench_projection import make_synthetic_payload
+        
+        media_dir = os.path.join(work_dir, "media")
+        os.makedirs(media_dir)
+        with open(os.path.join(media_dir, "media.mp4"), "wb") as f:
+            f.write(os.urandom(args.media_kib * 1024))
+        info_path = os.path.join(work_dir, "canned.info.json")
+        with open(info_path, "w") as f:
+            json.dump(make_synthetic_payload(), f)
+
+        httpd, base_url = start_stub_server(media_dir)
+        bin_dir = os.path.join(work_dir, "bin")
+        stub_ytdlp.install_executable(bin_dir)
+
+        # Everything my_mcp and the stub read, set for this process and the stdio servers alike
+        env = dict(os.environ)
+        env.update({
+            "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            "PYTHONPATH": BENCH_DIR,  # yt-dlp workers import stub_ytdlp
+            "STUB_YTDLP_INFO": info_path,
+            "STUB_YTDLP_MEDIA_URL": f"{base_url}/media.mp4",
+            "STUB_YTDLP_SPAWN_LOG": os.path.join(work_dir, "spawns.log"),
+            "STUB_YTDLP_FAIL_COOKIES": args.fail_cookies,
+            "BENCH_PID_DIR": os.path.join(work_dir, "pids"),
+        })
+        os.makedirs(env["BENCH_PID_DIR"])
+        os.environ.update(env)
+
+        counter = iter(range(10**9))
+        results = []
+        print_header()
+        try:
+            if "direct" in args.transport:
+                results.extend(await bench_direct(args, env, counter))
+            if "stdio" in args.transport:
+                results.extend(await bench_stdio(args, env, counter))
+            if "http" in args.transport:
+                results.extend(await bench_http(args, env, counter))
+        finally:
+            httpd.shutdown()
+
+    report = {
+        "config": {
+            "engine": args.engine,
+            "ytdlp_workers": args.ytdlp_workers,
+            "calls": args.calls,
+            "clients": args.clients,
+            "fail_cookies": args.fail_cookies,
+            "audio_format": args.audio_format,
+            "media_kib": args.media_kib,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20, help="Calls per tool and client count")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4], help="Concurrent client counts to measure")
+    parser.add_argument("--transport", nargs="+", choices=("direct", "stdio", "http"),
+                        default=["direct", "stdio", "http"])
+    parser.add_argument("--engine", choices=("inprocess", "subprocess"), default="inprocess")
+    parser.add_argument("--ytdlp-workers", type=int, default=6,
+                        help="Most warm yt-dlp workers per server, 0 starts a yt-dlp process for every run")
+    parser.add_argument("--fail-cookies", default="", help="Browsers the stub pretends have no cookies, e.g. firefox,chrome")
+    parser.add_argument("--audio-format", choices=("m4a", "opus", "mp3"), default="m4a",
+                        help="Format for download_youtube_audio; mp3 runs ffmpeg, which must be installed")
+    parser.add_argument("--media-kib", type=int, default=2048, help="Size of the stub media file")
+    parser.add_argument("--output", default="bench_tools.json", help="Where to write the JSON report")
+    asyncio.run(run(parser.parse_args()))
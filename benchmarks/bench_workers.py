@@ -0,0 +1,115 @@
+"""
+Compare starting a yt-dlp process for every run with my_mcp's warm worker pool
+(YtdlpWorkerPool: processes that have already imported yt-dlp).
+
+A local HTTP server serves a small media file, so every run is a real yt-dlp
+download (generic extractor, progress output) without touching the network.
+Runs go through my_mcp.run_ytdlp_lines(), like downloads and out-of-process
+extractions do. For each mode it reports the time from starting a run to its
+first line of output (spawn-to-first-byte) and to its exit.
+
+Usage: python benchmarks/bench_workers.py [--runs 20] [--parallel 1 4] [--media-kib 256]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import my_mcp  # noqa: E402
+from bench_engines import percentile, start_stub_server  # noqa: E402
+
+
+async def timed_run(cmd_args):
+    """(seconds to the first output line, seconds to exit) of one run"""
+    started = time.perf_counter()
+    first = []
+    errors = []
+
+    def on_line(line):
+        if not first:
+            first.append(time.perf_counter() - started)
+
+    def on_stderr(line):
+        on_line(line)
+        errors.append(line)
+
+    returncode = await my_mcp.run_ytdlp_lines(cmd_args, on_line, on_stderr, kind="bench")
+    if returncode != 0:
+        raise RuntimeError(f"yt-dlp exited with {returncode}: " + "\n".join(errors[-5:]))
+    return first[0] if first else None, time.perf_counter() - started
+
+
+async def bench_mode(mode, url, out_dir, runs, parallel):
+    pool = my_mcp.ytdlp_workers
+    pool.max_size = parallel if mode == "warm" else 0
+    pool.min_size = parallel if mode == "warm" else 0
+    pool.fill()
+    while mode == "warm" and len(pool.idle) < parallel:
+        await asyncio.sleep(0.05)  # the workers import yt-dlp before the clock starts
+
+    pending = list(range(runs))
+    samples = []
+
+    async def runner():
+        while pending:
+            output = os.path.join(out_dir, f"{mode}-{parallel}-{pending.pop()}.%(ext)s")
+            samples.append(await timed_run(["yt-dlp", "-o", output] + my_mcp.PROGRESS_ARGS + [url]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(runner() for _ in range(parallel)))
+    wall = time.perf_counter() - start
+
+    first = [s[0] for s in samples if s[0] is not None]
+    total = [s[1] for s in samples]
+    return {
+        "mode": mode,
+        "parallel": parallel,
+        "runs": runs,
+        "first_p50_ms": percentile(first, 50) * 1000,
+        "first_p90_ms": percentile(first, 90) * 1000,
+        "total_p50_ms": percentile(total, 50) * 1000,
+        "total_p90_ms": percentile(total, 90) * 1000,
+        "runs_per_s": runs / wall,
+    }
+
+
+async def run(args):
+    if shutil.which("yt-dlp") is None:
+        sys.exit("The yt-dlp command is needed for the per-run process mode")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        media_dir = os.path.join(work_dir, "media")
+        out_dir = os.path.join(work_dir, "out")
+        os.makedirs(media_dir)
+        os.makedirs(out_dir)
+        with open(os.path.join(media_dir, "clip.mp4"), "wb") as f:
+            f.write(os.urandom(args.media_kib * 1024))
+        httpd, base_url = start_stub_server(media_dir)
+
+        results = []
+        try:
+            for parallel in args.parallel:
+                for mode in ("process", "warm"):
+                    results.append(await bench_mode(mode, f"{base_url}/clip.mp4", out_dir, args.runs, parallel))
+        finally:
+            httpd.shutdown()
+
+    print(f"{'mode':<9}{'parallel':>9}{'runs':>6}{'first p50 ms':>14}{'first p90 ms':>14}"
+          f"{'total p50 ms':>14}{'total p90 ms':>14}{'runs/s':>8}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['parallel']:>9}{r['runs']:>6}{r['first_p50_ms']:>14.0f}{r['first_p90_ms']:>14.0f}"
+              f"{r['total_p50_ms']:>14.0f}{r['total_p90_ms']:>14.0f}{r['runs_per_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--media-kib", type=int, default=256)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,397 @@
+"""
+Stand-in for yt-dlp used by the offline benchmarks.
+
+It understands the subset of the command line my_mcp.py uses and answers with
+canned data instead of talking to YouTube:
+
+  - ytsearchN:QUERY          flat search results, honouring --playlist-start/--playlist-end
+  - --dump-json / --print    the canned info document (or the projected fields)
+  - --simulate               succeeds without output
+  - --load-info-json FILE    uses the document in FILE instead of the canned one
+  - --write-subs             writes STUB_YTDLP_CAPTION_MINUTES minutes of automatic-caption style
+                             WebVTT to the "subtitle:" output template (and --write-info-json
+                             the document to the "infojson:" one)
+  - -o TEMPLATE              "downloads" STUB_YTDLP_MEDIA_URL from a local HTTP server,
+                             printing --progress-template and --print after_move lines
+
+Use it either as an executable (install_executable() puts a `yt-dlp` wrapper in a
+directory for PATH) or as a module: make_module() returns an object that can replace
+my_mcp.yt_dlp for the in-process engine, and with this directory on PYTHONPATH
+my_mcp.YTDLP_WORKER_MODULE = "stub_ytdlp" makes the yt-dlp workers run main().
+
+Configuration comes from environment variables:
+  STUB_YTDLP_INFO            path of the canned --dump-json document
+  STUB_YTDLP_MEDIA_URL       URL of the media served for downloads
+  STUB_YTDLP_SPAWN_LOG       every process appends a JSON line here when it starts ("start"), and one
+                             per command line it ran ("run": argv, peak RSS); a warm worker runs many
+  STUB_YTDLP_FAIL_COOKIES    comma separated browsers whose cookies "can't be found"
+"""
+import http.cookiejar
+import json
+import os
+import re
+import stat
+import sys
+import time
+import types
+import urllib.request
+from collections import namedtuple
+
+
+def parse_args(argv):
+    """The options my_mcp.py passes, everything else is ignored"""
+    opts = {
+        "urls": [], "print": [], "dump_json": False, "simulate": False, "output": None,
+        "playlist_start": 1, "playlist_end": None, "browser": None, "extract_audio": False,
+        "audio_format": "mp3", "progress_template": None, "format": None, "load_info": None,
+        "write_subs": False, "write_info_json": False, "sub_langs": "en", "typed_output": {},
+    }
+    takes_value = {
+        "--print", "-O", "-o", "--playlist-start", "--playlist-end", "--cookies-from-browser",
+        "--audio-format", "--progress-template", "--user-agent", "--referer", "--sleep-interval", "--max-sleep-interval", "--extractor-args",
+        "--cookies", "--audio-quality", "-f", "--concurrent-fragments", "--limit-rate",
+        "--load-info-json", "--ffmpeg-location", "--sub-langs", "--sub-format",
+    }
+    flags = {
+        "--dump-json": "dump_json", "--simulate": "simulate", "--skip-download": "simulate", "-x": "extract_audio",
+        "--write-subs": "write_subs", "--write-auto-subs": "write_subs", "--write-info-json": "write_info_json",
+    }
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        value = argv[i + 1] if i + 1 < len(argv) else None
+        i += 1
+        if arg in flags:
+            opts[flags[arg]] = True
+            continue
+        if not arg.startswith("-"):
+            opts["urls"].append(arg)
+            continue
+        if arg not in takes_value:
+            continue  # a flag the stub doesn't care about
+        i += 1
+        if arg in ("--print", "-O"):
+            opts["print"].append(value)
+        elif arg == "-o" and value.startswith(("subtitle:", "infojson:")):
+            kind, template = value.split(":", 1)
+            opts["typed_output"][kind] = template
+        elif arg == "-o":
+            opts["output"] = value
+        elif arg == "-f":
+            opts["format"] = value
+        elif arg == "--load-info-json":
+            opts["load_info"] = value
+        elif arg == "--sub-langs":
+            opts["sub_langs"] = value
+        elif arg == "--playlist-start":
+            opts["playlist_start"] = int(value)
+        elif arg == "--playlist-end":
+            opts["playlist_end"] = int(value)
+        elif arg == "--cookies-from-browser":
+            opts["browser"] = value
+        elif arg == "--audio-format":
+            opts["audio_format"] = value
+        elif arg == "--progress-template":
+            opts["progress_template"] = value
+    return opts
+
+
+def cookie_error(opts):
+    failing = [b for b in os.environ.get("STUB_YTDLP_FAIL_COOKIES", "").split(",") if b]
+    if opts["browser"] in failing:
+        return f"ERROR: could not find {opts['browser']} cookies database"
+    return None
+
+
+def video_id(url):
+    match = re.search(r"[?&]v=([^&]+)", url)
+    return match.group(1) if match else url.rstrip("/").rsplit("/", 1)[-1].split(".")[0]
+
+
+_canned = None
+
+
+def canned_info(url):
+    global _canned
+    if _canned is None:
+        with open(os.environ["STUB_YTDLP_INFO"]) as f:
+            _canned = json.load(f)
+    info = dict(_canned)
+    info["id"] = video_id(url)
+    info["title"] = f"Stub video {info['id']}"
+    info["original_url"] = info["webpage_url"] = url
+    info["ext"] = "mp4"
+    return info
+
+
+def select_format(info, opts):
+    """Set format_id like a format selection: the first format id of -f that exists, else the last format"""
+    ids = [fmt.get("format_id") for fmt in info.get("formats") or []]
+    wanted = [part for part in re.split(r"[/+]", opts["format"] or "") if part in ids]
+    info["format_id"] = wanted[0] if wanted else (ids[-1] if ids else None)
+    return info
+
+
+def search_entries(url, opts):
+    """Flat search results for ytsearchN:QUERY"""
+    count, query = re.match(r"ytsearch(\d*):(.*)", url).groups()
+    end = min(int(count or 1), opts["playlist_end"] or int(count or 1))
+    slug = re.sub(r"\W+", "-", query.lower()).strip("-") or "q"
+    return [{
+        "_type": "url", "ie_key": "Youtube", "id": f"{slug}-{n}",
+        "url": f"https://www.youtube.com/watch?v={slug}-{n}",
+        "title": f"{query} #{n}", "duration_string": "3:21", "view_count": 1000 * n, "uploader": "Stub",
+    } for n in range(opts["playlist_start"], end + 1)]
+
+
+def render_template(template, info):
+    """The %(.{a,b,c})j dict selection and %(field)j / %(field)s forms"""
+    match = re.search(r"%\(\.\{([^}]*)\}\)j", template)
+    if match:
+        selected = {}
+        for field in match.group(1).split(","):
+            if field == "formats.:.height":
+                selected[field] = [f.get("height") for f in info.get("formats", []) if f.get("height")]
+            elif field in info:
+                selected[field] = info[field]
+        return template.replace(match.group(0), json.dumps(selected))
+    return re.sub(r"%\((\w+)\)([js])", lambda m: json.dumps(info.get(m.group(1))) if m.group(2) == "j"
+                  else str(info.get(m.group(1))), template)
+
+
+def stream_format(opts):
+    """(ext, acodec) of what the format selection downloads: bestaudio is AAC in m4a unless opus is asked for"""
+    selector = re.sub(r"^[\d+]+/", "", opts["format"] or "")  # exact format ids picked by my_mcp come first
+    if opts["extract_audio"]:
+        return opts["audio_format"], opts["audio_format"]
+    if selector.startswith("bestaudio[acodec=opus]"):
+        return "webm", "opus"
+    if selector.startswith("bestaudio"):
+        return "m4a", "mp4a.40.2"
+    return "mp4", "mp4a.40.2"
+
+
+def write_captions(opts):
+    """Captions like YouTube's automatic ones: each cue repeats the line before it"""
+    path = opts["typed_output"]["subtitle"].replace("%(ext)s", f"{opts['sub_langs']}.vtt")
+    minutes = int(os.environ.get("STUB_YTDLP_CAPTION_MINUTES", "10"))
+    stamp = lambda t: f"{t // 3600:02d}:{t % 3600 // 60:02d}:{t % 60:02d}.000"
+    previous = " "
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("WEBVTT\nKind: captions\nLanguage: en\n\n")
+        for t in range(0, minutes * 60, 2):
+            line = f"caption line at {t} seconds"
+            f.write(f"{stamp(t)} --> {stamp(t + 2)} align:start position:0%\n{previous}\n{line}<c> end</c>\n\n")
+            previous = line + " end"
+
+
+def download(info, opts, out):
+    """Fetch the stub media, print progress like --progress-template would, return the file path"""
+    ext, info["acodec"] = stream_format(opts)
+    path = opts["output"].replace("%(title)s", info["title"]).replace("%(ext)s", ext)
+    if os.path.exists(path):
+        return path
+
+    started = time.monotonic()
+    with urllib.request.urlopen(os.environ["STUB_YTDLP_MEDIA_URL"]) as response, open(path + ".part", "wb") as f:
+        total = int(response.headers.get("Content-Length") or 0) or None
+        done = 0
+        while True:
+            chunk = response.read(256 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+            done += len(chunk)
+            if opts["progress_template"]:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                speed = done / elapsed
+                eta = int((total - done) / speed) if total else None
+                out.write("[progress] " + json.dumps({
+                    "status": "downloading", "downloaded_bytes": done, "total_bytes": total, "speed": speed, "eta": eta
+                }) + "\n")
+        if opts["progress_template"]:
+            out.write("[progress] " + json.dumps({"status": "finished", "downloaded_bytes": done, "total_bytes": total}) + "\n")
+    os.replace(path + ".part", path)
+    return path
+
+
+def peak_rss_kib():
+    """VmHWM of this process (Linux), which unlike ru_maxrss starts over at exec"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def log_event(event, **fields):
+    log = os.environ.get("STUB_YTDLP_SPAWN_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write(json.dumps({"event": event, "pid": os.getpid(), **fields}) + "\n")
+
+
+def main(argv):
+    try:
+        return run_cli(argv)
+    finally:
+        log_event("run", argv=argv, peak_rss_kib=peak_rss_kib())
+
+
+def run_cli(argv, out=None, err=None):
+    # Looked up per call: my_mcp's yt-dlp workers swap sys.stdout/sys.stderr for every job
+    out = out or sys.stdout
+    err = err or sys.stderr
+    opts = parse_args(argv)
+    error = cookie_error(opts)
+    if error:
+        err.write(error + "\n")
+        return 1
+
+    loaded = None
+    urls = opts["urls"]
+    if opts["load_info"]:
+        with open(opts["load_info"]) as f:
+            loaded = json.load(f)
+        urls = [loaded.get("original_url") or loaded.get("webpage_url")]
+
+    returncode = 0
+    for url in urls:
+        if url.startswith("ytsearch"):
+            for entry in search_entries(url, opts):
+                out.write(json.dumps(entry) + "\n")
+            continue
+        if "nope" in url:
+            err.write(f"ERROR: [generic] {video_id(url)}: HTTP Error 404: Not Found\n")
+            returncode = 1
+            continue
+
+        info = select_format(dict(loaded) if loaded else canned_info(url), opts)
+        if opts["dump_json"]:
+            out.write(json.dumps(info) + "\n")
+        if opts["write_subs"] and "subtitle" in opts["typed_output"]:
+            write_captions(opts)
+        if opts["write_info_json"] and "infojson" in opts["typed_output"]:
+            with open(opts["typed_output"]["infojson"].replace("%(ext)s", "info.json"), "w") as f:
+                json.dump(info, f)
+        for template in opts["print"]:
+            if not template.startswith("after_move:") and opts["output"] is None:
+                out.write(render_template(template, info) + "\n")
+        if opts["output"] and not opts["simulate"] and not opts["dump_json"]:
+            info["filepath"] = download(info, opts, out)
+            for template in opts["print"]:
+                if template.startswith("after_move:"):
+                    out.write(render_template(template[len("after_move:"):], info) + "\n")
+        out.flush()
+    return returncode
+
+
+def make_module():
+    """A stand-in for the yt_dlp package, for my_mcp's in-process engine"""
+    module = types.ModuleType("yt_dlp")
+    utils = types.ModuleType("yt_dlp.utils")
+
+    class YoutubeDLError(Exception):
+        pass
+
+    class DownloadError(YoutubeDLError):
+        pass
+
+    utils.YoutubeDLError = YoutubeDLError
+    utils.DownloadError = DownloadError
+    
+    # Browser cookies for my_mcp's cookie jar export: none, or missing like STUB_YTDLP_FAIL_COOKIES says
+    cookies = types.ModuleType("yt_dlp.cookies")
+    cookies.YoutubeDLCookieJar = http.cookiejar.MozillaCookieJar
+
+    def extract_cookies_from_browser(browser_name, profile=None, logger=None, **kwargs):
+        error = cookie_error({"browser": browser_name})
+        if error:
+            raise FileNotFoundError(error[len("ERROR: "):])
+        return http.cookiejar.MozillaCookieJar()
+
+    cookies.extract_cookies_from_browser = extract_cookies_from_browser
+    ParsedOptions = namedtuple("ParsedOptions", ("parser", "options", "urls", "ydl_opts"))
+
+    def parse_options(argv):
+        opts = parse_args(argv)
+        options = types.SimpleNamespace(load_info_filename=opts["load_info"])
+        return ParsedOptions(None, options, opts["urls"], {"stub_opts": opts})
+
+    class YoutubeDL:
+        calls = 0
+
+        def __init__(self, params, auto_init=True):
+            self.params = params
+            self.logger = params.get("logger")
+            self._ies = {}
+
+        def add_info_extractor(self, ie):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def get_info_extractor(self, name):
+            return None
+
+        def _fail(self, message):
+            if self.logger is not None:
+                self.logger.error(message)
+            raise DownloadError(message)
+
+        def extract_info(self, url, download=False):
+            YoutubeDL.calls += 1
+            opts = self.params["stub_opts"]
+            error = cookie_error(opts)
+            if error:
+                self._fail(error)
+            if url.startswith("ytsearch"):
+                return {"_type": "playlist", "entries": search_entries(url, opts)}
+            if "nope" in url:
+                self._fail(f"ERROR: [generic] {video_id(url)}: HTTP Error 404: Not Found")
+            return select_format(canned_info(url), opts)
+
+        def process_ie_result(self, info, download=True):
+            return select_format(dict(info), self.params["stub_opts"])
+
+        @staticmethod
+        def sanitize_info(info, remove_private_keys=False):
+            return json.loads(json.dumps(info))
+
+    module.utils = utils
+    module.cookies = cookies
+    module.parse_options = parse_options
+    module.YoutubeDL = YoutubeDL
+    return module
+
+
+def install_executable(bin_dir):
+    """Put a `yt-dlp` command running this stub into bin_dir, returns its path"""
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.abspath(__file__)
+    if os.name == "nt":
+        path = os.path.join(bin_dir, "yt-dlp.cmd")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(bin_dir, "yt-dlp")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+# my_mcp's yt-dlp workers import this module as they start (python -c WORKER_SOURCE stub_ytdlp)
+if sys.argv[1:2] == [__name__]:
+    log_event("start")
+
+if __name__ == "__main__":
+    log_event("start")
+    sys.exit(main(sys.argv[1:]))
@@ -1,21 +1,197 @@
+import argparse
 import asyncio
+import bisect
+import contextlib
+import copy
+import cProfile
+import glob
+import hashlib
+import html
 import os
 import json
+import math
 import random
+import re
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import weakref
+from urllib.parse import urlparse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import uvicorn
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
-from mcp.types import Tool, TextContent
+from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+from mcp.server.transport_security import TransportSecuritySettings
+from mcp.types import CallToolResult, Tool, TextContent
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+try:
+    import yt_dlp
+except ImportError:  # yt-dlp is only installed as a command line tool
+    yt_dlp = None
 
 server = Server("yt-dlp-mcp-server")
 
 DOWNLOAD_DIR = os.path.expanduser("~/Downloads/mcp_ytdlp")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
+# Server state (caches, indexes) lives next to the downloads, not inside them
+STATE_DIR = os.path.join(os.path.dirname(DOWNLOAD_DIR), "mcp_ytdlp_state")
+os.makedirs(STATE_DIR, exist_ok=True)
+
 # Custom cookie path - Update this path for your browser
 # For Windows Firefox: C:/Users/USERNAME/AppData/Roaming/Mozilla/Firefox/Profiles/XXXXX.default/cookies.sqlite
 # For Windows Chrome: C:/Users/USERNAME/AppData/Local/Google/Chrome/User Data/Default/Network/Cookies
 CUSTOM_COOKIE_PATH = ""  # Leave empty if you want to use browser auto-detection
 
+# Extraction engine used by search and video info:
+#   "inprocess"  - run yt-dlp through its Python API in a long-lived worker pool
+#   "subprocess" - start a new yt-dlp process for every call
+# The subprocess engine is also used automatically when the yt_dlp module can't be imported.
+YTDLP_ENGINE = "inprocess"
+INPROCESS_WORKERS = 4
+# Ask yt-dlp only for the fields get_video_info shows instead of the whole --dump-json
+# document (formats, thumbnails, captions, ... often several hundred KB per video)
+INFO_PROJECTION = True
+INFO_FIELDS = [
+    "id", "original_url", "title", "uploader", "duration_string", "view_count",
+    "like_count", "description", "upload_date", "formats.:.height",
+]
+INFO_PROJECTION_TEMPLATE = "%(.{" + ",".join(INFO_FIELDS) + "})j"
+# get_video_info_batch: most URLs per call, and extractor sessions running at the same time.
+# With the in-process engine a batch uses at most INPROCESS_WORKERS - 1 of the workers, so
+# searches and single lookups don't wait for it.
+INFO_BATCH_MAX_URLS = 100
+INFO_BATCH_SESSIONS = 3
+
+# get_transcript: transcripts converted to text are kept per video and language. One call returns
+# at most TRANSCRIPT_MAX_CHARS characters, with a timestamp every TRANSCRIPT_PARAGRAPH_SECONDS.
+TRANSCRIPT_DIR = os.path.join(STATE_DIR, "transcripts")
+TRANSCRIPT_CACHE_TTL = 7 * 24 * 60 * 60
+TRANSCRIPT_CACHE_FILES = 500
+TRANSCRIPT_MAX_CHARS = 20000
+TRANSCRIPT_PARAGRAPH_SECONDS = 30
+
+# Metadata cache for get_video_info and search_youtube (TTLs in seconds)
+CACHE_DB_PATH = os.path.join(STATE_DIR, "metadata_cache.sqlite3")
+INFO_CACHE_TTL = 6 * 60 * 60
+SEARCH_CACHE_TTL = 30 * 60
+
+# Whole info documents of extracted videos, kept so that downloading a video that was just looked up
+# doesn't extract it again (yt-dlp --load-info-json). A document is only used while its signed stream
+# URLs stay valid for INFO_JSON_URL_MARGIN more seconds, and never longer than INFO_CACHE_TTL.
+# Lookups only have the whole document with the in-process engine, or without INFO_PROJECTION.
+INFO_JSON_REUSE = True
+INFO_JSON_DIR = os.path.join(STATE_DIR, "info_json")
+INFO_JSON_URL_MARGIN = 30 * 60
+INFO_JSON_MAX_FILES = 200
+
+# search_youtube pagination: results per page, results fetched per yt-dlp call (one page of
+# YouTube's search API costs the same for 5 or 20 results), and when unused query buffers are dropped
+MAX_SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_RESULTS = 1000
+SEARCH_FETCH_CHUNK = 20
+SEARCH_BUFFER_IDLE_SECONDS = 10 * 60
+MAX_SEARCH_BUFFERS = 100
+MEMORY_CACHE_ENTRIES = 256
+DISK_CACHE_ENTRIES = 5000
+
+# Index of finished downloads, so repeated requests don't run yt-dlp again
+DOWNLOAD_INDEX_PATH = os.path.join(STATE_DIR, "download_index.sqlite3")
+
+# Unfinished download jobs, resumed (from their .part files) when the server starts again
+DOWNLOAD_JOURNAL_PATH = os.path.join(STATE_DIR, "download_journal.sqlite3")
+
+# Disk quota for DOWNLOAD_DIR in bytes (0 = no quota). Before a download starts, the least recently
+# used files are deleted until its expected size fits; pin_download protects a file from this.
+# A download is also refused when it would leave less than MIN_FREE_DISK bytes free on the disk.
+DOWNLOAD_QUOTA = 0
+MIN_FREE_DISK = 512 * 1024 ** 2
+STORAGE_DB_PATH = os.path.join(STATE_DIR, "storage.sqlite3")
+
+# Transport: "stdio" (each MCP client starts its own server) or "http", one long-running server
+# at http://HTTP_HOST:HTTP_PORT/mcp that many clients share (caches, download queue, cookies).
+# Can also be chosen on the command line: python my_mcp.py --transport http --port 8765
+TRANSPORT = "stdio"
+HTTP_HOST = "127.0.0.1"
+HTTP_PORT = 8765
+# Tool calls one client session may run at the same time, further calls wait
+SESSION_MAX_CONCURRENT_CALLS = 8
+# On shutdown of the HTTP server, running downloads get this many seconds to finish.
+# Queued and unfinished downloads are resumed the next time the server starts.
+DRAIN_TIMEOUT = 60
+
+# Which cookie source worked last, so it is tried first next time
+COOKIE_MEMORY_PATH = os.path.join(STATE_DIR, "cookie_sources.sqlite3")
+# Browser cookies of these sites are exported once into a cookie file for yt-dlp, instead of yt-dlp
+# reading (and for Chrome/Edge decrypting) the browser's cookie database on every run. An export is
+# redone when the browser's cookie database changed since, and at least every COOKIE_JAR_TTL seconds.
+COOKIE_JAR_EXPORT = True
+COOKIE_JAR_DIR = os.path.join(STATE_DIR, "cookie_jars")
+COOKIE_JAR_TTL = 30 * 60
+COOKIE_JAR_DOMAINS = ["youtube.com", "google.com"]
+
+# Background downloads: how many run at the same time and how many finished jobs are remembered
+MAX_CONCURRENT_DOWNLOADS = 2
+DOWNLOAD_HISTORY_LIMIT = 200
+# download_batch defaults: items downloaded in parallel, fragments per item (--concurrent-fragments).
+# A batch runs on the download workers above, so at most MAX_CONCURRENT_DOWNLOADS items at a time.
+BATCH_PARALLEL_DOWNLOADS = MAX_CONCURRENT_DOWNLOADS
+BATCH_CONCURRENT_FRAGMENTS = 4
+MAX_BATCH_ITEMS = 500
+# Audio downloads fetch only the audio stream. Converting it (e.g. to mp3) runs afterwards in ffmpeg,
+# at most TRANSCODE_WORKERS conversions at a time, while the download workers go on with the next jobs.
+# m4a and opus are kept as downloaded when YouTube has them, without converting at all.
+AUDIO_FORMATS = ["mp3", "m4a", "opus"]
+AUDIO_BITRATES = [128, 192, 256, 320]  # kbit/s; mp3 without a bitrate is encoded at the best VBR quality
+TRANSCODE_WORKERS = os.cpu_count() or 2
+FFMPEG_PATH = "ffmpeg"
+# Lower numbers are started first
+DOWNLOAD_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Priority when the request doesn't give one: audio is small and usually wanted right away
+DEFAULT_PRIORITIES = {"audio": "high", "video": "normal"}
+# Total download bandwidth in bytes/s shared by all running downloads (0 = unlimited), can be
+# changed at runtime with set_bandwidth_limit. Each yt-dlp gets a --limit-rate share weighted by priority.
+BANDWIDTH_LIMIT = 0
+BANDWIDTH_WEIGHTS = {0: 4, 1: 2, 2: 1}  # DOWNLOAD_PRIORITIES value -> share weight
+MIN_DOWNLOAD_RATE = 64 * 1024
+# A running download is restarted with its new share (continuing its .part file) only when
+# the share changed by more than this fraction
+RATE_CHANGE_THRESHOLD = 0.25
+# yt-dlp output kept per process for error reporting; progress lines are parsed, not kept
+OUTPUT_TAIL_LINES = 50
+# Warm yt-dlp workers: processes that have already started Python and imported yt-dlp, used
+# for downloads and out-of-process extractions instead of starting the yt-dlp program each time.
+# The pool grows from YTDLP_WORKERS_MIN to YTDLP_WORKERS_MAX workers, beyond that (or with
+# YTDLP_WORKERS_MAX = 0) a new yt-dlp process is started. A worker is replaced after
+# YTDLP_WORKER_MAX_JOBS jobs or once it uses YTDLP_WORKER_MAX_RSS_MB of memory, and workers
+# above the minimum exit after YTDLP_WORKER_IDLE_SECONDS without work.
+YTDLP_WORKERS_MIN = 1
+YTDLP_WORKERS_MAX = 6
+YTDLP_WORKER_MAX_JOBS = 50
+YTDLP_WORKER_MAX_RSS_MB = 400
+YTDLP_WORKER_IDLE_SECONDS = 300
+YTDLP_WORKER_MODULE = "yt_dlp"  # module whose main(argv) the workers run
+# Minimum seconds between MCP progress notifications for a waiting download
+PROGRESS_NOTIFY_INTERVAL = 1.0
+
+# Metrics are always collected (see the get_server_metrics tool). Set a path to also write them in
+# Prometheus text format every METRICS_TEXTFILE_INTERVAL seconds, e.g. for node_exporter's textfile collector
+METRICS_TEXTFILE = ""
+METRICS_TEXTFILE_INTERVAL = 15
+# Profile tool calls with cProfile and keep the profile of every call slower than this (ms, 0 = off)
+PROFILE_SLOW_CALLS_MS = 0
+PROFILE_DIR = os.path.join(STATE_DIR, "profiles")
+
 # Rotate user agents to avoid detection
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -41,233 +217,2734 @@ def get_base_ytdlp_args(use_oauth=False):
     
     return args
 
-async def try_download_with_cookies(url, format_str, output_path):
+# Histogram bucket upper bounds: seconds for timings, bytes/s for download speed
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+SPEED_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+class Histogram:
+    """Bucketed observations, like a Prometheus histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated inside its bucket (None without observations)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0
+        for upper, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+def _prometheus_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _prometheus_labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_prometheus_label_value(value)}"' for name, value in labels.items()) + "}"
+
+class ServerMetrics:
     """
-    Try downloading with cookies in this order:
-    1. Custom path (if set)
-    2. Firefox
-    3. Chrome
-    4. Edge
-    5. No cookies
-    
-    Returns: (success: bool, stdout: str, stderr: str, method: str)
+    Counters and histograms of where the server spends its time: tool calls, yt-dlp
+    processes (time to start, time to exit), in-process extractions and downloads.
     """
-    
-    # Method 1: Custom cookie path
-    if CUSTOM_COOKIE_PATH and os.path.exists(CUSTOM_COOKIE_PATH):
-        shell_command = f'yt-dlp --cookies "{CUSTOM_COOKIE_PATH}" -f "{format_str}" -o "{output_path}" "{url}"'
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.tool_latency = {}  # tool -> Histogram of seconds per call
+        self.tool_errors = {}  # tool -> calls that returned an error
+        self.tool_names = None  # registered tools, timed_tool_call() counts calls of other names as "unknown"
+        self.process_spawn = {}  # kind -> Histogram of seconds until the process was running
+        self.process_first_output = {}  # (kind, warm worker) -> Histogram of seconds until the first line
+        self.process_runtime = {}  # kind -> Histogram of seconds from start to exit
+        self.process_failures = {}  # kind -> non-zero exits
+        self.extractions = Histogram(LATENCY_BUCKETS)  # in-process engine
+        self.download_bytes = {}  # kind -> bytes transferred
+        self.download_results = {}  # (kind, status) -> finished jobs
+        self.download_speed = Histogram(SPEED_BUCKETS)  # bytes/s of completed jobs
+        self.slow_call_profiles = 0
+
+    def observe_tool(self, name, seconds, failed):
+        self.tool_latency.setdefault(name, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        if failed:
+            self.tool_errors[name] = self.tool_errors.get(name, 0) + 1
+
+    def observe_spawn(self, kind, seconds):
+        self.process_spawn.setdefault(kind, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def observe_first_output(self, kind, warm, seconds):
+        self.process_first_output.setdefault((kind, warm), Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def observe_exit(self, kind, seconds, returncode):
+        self.process_runtime.setdefault(kind, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        if returncode != 0:
+            self.process_failures[kind] = self.process_failures.get(kind, 0) + 1
+
+    def observe_download(self, job):
+        transferred = job.transferred_bytes()
+        self.download_bytes[job.kind] = self.download_bytes.get(job.kind, 0) + transferred
+        key = (job.kind, job.status)
+        self.download_results[key] = self.download_results.get(key, 0) + 1
+        if job.status == "completed" and transferred and job.started_at:
+            self.download_speed.observe(transferred / max(job.finished_at - job.started_at, 0.001))
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
         
-        process = await asyncio.create_subprocess_shell(
-            shell_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP ytdlp_mcp_{name} {help_text}")
+            lines.append(f"# TYPE ytdlp_mcp_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"ytdlp_mcp_{name}{_prometheus_labels(**labels)} {value}")
         
-        stdout, stderr = await process.communicate()
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP ytdlp_mcp_{name} {help_text}")
+            lines.append(f"# TYPE ytdlp_mcp_{name} histogram")
+            for labels, hist in histograms:
+                cumulative = 0
+                for bound, n in zip(hist.buckets + ("+Inf",), hist.counts):
+                    cumulative += n
+                    lines.append(f"ytdlp_mcp_{name}_bucket{_prometheus_labels(**labels, le=bound)} {cumulative}")
+                lines.append(f"ytdlp_mcp_{name}_sum{_prometheus_labels(**labels)} {hist.sum}")
+                lines.append(f"ytdlp_mcp_{name}_count{_prometheus_labels(**labels)} {hist.count}")
         
-        if process.returncode == 0:
-            return (True, stdout.decode(), stderr.decode(), "custom_path")
+        metric("uptime_seconds", "gauge", "Seconds since the server started", [({}, time.time() - self.started_at)])
+        histogram("tool_call_seconds", "Duration of MCP tool calls",
+            [({"tool": name}, hist) for name, hist in sorted(self.tool_latency.items())])
+        metric("tool_call_errors_total", "counter", "Tool calls that returned an error",
+            [({"tool": name}, n) for name, n in sorted(self.tool_errors.items())])
+        histogram("process_spawn_seconds", "Time until a yt-dlp or ffmpeg process was started",
+            [({"kind": kind}, hist) for kind, hist in sorted(self.process_spawn.items())])
+        histogram("process_first_output_seconds", "Time from starting a yt-dlp or ffmpeg run to its first output line",
+            [({"kind": kind, "start": "warm" if warm else "cold"}, hist)
+             for (kind, warm), hist in sorted(self.process_first_output.items())])
+        metric("ytdlp_workers", "gauge", "Warm yt-dlp worker processes", [({}, ytdlp_workers.size)])
+        metric("ytdlp_workers_idle", "gauge", "Warm yt-dlp workers waiting for a job", [({}, len(ytdlp_workers.idle))])
+        metric("ytdlp_workers_started_total", "counter", "yt-dlp workers started", [({}, ytdlp_workers.started)])
+        metric("ytdlp_workers_recycled_total", "counter", "yt-dlp workers replaced after too many jobs or too much memory",
+            [({}, ytdlp_workers.recycled)])
+        metric("ytdlp_workers_overflows_total", "counter", "yt-dlp runs that got a new process because all workers were busy",
+            [({}, ytdlp_workers.overflows)])
+        histogram("process_runtime_seconds", "Time from starting a yt-dlp or ffmpeg process to its exit",
+            [({"kind": kind}, hist) for kind, hist in sorted(self.process_runtime.items())])
+        metric("process_failures_total", "counter", "yt-dlp and ffmpeg processes that exited with an error",
+            [({"kind": kind}, n) for kind, n in sorted(self.process_failures.items())])
+        histogram("inprocess_extraction_seconds", "Extractions run by the in-process engine",
+            [({}, self.extractions)])
+        metric("download_bytes_total", "counter", "Bytes downloaded",
+            [({"kind": kind}, n) for kind, n in sorted(self.download_bytes.items())])
+        metric("downloads_total", "counter", "Download jobs that ran, by result",
+            [({"kind": kind, "status": status}, n) for (kind, status), n in sorted(self.download_results.items())])
+        histogram("download_speed_bytes_per_second", "Average speed of completed downloads",
+            [({}, self.download_speed)])
+        metric("download_queue_depth", "gauge", "Download jobs waiting for a worker",
+            [({}, download_manager.queued_count())])
+        metric("downloads_running", "gauge", "Download jobs running now",
+            [({}, sum(1 for job in download_manager.jobs.values() if job.status == "running"))])
+        for name in ("downloads", "attempts", "probes", "first_try_successes"):
+            metric(f"cookie_fallback_{name}_total", "counter", f"Cookie fallback {name.replace('_', ' ')}",
+                [({}, cookie_fallback_stats[name])])
+        metric("cookie_fallback_seconds_total", "counter", "Time spent on cookie sources that did not work",
+            [({}, cookie_fallback_stats["fallback_seconds"])])
+        for name in ("exports", "reuses", "failures"):
+            metric(f"cookie_jar_{name}_total", "counter", f"Browser cookie exports: {name}",
+                [({}, cookie_jars.counters[name])])
+        cache = metadata_cache.stats()
+        for name in ("memory_hits", "disk_hits", "misses", "stores", "evictions"):
+            metric(f"metadata_cache_{name}_total", "counter", f"Metadata cache {name.replace('_', ' ')}",
+                [({}, cache[name])])
+        for name in ("hits", "misses", "stores"):
+            metric(f"info_json_{name}_total", "counter", f"Kept info documents for downloads: {name}",
+                [({}, info_json_store.counters[name])])
+        metric("bandwidth_limit_bytes_per_second", "gauge", "Download bandwidth shared by running downloads (0 = unlimited)",
+            [({}, bandwidth_scheduler.limit)])
+        metric("bandwidth_rate_restarts_total", "counter", "Downloads restarted to apply a new bandwidth share",
+            [({}, bandwidth_scheduler.restarts)])
+        used, _, _ = storage_manager.usage()
+        metric("storage_used_bytes", "gauge", "Bytes used by files in the download directory", [({}, used)])
+        metric("storage_quota_bytes", "gauge", "Download directory quota (0 = none)", [({}, storage_manager.quota)])
+        metric("storage_evicted_files_total", "counter", "Least recently used files deleted to make room",
+            [({}, storage_manager.evictions)])
+        metric("storage_evicted_bytes_total", "counter", "Bytes deleted to make room", [({}, storage_manager.evicted_bytes)])
+        metric("storage_rejected_downloads_total", "counter", "Downloads refused for lack of space",
+            [({}, storage_manager.rejections)])
+        metric("slow_call_profiles_total", "counter", "Profiles written for slow tool calls",
+            [({}, self.slow_call_profiles)])
+        return "\n".join(lines) + "\n"
+
+server_metrics = ServerMetrics()
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+_active_profiler = None
+
+def start_call_profile():
+    """Start profiling a tool call if PROFILE_SLOW_CALLS_MS is set and no other call is being profiled"""
+    global _active_profiler
+    if PROFILE_SLOW_CALLS_MS <= 0 or _active_profiler is not None:
+        return None
+    _active_profiler = cProfile.Profile()
+    _active_profiler.enable()
+    return _active_profiler
+
+def finish_call_profile(profiler, name, seconds):
+    """
+    Stop the profiler and keep its stats in PROFILE_DIR if the call was slow.
+    The profile covers everything the event loop ran during the call, not only this call.
+    """
+    global _active_profiler
+    if profiler is None:
+        return
+    profiler.disable()
+    _active_profiler = None
+    if seconds * 1000 < PROFILE_SLOW_CALLS_MS:
+        return
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{name}_{seconds * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        server_metrics.slow_call_profiles += 1
+    except OSError:
+        pass
+
+def write_metrics_textfile():
+    """Replace METRICS_TEXTFILE atomically, so a collector never reads half a file"""
+    tmp_path = METRICS_TEXTFILE + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(server_metrics.render_prometheus())
+        os.replace(tmp_path, METRICS_TEXTFILE)
+    except OSError:
+        pass
+
+async def metrics_textfile_loop():
+    while True:
+        write_metrics_textfile()
+        await asyncio.sleep(METRICS_TEXTFILE_INTERVAL)
+
+class _CollectingLogger:
+    """yt-dlp logger that keeps messages instead of printing them (stdout is the MCP transport)"""
+
+    def __init__(self):
+        self.errors = []
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+_inprocess_executor = None
+
+def _warm_up_worker():
+    """Pay yt-dlp's option parsing and extractor initialization once per worker thread"""
+    with _new_youtube_dl({"quiet": True, "logger": _CollectingLogger()}) as ydl:
+        ydl.get_info_extractor("Youtube")
+
+def get_inprocess_executor():
+    """Get the shared worker pool of the in-process engine, starting it on first use"""
+    global _inprocess_executor
+    if _inprocess_executor is None:
+        _inprocess_executor = ThreadPoolExecutor(
+            max_workers=INPROCESS_WORKERS,
+            thread_name_prefix="yt-dlp",
+            initializer=_warm_up_worker
+        )
+    return _inprocess_executor
+
+def warm_up_extraction_engine():
+    """Start all in-process workers now so the first tool call doesn't pay for it"""
+    if YTDLP_ENGINE != "inprocess" or yt_dlp is None:
+        return
+    executor = get_inprocess_executor()
+    for _ in range(INPROCESS_WORKERS):
+        executor.submit(lambda: None)
+
+_extractor_classes = None
+
+def _new_youtube_dl(ydl_opts):
+    """
+    YoutubeDL for ydl_opts. The list of default extractors is resolved once: YoutubeDL does it
+    again for every instance (~1700 extractors), which costs more than the rest of its setup.
+    """
+    global _extractor_classes
+    default_extractors = list(ydl_opts.get("allowed_extractors") or ["default"]) == ["default"]
+    if _extractor_classes is None or not default_extractors:
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+        if default_extractors:
+            _extractor_classes = list(ydl._ies.values())
+        return ydl
+    ydl = yt_dlp.YoutubeDL(ydl_opts, auto_init=False)
+    for ie in _extractor_classes:
+        # Extractor instances (the final catch-all) belong to one YoutubeDL, each gets its own
+        ydl.add_info_extractor(ie if isinstance(ie, type) else type(ie)())
+    return ydl
+
+_parsed_options = OrderedDict()  # arguments without URLs -> (ydl_opts, load_info_filename), least recently used first
+_parsed_options_lock = threading.Lock()
+PARSED_OPTIONS_ENTRIES = 64
+
+def _parse_ytdlp_args(args):
+    """
+    yt_dlp.parse_options(args) as (ydl_opts, urls, load_info_filename), ydl_opts being a private copy.
+    Parsed options are cached by the arguments before the URL: command lines here mostly differ only in it.
+    """
+    with _parsed_options_lock:
+        if args and not args[-1].startswith("-") and tuple(args[:-1]) in _parsed_options:
+            key, urls = tuple(args[:-1]), [args[-1]]
+        elif tuple(args) in _parsed_options:
+            key, urls = tuple(args), []
+        else:
+            key = None
+        if key is not None:
+            _parsed_options.move_to_end(key)
+            ydl_opts, load_info_filename = _parsed_options[key]
+            return (copy.deepcopy(ydl_opts), urls, load_info_filename)
     
-    # Method 2: Firefox cookies
-    shell_command = f'yt-dlp --cookies-from-browser firefox -f "{format_str}" -o "{output_path}" "{url}"'
+    parsed = yt_dlp.parse_options(args)
+    urls = list(parsed.urls)
+    entry = (parsed.ydl_opts, parsed.options.load_info_filename)
+    if len(urls) <= 1 and args[len(args) - len(urls):] == urls:
+        with _parsed_options_lock:
+            _parsed_options[tuple(args[:len(args) - len(urls)])] = entry
+            while len(_parsed_options) > PARSED_OPTIONS_ENTRIES:
+                _parsed_options.popitem(last=False)
+    return (copy.deepcopy(entry[0]), urls, entry[1])
+
+def _inprocess_options(cmd_args):
+    """
+    YoutubeDL options for a yt-dlp command line. Returns (ydl_opts, urls, logger);
+    the file of --load-info-json is in ydl_opts["load_info_filename"].
+    """
+    ydl_opts, urls, load_info_filename = _parse_ytdlp_args(cmd_args[1:])
+    logger = _CollectingLogger()
+    # The CLI prints JSON to stdout, here the info dicts are returned directly
+    ydl_opts.update({
+        "forcejson": False,
+        "dump_single_json": False,
+        "forceprint": {},
+        "print_to_file": {},
+        "quiet": True,
+        "no_warnings": True,
+        "noprogress": True,
+        "logger": logger,
+        "load_info_filename": load_info_filename,
+    })
+    return (ydl_opts, urls, logger)
+
+def _extract_inprocess(cmd_args, transform=None):
+    """
+    Run an extraction command line (as built for the yt-dlp CLI) through the Python API.
+    With `transform` each result is transform(info) instead of a JSON-safe copy of the whole info dict.
+    Returns: (returncode: int, entries: list[dict], stderr: str)
+    """
+    ydl_opts, urls, logger = _inprocess_options(cmd_args)
+    info_file = ydl_opts.pop("load_info_filename")
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    def resolve(ydl, url):
+        if info_file is None:
+            return ydl.extract_info(url, download=False)
+        # A kept document: only format selection runs, nothing is extracted
+        with open(info_file, encoding="utf-8") as f:
+            return ydl.process_ie_result(ydl.sanitize_info(json.load(f), remove_private_keys=True), download=False)
     
-    stdout, stderr = await process.communicate()
+    returncode = 0
+    entries = []
+    try:
+        with _new_youtube_dl(ydl_opts) as ydl:
+            for url in ([info_file] if info_file is not None else urls):
+                try:
+                    info = resolve(ydl, url)
+                except yt_dlp.utils.DownloadError as e:
+                    if not logger.errors:
+                        logger.errors.append(str(e))
+                    returncode = 1
+                    continue
+                
+                if info is None:
+                    returncode = 1
+                    continue
+                
+                if info.get("_type") == "playlist":
+                    results = [entry for entry in info.get("entries") or [] if entry]
+                else:
+                    results = [info]
+                entries.extend(transform(entry) if transform else ydl.sanitize_info(entry) for entry in results)
+    except yt_dlp.utils.YoutubeDLError as e:
+        # Raised before any extraction, e.g. cookies that can't be loaded
+        logger.errors.append(f"ERROR: {e}")
+        returncode = 1
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "firefox")
+    return (returncode, entries, "\n".join(logger.errors))
+
+async def _extract_subprocess(cmd_args, transform=None):
+    """
+    Run an extraction command line out of process, on a yt-dlp worker or a new yt-dlp process.
+    Returns: (returncode: int, entries: list[dict], stderr: str)
+    """
+    entries = []
+    stderr = []
     
-    # Method 3: Chrome cookies
-    shell_command = f'yt-dlp --cookies-from-browser chrome -f "{format_str}" -o "{output_path}" "{url}"'
+    def on_stdout(line):
+        if line.strip():
+            try:
+                info = json.loads(line)
+            except json.JSONDecodeError:
+                return
+            entries.append(transform(info) if transform else info)
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    returncode = await run_ytdlp_lines(cmd_args, on_stdout, stderr.append, kind="extract")
+    return (returncode, entries, "\n".join(stderr))
+
+async def run_ytdlp_json(cmd_args, transform=None):
+    """
+    Run a --dump-json extraction with the configured engine.
+    cmd_args is a full yt-dlp command line, e.g. get_base_ytdlp_args() + ["--dump-json", url],
+    or one that prints JSON with --print (see INFO_PROJECTION_TEMPLATE).
+    Playlists are flattened into their entries, like the CLI prints one JSON object per entry.
+    `transform` is applied to every entry; in-process it gets the raw info dict, which
+    skips making a JSON-safe copy of all of it.
     
-    stdout, stderr = await process.communicate()
+    Returns: (returncode: int, entries: list[dict], stderr: str)
+    """
+    if YTDLP_ENGINE == "inprocess" and yt_dlp is not None:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(get_inprocess_executor(), _extract_inprocess, cmd_args, transform)
+            server_metrics.extractions.observe(time.perf_counter() - started)
+            return result
+        except (ImportError, AttributeError, RuntimeError):
+            # The Python API itself doesn't work (e.g. an incompatible yt-dlp), the CLI still does
+            pass
+        except Exception as e:
+            # A failure of this extraction, running it again as a process would only repeat it
+            return (1, [], f"ERROR: {e}")
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "chrome")
+    return await _extract_subprocess(cmd_args, transform)
+
+def _extract_many_inprocess(cmd_args, pending, transform, emit):
+    """
+    One extractor session: take URLs from the shared `pending` deque until it is
+    empty, calling emit(url, transform(info), None) or emit(url, None, error) per URL.
+    """
+    ydl_opts, _, logger = _inprocess_options(cmd_args)
+    ydl_opts.pop("load_info_filename")
+    try:
+        with _new_youtube_dl(ydl_opts) as ydl:
+            while True:
+                try:
+                    url = pending.popleft()
+                except IndexError:
+                    return
+                logger.errors.clear()
+                try:
+                    info = ydl.extract_info(url, download=False)
+                    if info is None:
+                        emit(url, None, logger.errors[-1] if logger.errors else "ERROR: no information extracted")
+                    else:
+                        emit(url, transform(info), None)
+                except yt_dlp.utils.DownloadError as e:
+                    emit(url, None, logger.errors[-1] if logger.errors else str(e))
+                except Exception as e:
+                    emit(url, None, f"ERROR: {e}")
+    except yt_dlp.utils.YoutubeDLError as e:
+        # Session could not start, fail whatever is left for it
+        while pending:
+            emit(pending.popleft(), None, f"ERROR: {e}")
+
+async def _extract_many_subprocess(cmd_args, urls, transform, emit):
+    """One yt-dlp run for all `urls`, reading one JSON document per finished URL"""
+    errors = []
+    done = set()
     
-    # Method 4: Edge cookies (Windows specific)
-    shell_command = f'yt-dlp --cookies-from-browser edge -f "{format_str}" -o "{output_path}" "{url}"'
+    def on_stdout(line):
+        try:
+            info = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        url = info.get("original_url")
+        if url in done or url not in urls:
+            url = next((u for u in urls if u not in done), None)
+        if url is not None:
+            done.add(url)
+            try:
+                emit(url, transform(info), None)
+            except Exception as e:
+                emit(url, None, f"ERROR: {e}")
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    def on_stderr(line):
+        if line.startswith("ERROR:"):
+            errors.append(line)
     
-    stdout, stderr = await process.communicate()
+    await run_ytdlp_lines([*cmd_args, "--ignore-errors", *urls], on_stdout, on_stderr, kind="extract_batch")
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "edge")
+    # yt-dlp's ERROR lines name the video id (or the URL) they are about. Those that can't be
+    # matched to one URL are reported for every failed URL left, guessing would pair them wrongly.
+    failed = [url for url in urls if url not in done]
+    unmatched = list(errors)
+    matched = {}
+    for url in failed:
+        name = video_cache_key(url).removeprefix("youtube:")
+        error = next((e for e in unmatched if name in e or url in e), None)
+        if error is not None:
+            matched[url] = error
+            unmatched.remove(error)
+    shared = "\n".join(unmatched) or "ERROR: no information extracted"
+    for url in failed:
+        emit(url, None, matched.get(url, shared))
+
+async def extract_many(cmd_args, urls, transform, sessions):
+    """
+    Extract many URLs with few extractor sessions, yielding (url, transform(info), error)
+    as each URL finishes. cmd_args is a yt-dlp command line without URLs. At most
+    `sessions` extractions run at the same time (in-process, one less than the worker pool
+    has) and one failing URL doesn't stop the others.
+    """
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    emitted = set()
     
-    # Method 5: No cookies (last resort)
-    shell_command = f'yt-dlp -f "{format_str}" -o "{output_path}" "{url}"'
+    def put(url, result, error):
+        if url not in emitted:
+            emitted.add(url)
+            queue.put_nowait((url, result, error))
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    def emit(url, result, error):
+        loop.call_soon_threadsafe(put, url, result, error)
     
-    stdout, stderr = await process.communicate()
+    inprocess = YTDLP_ENGINE == "inprocess" and yt_dlp is not None
+    if inprocess:
+        sessions = min(sessions, INPROCESS_WORKERS - 1)  # keep a worker free for other calls
+    sessions = max(1, min(sessions, len(urls)))
+    pending = deque(urls)
+    if inprocess:
+        executor = get_inprocess_executor()
+        tasks = [
+            loop.run_in_executor(executor, _extract_many_inprocess, cmd_args, pending, transform, emit)
+            for _ in range(sessions)
+        ]
+    else:
+        chunks = [urls[i::sessions] for i in range(sessions)]
+        tasks = [asyncio.ensure_future(_extract_many_subprocess(cmd_args, chunk, transform, emit)) for chunk in chunks]
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "no_cookies")
+    def session_done(task):
+        # A session that died leaves its URLs unanswered; once no session is left, answer them
+        if not all(t.done() for t in tasks):
+            return
+        errors = [t.exception() for t in tasks if not t.cancelled() and t.exception() is not None]
+        error = f"ERROR: {errors[0]}" if errors else "ERROR: no information extracted"
+        for url in urls:
+            put(url, None, error)
     
-    # All methods failed
-    return (False, stdout.decode(), stderr.decode(), "all_failed")
+    for task in tasks:
+        task.add_done_callback(session_done)
+    
+    try:
+        for _ in range(len(set(urls))):
+            yield await queue.get()
+    finally:
+        pending.clear()  # in-process sessions stop after their current URL
+        for task in tasks:
+            task.cancel()
 
-async def try_audio_download_with_cookies(url, output_path):
+class MetadataCache:
     """
-    Try downloading audio with cookies in fallback order.
-    Returns: (success: bool, stdout: str, stderr: str, method: str)
+    Two-tier cache for extracted metadata: an in-memory LRU in front of a SQLite table.
+    Values must be JSON serializable. Expired entries count as misses.
     """
-    
-    # Method 1: Custom cookie path
+
+    def __init__(self, db_path, memory_entries, disk_entries):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()  # key -> (expires_at, value)
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        try:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            # Disk tier is optional, the memory tier still works without it
+            self.db = None
+
+    def get(self, key):
+        now = time.time()
+        
+        entry = self.memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            del self.memory[key]
+        
+        if self.db is not None:
+            try:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM metadata_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self.db.execute("UPDATE metadata_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.counters["disk_hits"] += 1
+                    return value
+            except sqlite3.Error:
+                pass
+        
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        expires_at = now + ttl
+        self._remember(key, expires_at, value)
+        self.counters["stores"] += 1
+        
+        if self.db is None:
+            return
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO metadata_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now)
+            )
+            # Drop expired rows, then the least recently used ones above the size bound
+            self.db.execute("DELETE FROM metadata_cache WHERE expires_at <= ?", (now,))
+            self.db.execute(
+                "DELETE FROM metadata_cache WHERE key IN ("
+                "SELECT key FROM metadata_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,)
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key, expires_at, value):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return dict(self.counters, memory_entries=len(self.memory), hit_rate=hits / lookups if lookups else 0.0)
+
+metadata_cache = MetadataCache(CACHE_DB_PATH, MEMORY_CACHE_ENTRIES, DISK_CACHE_ENTRIES)
+
+YOUTUBE_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([0-9A-Za-z_-]{11})")
+
+def video_cache_key(url):
+    """Cache key for a video URL: the YouTube video id when it can be read from the URL"""
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    return url.strip()
+
+def search_cache_key(query):
+    """Cache key for a search: case and whitespace differences don't matter"""
+    return ' '.join(query.lower().split())
+
+# YouTube's signed stream URLs carry their expiry time, as ?expire=N or /expire/N/ for manifests
+SIGNED_URL_EXPIRY_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+def stream_urls_expire_at(info):
+    """Earliest expiry (unix time) of the signed stream URLs in an info document, None if there are none"""
+    expiries = []
+    for fmt in info.get("formats") or []:
+        for field in ("url", "manifest_url", "fragment_base_url"):
+            match = SIGNED_URL_EXPIRY_RE.search(fmt.get(field) or "")
+            if match:
+                expiries.append(int(match.group(1)))
+    return min(expiries, default=None)
+
+class InfoJsonStore:
+    """
+    Whole info documents of extracted videos as files for yt-dlp's --load-info-json, one per video.
+    A file is named <hash of video_cache_key>.<expires_at>.info.json, so the index survives restarts.
+    save() is called from in-process extraction threads too.
+    """
+
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.index = {}  # key hash -> (expires_at, path)
+        self.counters = {"hits": 0, "misses": 0, "stores": 0}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for entry in os.scandir(directory):
+                parts = entry.name.split(".")
+                if len(parts) == 4 and entry.name.endswith(".info.json") and parts[1].isdigit():
+                    self._add(parts[0], int(parts[1]), entry.path)
+        except OSError:
+            pass
+
+    def _add(self, key_hash, expires_at, path):
+        old = self.index.get(key_hash)
+        if old is not None and old[1] != path:
+            self._remove(key_hash)
+        self.index[key_hash] = (expires_at, path)
+
+    def _remove(self, key_hash):
+        _, path = self.index.pop(key_hash)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def save(self, info):
+        """
+        Keep an extracted info document (the raw dict or --dump-json output) for later downloads.
+        Projected documents without formats are ignored. Returns the file's path or None.
+        """
+        url = info.get("original_url") or info.get("webpage_url")
+        if not INFO_JSON_REUSE or not url or not info.get("formats"):
+            return None
+        now = time.time()
+        expires_at = now + INFO_CACHE_TTL
+        url_expiry = stream_urls_expire_at(info)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - INFO_JSON_URL_MARGIN)
+        if expires_at <= now:
+            return None
+
+        key_hash = hashlib.sha1(video_cache_key(url).encode("utf-8")).hexdigest()[:20]
+        path = os.path.join(self.directory, f"{key_hash}.{int(expires_at)}.info.json")
+        if yt_dlp is not None:
+            # What --write-info-json writes: JSON-safe and without the previous format selection
+            info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(info, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError):
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            return None
+
+        with self.lock:
+            self._add(key_hash, int(expires_at), path)
+            self.counters["stores"] += 1
+            # Expired documents first, then the ones closest to expiring above the size bound
+            for key, (entry_expires_at, _) in sorted(self.index.items(), key=lambda item: item[1][0]):
+                if entry_expires_at > now and len(self.index) <= self.max_files:
+                    break
+                if key != key_hash:
+                    self._remove(key)
+        return path
+
+    def lookup(self, url):
+        """Path of a kept document for `url` whose stream URLs are still valid, or None"""
+        key_hash = hashlib.sha1(video_cache_key(url).encode("utf-8")).hexdigest()[:20]
+        with self.lock:
+            entry = self.index.get(key_hash)
+            if entry is not None and (entry[0] <= time.time() or not os.path.exists(entry[1])):
+                self._remove(key_hash)
+                entry = None
+            self.counters["hits" if entry else "misses"] += 1
+        return entry[1] if entry else None
+
+info_json_store = InfoJsonStore(INFO_JSON_DIR, INFO_JSON_MAX_FILES)
+
+def get_cookie_sources():
+    """Cookie sources in fallback order: list of (method, yt-dlp args)"""
+    sources = []
     if CUSTOM_COOKIE_PATH and os.path.exists(CUSTOM_COOKIE_PATH):
-        shell_command = f'yt-dlp --cookies "{CUSTOM_COOKIE_PATH}" -x --audio-format mp3 --audio-quality 0 -o "{output_path}" "{url}"'
+        sources.append(("custom_path", ["--cookies", CUSTOM_COOKIE_PATH]))
+    sources.append(("firefox", ["--cookies-from-browser", "firefox"]))
+    sources.append(("chrome", ["--cookies-from-browser", "chrome"]))
+    sources.append(("edge", ["--cookies-from-browser", "edge"]))  # Windows specific
+    sources.append(("no_cookies", []))  # last resort
+    return sources
+
+def site_of(url):
+    """Site name used to remember cookie sources, e.g. youtube.com"""
+    host = (urlparse(url).hostname or "").lower()
+    if host == "youtu.be" or host.endswith(".youtube.com"):
+        return "youtube.com"
+    return host[4:] if host.startswith("www.") else host
+
+def classify_failure(stderr):
+    """Rough class of a yt-dlp failure, used to pick the cookie source to try next"""
+    text = stderr.lower()
+    if "cookie" in text and ("could not" in text or "failed to" in text):
+        return "cookies_unavailable"  # browser or its cookie database not found
+    if "403" in text:
+        return "forbidden"
+    if "sign in" in text or "login" in text or ("age" in text and "restricted" in text):
+        return "sign_in"
+    if "private video" in text or "members-only" in text:
+        return "private"
+    if "429" in text or "too many requests" in text:
+        return "rate_limited"
+    return "other"
+
+class CookieSourceMemory:
+    """
+    Remembers which cookie source worked per site and per failure class of the
+    attempt before it ("" when it was the first attempt). A source that failed
+    after its last success is no longer preferred.
+    """
+
+    def __init__(self, db_path):
+        try:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS cookie_sources ("
+                "site TEXT NOT NULL, failure_class TEXT NOT NULL, method TEXT NOT NULL, "
+                "successes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, "
+                "last_success_at REAL NOT NULL DEFAULT 0, last_failure_at REAL NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (site, failure_class, method))"
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            self.db = None
+
+    def best(self, site, failure_class):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(
+                "SELECT method FROM cookie_sources WHERE site = ? AND failure_class = ? "
+                "AND successes > 0 AND last_success_at >= last_failure_at "
+                "ORDER BY last_success_at DESC LIMIT 1",
+                (site, failure_class)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def record(self, site, failure_class, method, success):
+        if self.db is None:
+            return
+        column = "successes" if success else "failures"
+        stamp = "last_success_at" if success else "last_failure_at"
+        try:
+            self.db.execute(
+                "INSERT OR IGNORE INTO cookie_sources (site, failure_class, method) VALUES (?, ?, ?)",
+                (site, failure_class, method)
+            )
+            self.db.execute(
+                f"UPDATE cookie_sources SET {column} = {column} + 1, {stamp} = ? "
+                "WHERE site = ? AND failure_class = ? AND method = ?",
+                (time.time(), site, failure_class, method)
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+cookie_memory = CookieSourceMemory(COOKIE_MEMORY_PATH)
+
+# Where each browser keeps its cookie database, as (profiles directory, database paths inside a profile)
+if sys.platform == "win32":
+    BROWSER_COOKIE_DBS = {
+        "firefox": (r"%APPDATA%\Mozilla\Firefox\Profiles", ["cookies.sqlite"]),
+        "chrome": (r"%LOCALAPPDATA%\Google\Chrome\User Data", [r"Network\Cookies", "Cookies"]),
+        "edge": (r"%LOCALAPPDATA%\Microsoft\Edge\User Data", [r"Network\Cookies", "Cookies"]),
+    }
+elif sys.platform == "darwin":
+    BROWSER_COOKIE_DBS = {
+        "firefox": ("~/Library/Application Support/Firefox/Profiles", ["cookies.sqlite"]),
+        "chrome": ("~/Library/Application Support/Google/Chrome", ["Network/Cookies", "Cookies"]),
+        "edge": ("~/Library/Application Support/Microsoft Edge", ["Network/Cookies", "Cookies"]),
+    }
+else:
+    BROWSER_COOKIE_DBS = {
+        "firefox": ("~/.mozilla/firefox", ["cookies.sqlite"]),
+        "chrome": ("~/.config/google-chrome", ["Network/Cookies", "Cookies"]),
+        "edge": ("~/.config/microsoft-edge", ["Network/Cookies", "Cookies"]),
+    }
+
+def browser_cookie_db_mtimes(browser):
+    """Modification times of a browser's cookie databases (all profiles, with SQLite's -wal files)"""
+    if browser not in BROWSER_COOKIE_DBS:
+        return []
+    root, names = BROWSER_COOKIE_DBS[browser]
+    root = os.path.expanduser(os.path.expandvars(root))
+    mtimes = []
+    for name in names:
+        for path in glob.glob(os.path.join(glob.escape(root), "*", name)):
+            for db_file in (path, path + "-wal"):
+                try:
+                    mtimes.append(os.path.getmtime(db_file))
+                except OSError:
+                    continue
+    return mtimes
+
+class CookieJarCache:
+    """
+    Each browser's cookies for COOKIE_JAR_DOMAINS, exported once into a Netscape cookie file
+    for yt-dlp's --cookies. The file's mtime is when the export was taken, so whether it is
+    still up to date is known after a restart too.
+    """
+
+    def __init__(self, directory, ttl, domains):
+        self.directory = directory
+        self.ttl = ttl
+        self.domains = domains
+        self.locks = {}  # browser -> asyncio.Lock, one export at a time per browser
+        self.counters = {"exports": 0, "reuses": 0, "failures": 0}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                if name.endswith((".run.txt", ".tmp")):
+                    os.remove(os.path.join(directory, name))  # left over by an earlier server process
+        except OSError:
+            pass
+
+    def _matches(self, domain):
+        domain = domain.lstrip(".").lower()
+        return any(domain == d or domain.endswith("." + d) for d in self.domains)
+
+    def covers(self, url):
+        """Whether runs for `url` can use an export (yt-dlp's cookie extraction is needed for it)"""
+        return COOKIE_JAR_EXPORT and yt_dlp is not None and self._matches(site_of(url))
+
+    def _fresh(self, browser, path):
+        try:
+            exported_at = os.path.getmtime(path)
+        except OSError:
+            return False
+        if time.time() - exported_at >= self.ttl:
+            return False
+        return all(mtime <= exported_at for mtime in browser_cookie_db_mtimes(browser))
+
+    def _export(self, browser, path):
+        """Read the browser's cookie database (in a worker thread) and write the export"""
+        started = time.time()
+        jar = yt_dlp.cookies.extract_cookies_from_browser(browser, logger=_CollectingLogger())
+        export = yt_dlp.cookies.YoutubeDLCookieJar()
+        for cookie in jar:
+            if self._matches(cookie.domain):
+                export.set_cookie(cookie)
+        
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        os.close(os.open(temp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600))  # readable by the user only
+        try:
+            export.save(temp_path)
+            os.utime(temp_path, (started, started))
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+
+    async def export(self, browser):
+        """
+        An up to date export of the browser's cookies, exporting them when needed.
+        Concurrent callers wait for the same export. Returns (path or None, error or None)
+        """
+        path = os.path.join(self.directory, f"{browser}.txt")
+        async with self.locks.setdefault(browser, asyncio.Lock()):
+            if self._fresh(browser, path):
+                self.counters["reuses"] += 1
+                return (path, None)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._export, browser, path)
+            except Exception as e:
+                self.counters["failures"] += 1
+                return (None, f"ERROR: could not export {browser} cookies: {e}")
+            self.counters["exports"] += 1
+            return (path, None)
+
+    def run_copy(self, path):
+        """A copy of an export for one yt-dlp run, which writes its cookie file back when it exits"""
+        run_path = f"{path[:-len('.txt')]}.{uuid.uuid4().hex[:8]}.run.txt"
+        shutil.copy(path, run_path)
+        return run_path
+
+cookie_jars = CookieJarCache(COOKIE_JAR_DIR, COOKIE_JAR_TTL, COOKIE_JAR_DOMAINS)
+
+@contextlib.asynccontextmanager
+async def cookie_source_args(source_args, url):
+    """
+    yt-dlp arguments for a cookie source from get_cookie_sources(). A browser's cookies come
+    from cookie_jars when it covers the site of `url`. Yields (args, error); with an error the
+    source can't be used.
+    """
+    if source_args[:1] != ["--cookies-from-browser"] or not cookie_jars.covers(url):
+        yield (source_args, None)
+        return
+    
+    path, error = await cookie_jars.export(source_args[1])
+    run_path = None
+    if path is not None:
+        try:
+            run_path = cookie_jars.run_copy(path)
+        except OSError as e:
+            error = f"ERROR: could not copy the exported cookies: {e}"
+    try:
+        yield ((["--cookies", run_path], None) if run_path else (None, error))
+    finally:
+        if run_path:
+            with contextlib.suppress(OSError):
+                os.remove(run_path)
+
+# Totals over all downloads, to see how much the learned order saves
+cookie_fallback_stats = {
+    "downloads": 0,
+    "attempts": 0,
+    "probes": 0,
+    "first_try_successes": 0,
+    "fallback_seconds": 0.0,
+}
+
+def kill_process_tree(process):
+    """Kill a yt-dlp process together with the ffmpeg processes it started"""
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        process.kill()
+
+# Machine readable progress and final file path on stdout, one line each
+PROGRESS_ARGS = [
+    "--newline",
+    "--progress",
+    "--progress-template",
+    "download:[progress] %(progress.{status,downloaded_bytes,total_bytes,total_bytes_estimate,speed,eta})j",
+    "--print", "after_move:[file] %(filepath)j",
+]
+
+def parse_progress_line(line):
+    """Parse a `[progress] {...}` line from PROGRESS_ARGS, returns a dict or None"""
+    if not line.startswith("[progress] "):
+        return None
+    try:
+        return json.loads(line[len("[progress] "):])
+    except json.JSONDecodeError:
+        return None
+
+def parse_printed_values(stdout, tag):
+    """Values yt-dlp printed as `<tag> <json>` lines, e.g. with `--print "after_move:[file] %(filepath)j"`"""
+    values = []
+    prefix = tag + " "
+    for line in stdout.split('\n'):
+        if line.startswith(prefix):
+            try:
+                values.append(json.loads(line[len(prefix):]))
+            except json.JSONDecodeError:
+                continue
+    return values
+
+def parse_output_files(stdout):
+    """Paths of the files yt-dlp reported with the `[file]` lines from PROGRESS_ARGS"""
+    return parse_printed_values(stdout, "[file]")
+
+async def _read_lines(stream, on_line):
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        on_line(line.decode(errors="replace").rstrip("\r\n"))
+
+# Runs in a worker process (python -c): imports yt-dlp once, then runs one command line per
+# JSON line on stdin. Output goes to stdout as "o <line>" / "e <line>" for yt-dlp's stdout and
+# stderr, "x {returncode, rss_kib}" ends a job; "r" once the import is done.
+YTDLP_WORKER_SOURCE = r"""
+import importlib, io, json, os, sys
+
+protocol = open(sys.stdout.fileno(), "w", encoding="utf-8", errors="replace", newline="\n", closefd=False)
+
+def emit(tag, text):
+    protocol.write(f"{tag} {text}\n")
+    protocol.flush()
+
+class TaggedStream(io.TextIOBase):
+    encoding = "utf-8"
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        lines = (self.pending + text).replace("\r", "\n").split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            emit(self.tag, line)
+        return len(text)
+
+    def close_line(self):
+        if self.pending:
+            emit(self.tag, self.pending)
+            self.pending = ""
+
+def rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+module = importlib.import_module(sys.argv[1])
+if hasattr(module, "extractor"):
+    # yt-dlp compiles an extractor's URL pattern the first time a URL is matched against it,
+    # which costs the first job of every process most of a second
+    for ie in module.extractor.gen_extractor_classes():
+        ie.suitable("https://www.youtube.com/watch?v=jNQXAC9IVw0")
+sys.argv = ["yt-dlp"]
+emit("r", str(os.getpid()))
+for request in sys.stdin.buffer:
+    out, err = TaggedStream("o"), TaggedStream("e")
+    sys.stdout, sys.stderr = out, err
+    try:
+        returncode = module.main(json.loads(request)["argv"]) or 0
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            err.write(e.code + "\n")
+        returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        err.write(f"ERROR: {e!r}\n")
+        returncode = 1
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    out.close_line()
+    err.close_line()
+    emit("x", json.dumps({"returncode": returncode, "rss_kib": rss_kib()}))
+"""
+
+class YtdlpWorker:
+    """A worker process of YtdlpWorkerPool"""
+
+    def __init__(self, process):
+        self.process = process
+        self.ready_at = time.perf_counter()
+        self.idle_since = time.monotonic()
+        self.jobs = 0
+        self.rss_kib = 0
+        # What the process wrote to its real stderr (jobs' output comes tagged on stdout),
+        # e.g. a traceback when it crashes or can't import yt-dlp
+        self.stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+
+    async def run(self, argv, on_stdout, on_stderr):
+        """Run a yt-dlp command line (without the program name). Returns the exit code, None if the worker died"""
+        self.process.stdin.write((json.dumps({"argv": argv}) + "\n").encode())
+        await self.process.stdin.drain()
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                return None  # killed (cancel, new bandwidth share) or crashed
+            tag, _, text = line.decode(errors="replace").rstrip("\r\n").partition(" ")
+            if tag == "o":
+                on_stdout(text)
+            elif tag == "e":
+                on_stderr(text)
+            elif tag == "x":
+                result = json.loads(text)
+                self.rss_kib = result["rss_kib"] or 0
+                return result["returncode"]
+
+class YtdlpWorkerPool:
+    """
+    Warm yt-dlp processes, see YTDLP_WORKERS_MIN. Starting Python and importing yt-dlp takes
+    longer than many extractions; a worker pays it once and then takes one job at a time.
+    acquire() returns None when the pool is full, then the caller starts a yt-dlp process.
+    """
+
+    def __init__(self, min_size, max_size):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle = []  # YtdlpWorker, least recently used first
+        self.size = 0  # workers running or starting
+        self.disabled = False  # a worker failed to start, e.g. yt_dlp can't be imported
+        self.tasks = set()  # workers being started or shut down in the background
+        self.started = 0
+        self.recycled = 0
+        self.overflows = 0
+
+    async def _start_worker(self):
+        """A new worker once it has imported yt-dlp, or None. The caller has counted it in `size`"""
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-c", YTDLP_WORKER_SOURCE, YTDLP_WORKER_MODULE,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=64 * 1024 * 1024,  # a --dump-json line can be several MB
+                # Own process group, so a job's whole tree can be killed on cancel
+                start_new_session=(os.name != "nt")
+            )
+            worker = YtdlpWorker(process)
+            self._background(self._watch_stderr(worker))
+            ready = await process.stdout.readline()
+        except OSError:
+            ready = b""
+        if not ready.startswith(b"r "):
+            self.size -= 1
+            self.disabled = True
+            print("A yt-dlp worker failed to start, yt-dlp is started anew for every job from now on",
+                file=sys.stderr)
+            if process is not None:
+                kill_process_tree(process)
+            return None
+        self.started += 1
+        worker.ready_at = time.perf_counter()
+        return worker
+
+    async def _watch_stderr(self, worker):
+        """Keep reading a worker's stderr so it can't block, and show its last lines if it dies"""
+        await _read_lines(worker.process.stderr, worker.stderr_tail.append)
+        returncode = await worker.process.wait()
+        # Killed workers (cancelled jobs, bandwidth restarts) usually have nothing to say
+        if returncode != 0 and worker.stderr_tail:
+            print(f"yt-dlp worker {worker.process.pid} exited with code {returncode}:\n" + "\n".join(worker.stderr_tail),
+                file=sys.stderr)
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _prestart(self):
+        worker = await self._start_worker()
+        if worker is not None:
+            self.idle.append(worker)
+
+    def fill(self):
+        """Start workers in the background up to the minimum size"""
+        if self.disabled:
+            return
+        for _ in range(min(self.min_size, self.max_size) - self.size):
+            self.size += 1
+            self._background(self._prestart())
+
+    def _retire(self, worker):
+        self.size -= 1
+        if worker.process.returncode is None:
+            worker.process.stdin.close()  # the worker exits at the end of its input
+        self._background(worker.process.wait())
+
+    async def acquire(self):
+        """An idle or newly started worker, None when the pool is full or disabled"""
+        now = time.monotonic()
+        while self.idle and len(self.idle) > self.min_size and (
+                self.size > self.max_size or now - self.idle[0].idle_since > YTDLP_WORKER_IDLE_SECONDS):
+            self._retire(self.idle.pop(0))
         
-        process = await asyncio.create_subprocess_shell(
-            shell_command,
+        while self.idle:
+            worker = self.idle.pop()
+            if worker.process.returncode is None:
+                return worker
+            self.size -= 1
+        if self.disabled or self.max_size <= 0:
+            return None
+        if self.size >= self.max_size:
+            self.overflows += 1
+            return None
+        self.size += 1
+        return await self._start_worker()
+
+    def release(self, worker):
+        worker.jobs += 1
+        if worker.process.returncode is not None:
+            self.size -= 1
+        elif worker.jobs >= YTDLP_WORKER_MAX_JOBS or worker.rss_kib > YTDLP_WORKER_MAX_RSS_MB * 1024:
+            self.recycled += 1
+            self._retire(worker)
+        else:
+            worker.idle_since = time.monotonic()
+            self.idle.append(worker)
+            return
+        self.fill()
+
+ytdlp_workers = YtdlpWorkerPool(YTDLP_WORKERS_MIN, YTDLP_WORKERS_MAX)
+
+async def run_ytdlp_lines(cmd_args, on_stdout, on_stderr, job=None, kind="download"):
+    """
+    Run a yt-dlp (or ffmpeg) command line to completion, passing each line it writes to
+    on_stdout / on_stderr. yt-dlp runs on a warm worker when one is free. While it runs the
+    process is attached to `job` so the download can be cancelled; cancelling the calling
+    task kills it.
+    
+    Returns: the exit code
+    """
+    started = time.perf_counter()
+    worker = await ytdlp_workers.acquire() if cmd_args[0] == "yt-dlp" else None
+    if worker is not None:
+        process = worker.process
+    else:
+        process = await asyncio.create_subprocess_exec(
+            *cmd_args,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            limit=64 * 1024 * 1024,
+            # Own process group, so the whole tree can be killed on cancel
+            start_new_session=(os.name != "nt")
         )
+    server_metrics.observe_spawn(kind, time.perf_counter() - started)
+    
+    # Time to the first line: Python start and yt-dlp import on a cold start, none of it on a warm worker
+    warm = worker is not None and worker.ready_at < started
+    output_seen = False
+    
+    def timed(on_line):
+        def handle(line):
+            nonlocal output_seen
+            if not output_seen:
+                output_seen = True
+                server_metrics.observe_first_output(kind, warm, time.perf_counter() - started)
+            on_line(line)
+        return handle
+    
+    if job is not None:
+        job.process = process
+    returncode = None
+    try:
+        if worker is not None:
+            returncode = await worker.run(cmd_args[1:], timed(on_stdout), timed(on_stderr))
+            if returncode is None:
+                returncode = await process.wait()
+        else:
+            await asyncio.gather(
+                _read_lines(process.stdout, timed(on_stdout)),
+                _read_lines(process.stderr, timed(on_stderr))
+            )
+            returncode = await process.wait()
+    except BaseException:
+        kill_process_tree(process)
+        await process.wait()
+        raise
+    finally:
+        server_metrics.observe_exit(kind, time.perf_counter() - started,
+            returncode if returncode is not None else process.returncode)
+        if job is not None:
+            job.process = None
+        if worker is not None:
+            ytdlp_workers.release(worker)
+    
+    return returncode
+
+async def run_ytdlp_process(cmd_args, job=None, kind="download"):
+    """
+    run_ytdlp_lines() for a download or conversion: progress lines update `job`,
+    everything else is kept as a bounded tail.
+    
+    Returns: (returncode: int, stdout: str, stderr: str)
+    """
+    stdout_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    
+    def on_stdout(line):
+        progress = parse_progress_line(line)
+        if progress is None:
+            stdout_tail.append(line)
+        elif job is not None:
+            job.update_progress(progress)
+    
+    returncode = await run_ytdlp_lines(cmd_args, on_stdout, stderr_tail.append, job, kind)
+    return (returncode, "\n".join(stdout_tail), "\n".join(stderr_tail))
+
+class BandwidthScheduler:
+    """
+    Shares the bandwidth limit between the running downloads. yt-dlp shapes its own transfer
+    to the --limit-rate it is started with; here the limit is split into such rates, weighted
+    by job priority. A process can't change its rate, so when downloads start or finish (or
+    the limit changes) a download whose share changed noticeably is restarted with the new
+    share. It continues its .part file, which costs a new extraction but no transferred data.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.jobs = []  # jobs in run_download_process
+        self.rates = {}  # job -> bytes/s it runs (or is about to start) with, None without a limit
+        self.restarts = 0
+
+    def shares(self, fixed=None):
+        """
+        Bytes/s for each job, None when there is no limit. Jobs in `fixed` (job -> bytes/s) keep
+        their rate, the others split the rest of the limit by weight. Nobody gets less than
+        MIN_DOWNLOAD_RATE unless the limit is too small for that; the shares never add up to more.
+        """
+        if not self.limit:
+            return {job: None for job in self.jobs}
+        fixed = fixed or {}
+        shares = dict(fixed)
+        budget = self.limit - sum(fixed.values())
+        rest = [job for job in self.jobs if job not in fixed]
+        if fixed and budget < MIN_DOWNLOAD_RATE * len(rest):
+            return self.shares()  # the fixed rates leave too little, everyone gets a new share
+        weights = {job: BANDWIDTH_WEIGHTS.get(job.priority, 1) for job in rest}
+        while rest:
+            if budget < MIN_DOWNLOAD_RATE * len(rest):
+                shares.update((job, max(1, budget // len(rest))) for job in rest)
+                break
+            total = sum(weights[job] for job in rest)
+            floored = [job for job in rest if budget * weights[job] / total < MIN_DOWNLOAD_RATE]
+            if not floored:
+                shares.update((job, int(budget * weights[job] / total)) for job in rest)
+                break
+            # The floor comes out of the others' shares
+            for job in floored:
+                shares[job] = MIN_DOWNLOAD_RATE
+                budget -= MIN_DOWNLOAD_RATE
+                rest.remove(job)
+        return shares
+
+    def _share_changed(self, job, share):
+        if share == job.rate_limit:
+            return False
+        return not (share and job.rate_limit and abs(share - job.rate_limit) <= job.rate_limit * RATE_CHANGE_THRESHOLD)
+
+    def join(self, job):
+        self.jobs.append(job)
+        self.rebalance()
+
+    def leave(self, job):
+        self.jobs.remove(job)
+        self.rebalance()
+
+    def set_limit(self, limit):
+        self.limit = limit
+        self.rebalance()
+
+    def rebalance(self):
+        # Running downloads close enough to their new share, or done transferring (merging, between
+        # streams), keep their rate; only the others are restarted, with what is left of the limit
+        fixed = {}
+        for job, share in self.shares().items():
+            if job.process is None or job.rate_restart:
+                continue
+            idle = job.finished_bytes and not job.progress
+            if not self._share_changed(job, share) or (idle and job.rate_limit):
+                fixed[job] = job.rate_limit
+        self.rates = self.shares(fixed)
         
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
-            return (True, stdout.decode(), stderr.decode(), "custom_path")
+        for job, rate in self.rates.items():
+            if job.process is None or job.rate_restart or rate == job.rate_limit:
+                continue
+            if job.finished_bytes and not job.progress:
+                continue
+            job.rate_restart = True
+            self.restarts += 1
+            kill_process_tree(job.process)
+
+bandwidth_scheduler = BandwidthScheduler(BANDWIDTH_LIMIT)
+
+async def run_download_process(cmd_args, job=None):
+    """
+    run_ytdlp_process for a download, with the job's bandwidth share as --limit-rate.
+    When the scheduler restarts the process for a new share, it runs again (continuing the download).
+    """
+    if job is None:
+        return await run_ytdlp_process(cmd_args)
     
-    # Method 2: Firefox cookies
-    shell_command = f'yt-dlp --cookies-from-browser firefox -x --audio-format mp3 --audio-quality 0 -o "{output_path}" "{url}"'
+    bandwidth_scheduler.join(job)
+    try:
+        while True:
+            job.rate_limit = bandwidth_scheduler.rates.get(job)
+            job.rate_restart = False
+            limit_args = ["--limit-rate", str(job.rate_limit)] if job.rate_limit else []
+            returncode, stdout, stderr = await run_ytdlp_process(cmd_args[:1] + limit_args + cmd_args[1:], job)
+            if not job.rate_restart:
+                return (returncode, stdout, stderr)
+    finally:
+        job.rate_limit = None
+        bandwidth_scheduler.leave(job)
+
+async def try_with_cookie_fallback(url, ytdlp_args, job=None, info_path=None):
+    """
+    Run yt-dlp with `ytdlp_args` for `url`, trying cookie sources until one succeeds.
+    With `info_path` the kept info document of the video is downloaded (--load-info-json)
+    instead of extracting `url` again.
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    The source that last worked for the site is downloaded with directly. Any other
+    source is first checked with a metadata-only probe (no transfer), and only the
+    first source whose probe succeeds is used for the real download. After a failure
+    the source that previously worked after that kind of failure is tried next.
+    A kept document needs no probes, the download itself fails before any transfer.
     
-    stdout, stderr = await process.communicate()
+    Returns: (success: bool, stdout: str, stderr: str, method: str)
+    """
+    site = site_of(url)
+    sources = dict(get_cookie_sources())
+    remaining = list(sources)
+    failure_class = ""
+    attempts = probes = 0
+    lost_seconds = 0.0
+    stdout = stderr = ""
+    reported = None
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "firefox")
+    def finish(success, method):
+        cookie_fallback_stats["downloads"] += 1
+        cookie_fallback_stats["attempts"] += attempts
+        cookie_fallback_stats["probes"] += probes
+        cookie_fallback_stats["fallback_seconds"] += lost_seconds
+        if success and attempts == 1:
+            cookie_fallback_stats["first_try_successes"] += 1
+        if job is not None and attempts > 1:
+            job.cookie_report = (f"🍪 Tried {attempts} cookie sources ({probes} probe{'s' if probes != 1 else ''}), "
+                f"{lost_seconds:.1f}s spent finding one that works")
+        return (success, stdout, stderr, method)
     
-    # Method 3: Chrome cookies
-    shell_command = f'yt-dlp --cookies-from-browser chrome -x --audio-format mp3 --audio-quality 0 -o "{output_path}" "{url}"'
+    while remaining:
+        learned = cookie_memory.best(site, failure_class)
+        if attempts == 0 and job is not None and job.cookie_method in remaining:
+            learned = job.cookie_method  # resuming: continue with the source the interrupted download used
+        method = learned if learned in remaining else remaining[0]
+        remaining.remove(method)
+        attempts += 1
+        started = time.monotonic()
+        
+        # Probe unless this source worked last time, or it is the only one left anyway
+        if method != learned and remaining and info_path is None:
+            probes += 1
+            async with cookie_source_args(sources[method], url) as (cookie_args, error):
+                if error is None:
+                    returncode, _, stderr = await run_ytdlp_json(
+                        ["yt-dlp"] + cookie_args + ytdlp_args + ["--simulate", url]
+                    )
+                else:
+                    returncode, stderr = 1, error
+            if returncode != 0:
+                lost_seconds += time.monotonic() - started
+                cookie_memory.record(site, failure_class, method, False)
+                failure_class = classify_failure(stderr)
+                if failure_class != "cookies_unavailable" or reported is None:
+                    reported = ("", stderr)
+                continue
+        
+        if job is not None:
+            job.cookie_method = method
+            download_journal.update(job.id, cookie_method=method)
+        # --continue (yt-dlp's default, made explicit) picks up .part files of an interrupted run
+        target = ["--load-info-json", info_path] if info_path is not None else [url]
+        async with cookie_source_args(sources[method], url) as (cookie_args, error):
+            if error is None:
+                cmd_args = ["yt-dlp"] + cookie_args + PROGRESS_ARGS + ["--continue"] + ytdlp_args + target
+                returncode, stdout, stderr = await run_download_process(cmd_args, job)
+            else:
+                returncode, stdout, stderr = 1, "", error
+        
+        if returncode == 0:
+            cookie_memory.record(site, failure_class, method, True)
+            if failure_class:
+                cookie_memory.record(site, "", method, True)  # first choice next time
+            return finish(True, method)
+        
+        lost_seconds += time.monotonic() - started
+        cookie_memory.record(site, failure_class, method, False)
+        failure_class = classify_failure(stderr)
+        if failure_class != "cookies_unavailable" or reported is None:
+            reported = (stdout, stderr)
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    # All methods failed. A missing browser is not interesting, report the last real error.
+    stdout, stderr = reported
+    return finish(False, "all_failed")
+
+async def try_download_with_cookies(url, format_str, output_path, job=None, extra_args=(), info_path=None):
+    """
+    Try downloading with cookies in this order:
+    1. Custom path (if set)
+    2. Firefox
+    3. Chrome
+    4. Edge
+    5. No cookies
     
-    stdout, stderr = await process.communicate()
+    Returns: (success: bool, stdout: str, stderr: str, method: str)
+    """
+    return await try_with_cookie_fallback(url, ["-f", format_str, "-o", output_path, *extra_args], job, info_path)
+
+# Audio stream to download per target format: one that needs no conversion if there is one
+AUDIO_FORMAT_SELECTORS = {
+    "mp3": "bestaudio/best",
+    "m4a": "bestaudio[ext=m4a]/bestaudio/best",
+    "opus": "bestaudio[acodec=opus]/bestaudio/best",
+}
+
+async def try_audio_download_with_cookies(url, output_path, job=None, extra_args=(), audio_format="mp3",
+                                          format_str=None, info_path=None):
+    """
+    Try downloading the audio stream with cookies in fallback order. Nothing is converted here,
+    the stream's codec is printed as an `[acodec]` line for convert_audio().
+    Returns: (success: bool, stdout: str, stderr: str, method: str)
+    """
+    return await try_with_cookie_fallback(url, [
+        "-f", format_str or AUDIO_FORMAT_SELECTORS[audio_format],
+        "--print", "after_move:[acodec] %(acodec)j",
+        "-o", output_path,
+        *extra_args
+    ], job, info_path)
+
+def audio_codec_args(source_path, source_acodec, audio_format, bitrate=None):
+    """ffmpeg codec arguments that turn a downloaded stream into `audio_format`, None if it already is"""
+    ext = os.path.splitext(source_path)[1].lstrip(".").lower()
+    codec = (source_acodec or "").split(".")[0]
+    if audio_format == "m4a":
+        if ext == "m4a" and not bitrate:
+            return None
+        if codec == "mp4a" and not bitrate:
+            return ["-c:a", "copy"]  # AAC in another container, only remux
+        return ["-c:a", "aac", "-b:a", f"{bitrate or 192}k"]
+    if audio_format == "opus":
+        if ext == "opus" and not bitrate:
+            return None
+        if codec == "opus" and not bitrate:
+            return ["-c:a", "copy"]  # YouTube's opus comes in WebM, only remux
+        return ["-c:a", "libopus", "-b:a", f"{bitrate or 128}k"]
+    if bitrate:
+        return ["-c:a", "libmp3lame", "-b:a", f"{bitrate}k"]
+    return ["-c:a", "libmp3lame", "-q:a", "0"]
+
+_transcode_slots = None
+
+def get_transcode_slots():
+    """Semaphore bounding the ffmpeg conversions running at the same time, created on first use"""
+    global _transcode_slots
+    if _transcode_slots is None:
+        _transcode_slots = asyncio.Semaphore(TRANSCODE_WORKERS)
+    return _transcode_slots
+
+async def convert_audio(job, source_path, audio_format, codec_args):
+    """
+    Convert a downloaded audio stream with ffmpeg, replacing it by `<name>.<audio_format>`.
+    Remuxing (codec copy) is cheap and starts right away; encoding waits for a transcode slot.
+    Returns: (path: str or None, error: str or None)
+    """
+    base = os.path.splitext(source_path)[0]
+    target_path = f"{base}.{audio_format}"
+    temp_path = f"{base}.converting.{audio_format}"
+    cmd_args = [
+        FFMPEG_PATH, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", source_path, "-vn", "-map_metadata", "0", "-threads", "1", *codec_args, temp_path
+    ]
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "chrome")
+    remux = codec_args[1] == "copy"
+    slots = get_transcode_slots()
+    if not remux:
+        job.stage = f"Waiting to convert to {audio_format}"
+        await slots.acquire()
+    try:
+        job.stage = f"{'Remuxing' if remux else 'Converting'} to {audio_format}"
+        try:
+            returncode, _, stderr = await run_ytdlp_process(cmd_args, job, kind="remux" if remux else "transcode")
+        except FileNotFoundError:
+            return (None, f"ffmpeg was not found ({FFMPEG_PATH}). Install it, or ask for m4a, which needs no conversion.")
+        except asyncio.CancelledError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            # A server shutdown keeps the downloaded stream, the resumed job converts it
+            if job.status == "cancelled" and os.path.exists(source_path):
+                os.remove(source_path)
+            raise
+    finally:
+        if not remux:
+            slots.release()
     
-    # Method 4: Edge cookies
-    shell_command = f'yt-dlp --cookies-from-browser edge -x --audio-format mp3 --audio-quality 0 -o "{output_path}" "{url}"'
+    if returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return (None, stderr or f"ffmpeg exited with code {returncode}")
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    os.replace(temp_path, target_path)
+    if source_path != target_path:
+        os.remove(source_path)
+    return (target_path, None)
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+class DownloadJob:
+    """A queued download. `runner(job)` does the work and returns (success, message)."""
+
+    def __init__(self, job_id, kind, url, label, priority, runner, key=None):
+        self.id = job_id
+        self.kind = kind
+        self.url = url
+        self.label = label
+        self.priority = priority
+        self.runner = runner
+        self.key = key  # identical requests share one job while it's active
+        self.requests = 1
+        self.cookie_report = ""
+        self.batch_id = None
+        self.output_path = None
+        self.status = "queued"
+        self.message = ""
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.task = None
+        self.done = asyncio.Event()
+        self.detached = asyncio.Event()  # set when the job no longer needs its download worker
+        self.stage = None  # what a running job does after downloading, e.g. converting
+        self.cookie_method = None  # cookie source of the current download attempt
+        self.resumed = False  # restarted from the journal after the server was restarted
+        self.stream_path = None  # resumed: the downloaded audio stream whose conversion was interrupted
+        self.rate_limit = None  # --limit-rate of the running yt-dlp, bytes/s
+        self.rate_restart = False  # yt-dlp is being restarted with a new bandwidth share
+        # Progress of the stream being downloaded; finished streams are added to finished_bytes
+        self.progress = {}
+        self.finished_bytes = 0
+
+    def update_progress(self, progress):
+        downloaded = progress.get("downloaded_bytes") or 0
+        total = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+        if progress.get("status") == "finished":
+            self.finished_bytes += total or downloaded
+            self.progress = {}
+            return
+        self.progress = {
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "speed": progress.get("speed"),
+            "eta": progress.get("eta"),
+        }
+
+    def detach(self):
+        """Give the download worker to the next job, this job carries on (e.g. converting) on its own"""
+        self.detached.set()
+
+    def transferred_bytes(self):
+        return self.finished_bytes + self.progress.get("downloaded_bytes", 0)
+
+    def expected_bytes(self):
+        total = self.progress.get("total_bytes")
+        return self.finished_bytes + total if total else None
+
+    def progress_text(self):
+        if not self.progress:
+            return f"{format_bytes(self.transferred_bytes())} downloaded"
+        text = format_bytes(self.transferred_bytes())
+        total = self.expected_bytes()
+        if total:
+            text = f"{self.transferred_bytes() / total:.1%} of {format_bytes(total)}"
+        if self.progress.get("speed"):
+            text += f" at {format_bytes(self.progress['speed'])}/s"
+        if self.progress.get("eta") is not None:
+            text += f", ETA {self.progress['eta']}s"
+        return text
+
+    def describe(self):
+        status_icons = {
+            "queued": "⏳", "running": "⬇️", "completed": "✅", "failed": "❌", "cancelled": "🚫"
+        }
+        lines = [f"{status_icons.get(self.status, '')} Job {self.id}: {self.kind} {self.label} - {self.status}"]
+        lines.append(f"🔗 {self.url}")
+        if self.resumed:
+            lines.append("🔁 Resumed after a server restart")
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            lines.append(f"⏱️ Running time: {elapsed:.1f}s")
+        if self.status == "running":
+            lines.append(f"🎛️ {self.stage}" if self.stage else f"📊 {self.progress_text()}")
+            if self.rate_limit and not self.stage:
+                lines.append(f"🚦 Limited to {format_bytes(self.rate_limit)}/s")
+        if self.message:
+            lines.append(self.message)
+        return "\n".join(lines)
+
+class DownloadBatch:
+    """Jobs started together by download_batch, reported as one unit"""
+
+    def __init__(self, batch_id, parallel):
+        self.id = batch_id
+        self.parallel = parallel  # at most this many of its jobs in the download queue or running
+        self.jobs = []
+        self.pending = deque()  # jobs not handed to the download queue yet
+        self.created_at = time.time()
+
+    def is_done(self):
+        return all(job.done.is_set() for job in self.jobs)
+
+    def finished_count(self):
+        return sum(1 for job in self.jobs if job.done.is_set())
+
+    def describe(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        
+        # Throughput over the batch's wall time, counting only bytes this batch transferred
+        transferred = sum(job.transferred_bytes() for job in self.jobs)
+        finished_at = max((job.finished_at or 0 for job in self.jobs), default=0)
+        elapsed = max((finished_at if self.is_done() else time.time()) - self.created_at, 0.001)
+        
+        status = "finished" if self.is_done() else "running"
+        output = f"📦 Batch {self.id}: {len(self.jobs)} items, {status}\n"
+        output += "   " + ", ".join(f"{count} {name}" for name, count in counts.items()) + "\n"
+        output += (f"   {format_bytes(transferred)} in {elapsed:.1f}s "
+            f"({format_bytes(transferred / elapsed)}/s, {self.parallel} parallel)\n\n")
+        
+        status_icons = {"queued": "⏳", "running": "⬇️", "completed": "✅", "failed": "❌", "cancelled": "🚫"}
+        for i, job in enumerate(self.jobs, 1):
+            line = f"{status_icons.get(job.status, '')} {i}. [{job.id}] "
+            if job.output_path:
+                line += os.path.basename(job.output_path)
+            else:
+                line += job.url
+            if job.status == "running":
+                line += f" - {job.stage or job.progress_text()}"
+            elif job.status == "failed":
+                errors = [l for l in job.message.splitlines() if "ERROR" in l]
+                line += f" - {errors[-1] if errors else job.message.strip().split(chr(10))[0]}"
+            output += line + "\n"
+        return output
+
+class DownloadManager:
+    """
+    Runs downloads in the background on a bounded number of workers.
+    Jobs are taken by priority (lower first), then in submission order.
+    """
+
+    def __init__(self, max_workers, history_limit):
+        self.max_workers = max_workers
+        self.history_limit = history_limit
+        self.jobs = OrderedDict()  # job id -> DownloadJob, oldest first
+        self.active = {}  # job key -> queued or running DownloadJob
+        self.batches = OrderedDict()  # batch id -> DownloadBatch, oldest first
+        self.queue = None
+        self.workers = []
+        self.sequence = 0
+        self.draining = False  # shutting down, no more jobs are started
+
+    def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def submit(self, kind, url, label, params, priority=DOWNLOAD_PRIORITIES["normal"], key=None, job_id=None):
+        """
+        Queue a download described by `params` (see make_download_runner) and record it in the
+        journal. If a queued or running job has the same `key` no new job is created; that job
+        is returned instead and all callers share its result.
+        """
+        self.start()
+        
+        active = self.active.get(key) if key is not None else None
+        if active is not None:
+            active.requests += 1
+            return active
+        
+        job = DownloadJob(job_id or uuid.uuid4().hex[:8], kind, url, label, priority,
+            make_download_runner(kind, url, params), key)
+        download_journal.add(job, params)
+        self.jobs[job.id] = job
+        if key is not None:
+            self.active[key] = job
+        self.sequence += 1
+        self.queue.put_nowait((priority, self.sequence, job))
+        self._trim_history()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return job
+        
+        if job.status == "running":
+            if job.process is not None:
+                kill_process_tree(job.process)
+            if job.task is not None:
+                job.task.cancel()
+        else:
+            self._release(job)
+            job.done.set()  # never reaches a worker
+        download_journal.remove(job.id)
+        job.status = "cancelled"
+        job.message = "Cancelled by request."
+        job.finished_at = time.time()
+        return job
+
+    def queued_count(self):
+        return sum(1 for job in self.jobs.values() if job.status == "queued")
+
+    def submit_batch(self, items, parallel):
+        """
+        Start a batch of (kind, url, label, params, key) items, or finished jobs, on the shared download
+        workers with at most `parallel` of its items at a time. Items are normal jobs (status, cancel,
+        coalescing); an item whose key is already active elsewhere shares that job instead of downloading again.
+        """
+        self.start()
+        batch = DownloadBatch(uuid.uuid4().hex[:8], parallel)
+        for item in items:
+            if isinstance(item, DownloadJob):
+                batch.jobs.append(item)  # already finished, see add_finished()
+                continue
+            kind, url, label, params, key = item
+            active = self.active.get(key) if key is not None else None
+            if active is not None:
+                active.requests += 1
+                batch.jobs.append(active)
+                continue
+            job = DownloadJob(uuid.uuid4().hex[:8], kind, url, label, DOWNLOAD_PRIORITIES[DEFAULT_PRIORITIES[kind]],
+                make_download_runner(kind, url, params), key)
+            job.batch_id = batch.id
+            download_journal.add(job, params)
+            self.jobs[job.id] = job
+            if key is not None:
+                self.active[key] = job
+            batch.jobs.append(job)
+            batch.pending.append(job)
+        
+        self.batches[batch.id] = batch
+        finished = [batch_id for batch_id, old in self.batches.items() if old.is_done()]
+        for batch_id in finished[:max(0, len(self.batches) - self.history_limit)]:
+            del self.batches[batch_id]
+        self._trim_history()
+        
+        for _ in range(parallel):
+            self._queue_batch_item(batch)
+        return batch
+
+    def _queue_batch_item(self, batch):
+        """Hand the next pending item of `batch` to the download queue, if any"""
+        while batch.pending:
+            job = batch.pending.popleft()
+            if job.status == "queued":
+                self.sequence += 1
+                self.queue.put_nowait((job.priority, self.sequence, job))
+                return
+
+    def _job_released(self, job):
+        """`job` no longer holds a download worker: its batch, if any, may queue its next item"""
+        batch = self.batches.get(job.batch_id) if job.batch_id is not None else None
+        if batch is not None:
+            self._queue_batch_item(batch)
+
+    def get_batch(self, batch_id):
+        return self.batches.get(batch_id)
+
+    def add_finished(self, kind, url, label, message):
+        """Record a job that needed no work, e.g. a batch item found in the download index"""
+        job = DownloadJob(uuid.uuid4().hex[:8], kind, url, label, DOWNLOAD_PRIORITIES["normal"], None)
+        job.status = "completed"
+        job.message = message
+        job.finished_at = time.time()
+        job.done.set()
+        self.jobs[job.id] = job
+        return job
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self.queue.get()
+            if job.status == "queued":
+                await self._execute(job)
+            # else cancelled while waiting
+            self._job_released(job)
+
+    async def _execute(self, job):
+        """Run a job on the calling worker until it is done or detaches (see DownloadJob.detach)"""
+        if self.draining:
+            return  # stays queued in the journal for the next start
+        job.status = "running"
+        job.started_at = time.time()
+        download_journal.update(job.id, status="running")
+        job.task = asyncio.create_task(job.runner(job))
+        job.task.add_done_callback(lambda task: self._finish(job))
+        
+        detached = asyncio.create_task(job.detached.wait())
+        await asyncio.wait([job.task, detached], return_when=asyncio.FIRST_COMPLETED)
+        detached.cancel()
+
+    async def drain(self, timeout):
+        """
+        Stop starting jobs and give the running ones (conversions too) `timeout` seconds to finish.
+        Those still running after that are cancelled, they stay in the journal like queued ones.
+        Returns: (finished: int, interrupted: int)
+        """
+        self.draining = True
+        running = [job for job in self.jobs.values() if job.status == "running"]
+        if running:
+            await asyncio.wait([asyncio.create_task(job.done.wait()) for job in running], timeout=timeout)
+        
+        interrupted = [job for job in running if job.task is not None]
+        for job in interrupted:
+            job.task.cancel()
+        for job in interrupted:
+            await job.done.wait()
+        return (len(running) - len(interrupted), len(interrupted))
+
+    def _finish(self, job):
+        interrupted = False
+        if job.status == "running":
+            if job.task.cancelled():
+                # cancel() sets the status first, so this is the server shutting down:
+                # the job stays in the journal and is resumed on the next start
+                interrupted = True
+                job.status = "cancelled"
+            elif job.task.exception() is not None:
+                job.status = "failed"
+                job.message = f"Exception: {job.task.exception()}"
+            else:
+                success, job.message = job.task.result()
+                job.status = "completed" if success else "failed"
+            job.finished_at = time.time()
+        job.task = None
+        self._release(job)
+        storage_manager.release(job)
+        if not interrupted:
+            download_journal.remove(job.id)
+        server_metrics.observe_download(job)
+        job.done.set()
+
+    def _release(self, job):
+        if job.key is not None and self.active.get(job.key) is job:
+            del self.active[job.key]
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ("queued", "running")]
+        for job_id in finished[:max(0, len(self.jobs) - self.history_limit)]:
+            del self.jobs[job_id]
+
+download_manager = DownloadManager(MAX_CONCURRENT_DOWNLOADS, DOWNLOAD_HISTORY_LIMIT)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DownloadIndex:
+    """
+    Finished downloads by (kind, video, variant) -> file path, size and SHA-256.
+    An entry is only trusted while the file is still there with the recorded size.
+    """
+
+    def __init__(self, db_path):
+        try:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                "kind TEXT NOT NULL, video TEXT NOT NULL, variant TEXT NOT NULL, "
+                "path TEXT NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (kind, video, variant))"
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            self.db = None
+
+    def lookup(self, key):
+        """Returns {"path", "size", "sha256"} for a (kind, video, variant) key, or None"""
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(
+                "SELECT path, size, sha256 FROM downloads WHERE kind = ? AND video = ? AND variant = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            if not os.path.isfile(row[0]) or os.path.getsize(row[0]) != row[1]:
+                # File was moved, deleted or changed since
+                self.db.execute("DELETE FROM downloads WHERE kind = ? AND video = ? AND variant = ?", key)
+                self.db.commit()
+                return None
+        except (sqlite3.Error, OSError):
+            return None
+        storage_manager.track(row[0])  # served again, so recently used
+        return {"path": row[0], "size": row[1], "sha256": row[2]}
+
+    def paths(self):
+        """Absolute paths of the recorded downloads"""
+        if self.db is None:
+            return set()
+        try:
+            return {os.path.abspath(path) for (path,) in self.db.execute("SELECT path FROM downloads")}
+        except sqlite3.Error:
+            return set()
+
+    async def record(self, key, path):
+        storage_manager.track(path)
+        if self.db is None or not os.path.isfile(path):
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            sha256 = await loop.run_in_executor(None, file_sha256, path)
+            self.db.execute(
+                "INSERT OR REPLACE INTO downloads (kind, video, variant, path, size, sha256, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, path, os.path.getsize(path), sha256, time.time())
+            )
+            self.db.commit()
+        except (sqlite3.Error, OSError):
+            pass
+
+download_index = DownloadIndex(DOWNLOAD_INDEX_PATH)
+
+class DownloadJournal:
+    """
+    Download jobs that are not finished yet: what to download (URL, format, output path),
+    the cookie source in use and the file being written. A job leaves the journal when it
+    completes, fails or is cancelled; whatever is left when the server starts was interrupted.
+    """
+
+    def __init__(self, db_path):
+        try:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, url TEXT NOT NULL, label TEXT NOT NULL, "
+                "params TEXT NOT NULL, job_key TEXT, priority INTEGER NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'queued', cookie_method TEXT, output_path TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            self.db = None
+
+    def add(self, job, params):
+        if self.db is None:
+            return
+        now = time.time()
+        try:
+            self.db.execute(
+                # A resumed job keeps its row: creation time, cookie source and the file being written
+                "INSERT INTO jobs (job_id, kind, url, label, params, job_key, priority, "
+                "output_path, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET status = 'queued', updated_at = excluded.updated_at",
+                (job.id, job.kind, job.url, job.label, json.dumps(params),
+                 json.dumps(job.key) if job.key is not None else None, job.priority,
+                 params.get("output_path"), now, now)
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+    def update(self, job_id, **fields):
+        """Update status, cookie_method and/or output_path of a job"""
+        if self.db is None:
+            return
+        try:
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            self.db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+    def remove(self, job_id):
+        if self.db is None:
+            return
+        try:
+            self.db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+    def pending(self):
+        """Journaled jobs, oldest first, as dicts with the params and key decoded"""
+        if self.db is None:
+            return []
+        try:
+            rows = self.db.execute(
+                "SELECT job_id, kind, url, label, params, job_key, priority, status, cookie_method, output_path "
+                "FROM jobs ORDER BY created_at"
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+        
+        jobs = []
+        for job_id, kind, url, label, params, job_key, priority, status, cookie_method, output_path in rows:
+            try:
+                params = json.loads(params)
+                key = tuple(json.loads(job_key)) if job_key else None
+            except json.JSONDecodeError:
+                self.remove(job_id)
+                continue
+            jobs.append({
+                "job_id": job_id, "kind": kind, "url": url, "label": label, "params": params, "key": key,
+                "priority": priority, "status": status, "cookie_method": cookie_method, "output_path": output_path,
+            })
+        return jobs
+
+download_journal = DownloadJournal(DOWNLOAD_JOURNAL_PATH)
+
+# Files yt-dlp and convert_audio() write before a download is finished: .part (and fragments of
+# it), .ytdl fragment state, single streams of a merged format (name.f137.mp4), conversion output
+PARTIAL_FILE_RE = re.compile(r"(\.part(-Frag\d+)?|\.ytdl|\.f\d+\.\w+|\.converting\.\w+)$")
+
+def find_partial_files():
+    """Unfinished download files in DOWNLOAD_DIR"""
+    try:
+        names = os.listdir(DOWNLOAD_DIR)
+    except OSError:
+        return []
+    return [os.path.join(DOWNLOAD_DIR, name) for name in names if PARTIAL_FILE_RE.search(name)]
+
+class StorageManager:
+    """
+    Keeps DOWNLOAD_DIR within the quota and the disk from filling up. Finished downloads are
+    tracked with their size and last access (downloaded, or asked for again and found in the
+    download index). With a quota, least recently used downloads are deleted before a download
+    starts until its expected size fits. Only files in the download index are ever deleted (not
+    pinned ones, nor anything else in the directory); without a quota nothing is, a download
+    that doesn't fit on the disk is refused.
+    """
+
+    def __init__(self, db_path, root, quota, min_free):
+        self.root = os.path.abspath(root)
+        self.quota = quota
+        self.min_free = min_free
+        self.reservations = {}  # job id -> (job, expected bytes) of downloads that made room
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.rejections = 0
+        try:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+                "pinned INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.db.commit()
+        except sqlite3.Error:
+            self.db = None
+
+    def track(self, path):
+        """Record a file in DOWNLOAD_DIR as used just now"""
+        if self.db is None:
+            return
+        path = os.path.abspath(path)
+        try:
+            self.db.execute(
+                "INSERT INTO files (path, size, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+                (path, os.path.getsize(path), time.time())
+            )
+            self.db.commit()
+        except (sqlite3.Error, OSError):
+            pass
+
+    def pin(self, path, pinned=True):
+        path = os.path.abspath(path)
+        self.track(path)
+        if self.db is None:
+            return
+        try:
+            self.db.execute("UPDATE files SET pinned = ? WHERE path = ?", (int(pinned), path))
+            self.db.commit()
+        except sqlite3.Error:
+            pass
+
+    def _files(self):
+        """{path: (size, mtime)} of the files in DOWNLOAD_DIR"""
+        files = {}
+        try:
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            pass
+        return files
+
+    def _tracked(self, files):
+        """{path: (last_access, pinned)}, forgetting files that are gone"""
+        if self.db is None:
+            return {}
+        try:
+            rows = self.db.execute("SELECT path, last_access, pinned FROM files").fetchall()
+            gone = [(path,) for path, _, _ in rows if path not in files]
+            if gone:
+                self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+                self.db.commit()
+        except sqlite3.Error:
+            return {}
+        return {path: (last_access, pinned) for path, last_access, pinned in rows if path in files}
+
+    def _evictable(self, files):
+        """(path, size) of the downloads in the download index that may be deleted, least recently used first"""
+        tracked = self._tracked(files)
+        downloaded = download_index.paths()
+        candidates = []
+        for path, (size, mtime) in files.items():
+            if path not in downloaded or PARTIAL_FILE_RE.search(path):
+                continue
+            last_access, pinned = tracked.get(path, (mtime, 0))
+            if pinned:
+                continue
+            candidates.append((last_access, path, size))
+        return [(path, size) for _, path, size in sorted(candidates)]
+
+    def usage(self):
+        """(bytes used, number of files, number of pinned files)"""
+        files = self._files()
+        tracked = self._tracked(files)
+        return (sum(size for size, _ in files.values()), len(files), sum(1 for _, pinned in tracked.values() if pinned))
+
+    def reserve(self, job, expected):
+        """
+        Make room for a download of about `expected` bytes (None when unknown), counting what
+        the other running downloads still have to write. Returns an error message when it
+        doesn't fit even after deleting every unpinned file (then nothing is deleted), else None.
+        """
+        need = expected or 0
+        files = self._files()
+        pending = sum(max(0, size - other.transferred_bytes()) for other, size in self.reservations.values())
+        
+        deficits = []
+        if self.quota:
+            used = sum(size for size, _ in files.values())
+            deficits.append((used + pending + need - self.quota, f"the download quota of {format_bytes(self.quota)}"))
+        try:
+            free = shutil.disk_usage(self.root).free
+            deficits.append((pending + need + self.min_free - free, f"the disk ({format_bytes(free)} free)"))
+        except OSError:
+            pass
+        deficit, limit = max(deficits, default=(0, ""))
+        
+        if deficit > 0:
+            evictable = self._evictable(files) if self.quota else []
+            if sum(size for _, size in evictable) < deficit:
+                self.rejections += 1
+                size = f" (about {format_bytes(need)})" if need else ""
+                if not self.quota:
+                    return f"Not enough space: this download{size} doesn't fit on {limit}."
+                return (f"Not enough space: this download{size} doesn't fit in {limit}, "
+                    f"even after deleting all {len(evictable)} unpinned download(s).")
+            for path, size in evictable:
+                if deficit <= 0:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                deficit -= size
+                self.evictions += 1
+                self.evicted_bytes += size
+            self._tracked(self._files())
+        
+        self.reservations[job.id] = (job, need)
+        return None
+
+    def release(self, job):
+        self.reservations.pop(job.id, None)
+
+storage_manager = StorageManager(STORAGE_DB_PATH, DOWNLOAD_DIR, DOWNLOAD_QUOTA, MIN_FREE_DISK)
+
+# What the format selection of a download picked: the exact format ids, the expected size (the
+# selected formats summed up for merged ones) and the duration, for estimating converted audio
+FORMAT_PROBE_TEMPLATE = "%(.{format_id,filesize,filesize_approx,duration})j"
+
+async def prepare_download(job, url, format_str, audio_format=None, bitrate=None):
+    """
+    Pick the exact formats of a download and make room for it in DOWNLOAD_DIR before any of it
+    is transferred, see StorageManager.reserve(). A kept info document of the video (e.g. from
+    get_video_info) is used when its stream URLs are still valid, then nothing is extracted here.
+    Otherwise the video is extracted once and its document kept for the download itself.
+    When that fails the download goes ahead as before, extracting the video with its size unknown.
+    Without DOWNLOAD_QUOTA the size isn't looked up at all, only the free disk space is checked.
+    Returns: (error message or None, info document path or None, format string to download)
+    """
+    info_path = info_json_store.lookup(url)
+    if not storage_manager.quota:
+        return (storage_manager.reserve(job, None), info_path, format_str)
     
-    stdout, stderr = await process.communicate()
+    job.stage = "Checking disk space"
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "edge")
+    def selection(info, path=None):
+        return {
+            "format_id": info.get("format_id"),
+            "size": info.get("filesize") or info.get("filesize_approx"),
+            "duration": info.get("duration"),
+            "info_path": path,
+        }
     
-    # Method 5: No cookies
-    shell_command = f'yt-dlp -x --audio-format mp3 --audio-quality 0 -o "{output_path}" "{url}"'
+    try:
+        if info_path is not None:
+            returncode, entries, _ = await run_ytdlp_json(
+                ["yt-dlp", "--load-info-json", info_path, "-f", format_str, "--print", FORMAT_PROBE_TEMPLATE],
+                transform=lambda info: selection(info, info_path)
+            )
+        if info_path is None or returncode != 0 or not entries:
+            cmd_args = get_base_ytdlp_args() + ["-f", format_str, "--no-playlist", "--dump-json", url]
+            returncode, entries, _ = await run_ytdlp_json(
+                cmd_args, transform=lambda info: selection(info, info_json_store.save(info))
+            )
+    finally:
+        job.stage = None
     
-    process = await asyncio.create_subprocess_shell(
-        shell_command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    selected = entries[0] if returncode == 0 and entries else selection({})
+    expected = selected["size"]
+    if expected and audio_format == "mp3" and selected["duration"]:
+        # The encoded file is written next to the downloaded stream
+        expected += int(selected["duration"] * (bitrate or 320) * 1000 / 8)
+    if selected["format_id"]:
+        # The picked formats, or what the selection picks if the document has to be extracted again
+        format_str = f"{selected['format_id']}/{format_str}"
+    return (storage_manager.reserve(job, expected), selected["info_path"], format_str)
+
+async def resume_interrupted_downloads():
+    """
+    Queue the journaled jobs of a previous server process again, under their old job IDs.
+    yt-dlp continues their .part files (--continue), so only the last moments of transfer
+    are lost. Once they are done, partial files from before the restart that no job
+    picked up (e.g. of cancelled downloads) are deleted.
+    """
+    started_at = time.time()
+    partial_files = find_partial_files()
     
-    stdout, stderr = await process.communicate()
+    jobs = []
+    for entry in download_journal.pending():
+        job = download_manager.submit(
+            entry["kind"], entry["url"], entry["label"], entry["params"],
+            entry["priority"], entry["key"], job_id=entry["job_id"]
+        )
+        job.resumed = True
+        job.cookie_method = entry["cookie_method"]
+        if entry["kind"] == "audio" and entry["output_path"] != entry["params"]["output_path"]:
+            job.stream_path = entry["output_path"]  # set once the stream was downloaded
+        jobs.append(job)
     
-    if process.returncode == 0:
-        return (True, stdout.decode(), stderr.decode(), "no_cookies")
+    for job in jobs:
+        await job.done.wait()
     
-    # All methods failed
-    return (False, stdout.decode(), stderr.decode(), "all_failed")
+    for path in partial_files:
+        try:
+            # A file written since the restart belongs to a download running now
+            if os.path.getmtime(path) < started_at:
+                os.remove(path)
+        except OSError:
+            continue
 
 # ----------------------
 # 1. Advertise tools
 # ----------------------
+AUDIO_FORMAT_SCHEMA = {
+    "type": "string",
+    "description": "Audio format: mp3 (converted), or m4a / opus, which are usually kept exactly as YouTube sends them",
+    "enum": AUDIO_FORMATS,
+    "default": "mp3"
+}
+
+AUDIO_BITRATE_SCHEMA = {
+    "type": "integer",
+    "description": "Encode at this bitrate in kbit/s. Without it mp3 uses the best variable bitrate "
+        "and m4a / opus are not re-encoded.",
+    "enum": AUDIO_BITRATES
+}
+
+PRIORITY_SCHEMA = {
+    "type": "string",
+    "description": "Queue priority: high priority jobs start first and get a larger share of the bandwidth limit. "
+        "Default: high for audio, normal for video",
+    "enum": list(DOWNLOAD_PRIORITIES)
+}
+
+WAIT_SCHEMA = {
+    "type": "boolean",
+    "description": "Wait for the download to finish, sending progress notifications, instead of returning a job ID right away",
+    "default": False
+}
+
 @server.list_tools()
 async def list_tools() -> list[Tool]:
     return [
         Tool(
             name="search_youtube",
-            description="Search for YouTube videos. Returns a list of videos with titles, URLs, durations, and view counts.",
+            description="Search for YouTube videos. Returns a list of videos with titles, URLs, durations, and view counts. "
+                "Use 'page' to get more results for the same query.",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "query": {"type": "string", "description": "Search query"},
                     "max_results": {
                         "type": "integer",
-                        "description": "Maximum number of results to return (1-20)",
+                        "description": f"Maximum number of results to return per page (1-{MAX_SEARCH_PAGE_SIZE})",
                         "default": 5,
                         "minimum": 1,
-                        "maximum": 20
+                        "maximum": MAX_SEARCH_PAGE_SIZE
+                    },
+                    "page": {
+                        "type": "integer",
+                        "description": "Page of results, 2 for the next max_results results and so on",
+                        "default": 1,
+                        "minimum": 1
                     }
                 },
                 "required": ["query"]
             }
         ),
         Tool(
-            name="download_youtube_video",
-            description="Download a YouTube video as MP4 using yt-dlp. Args: url, resolution (best, 720p, 1080p, 1440p, 2160p/4k).",
+            name="download_youtube_video",
+            description="Download a YouTube video as MP4 using yt-dlp. Args: url, resolution (best, 720p, 1080p, 1440p, 2160p/4k). "
+                "The download runs in the background; returns a job ID for get_download_status.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "url": {"type": "string", "description": "YouTube video URL"},
+                    "resolution": {
+                        "type": "string",
+                        "description": "Preferred resolution",
+                        "enum": ["best", "720p", "1080p", "1440p", "2160p", "4k"],
+                        "default": "best"
+                    },
+                    "priority": PRIORITY_SCHEMA,
+                    "wait": WAIT_SCHEMA
+                },
+                "required": ["url"]
+            }
+        ),
+        Tool(
+            name="download_youtube_audio",
+            description="Download audio from a YouTube video as MP3, M4A or Opus. "
+                "The download runs in the background; returns a job ID for get_download_status.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "url": {"type": "string", "description": "YouTube video URL"},
+                    "format": AUDIO_FORMAT_SCHEMA,
+                    "bitrate": AUDIO_BITRATE_SCHEMA,
+                    "priority": PRIORITY_SCHEMA,
+                    "wait": WAIT_SCHEMA
+                },
+                "required": ["url"]
+            }
+        ),
+        Tool(
+            name="download_batch",
+            description="Download many videos at once: a list of URLs and/or all videos of a playlist or channel. "
+                "Items are downloaded in parallel. Returns a batch ID for get_download_status, "
+                "which reports per-item results and total throughput.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "urls": {"type": "array", "items": {"type": "string"}, "description": "Video URLs"},
+                    "playlist_url": {"type": "string", "description": "Playlist or channel URL to download every video of"},
+                    "kind": {
+                        "type": "string",
+                        "description": "Download videos (MP4) or audio only",
+                        "enum": ["video", "audio"],
+                        "default": "video"
+                    },
+                    "audio_format": AUDIO_FORMAT_SCHEMA,
+                    "bitrate": AUDIO_BITRATE_SCHEMA,
+                    "resolution": {
+                        "type": "string",
+                        "description": "Preferred resolution for videos",
+                        "enum": ["best", "720p", "1080p", "1440p", "2160p", "4k"],
+                        "default": "best"
+                    },
+                    "max_items": {
+                        "type": "integer",
+                        "description": f"Maximum number of videos to download (1-{MAX_BATCH_ITEMS})",
+                        "default": MAX_BATCH_ITEMS,
+                        "minimum": 1,
+                        "maximum": MAX_BATCH_ITEMS
+                    },
+                    "parallel": {
+                        "type": "integer",
+                        "description": "How many videos of this batch to download at the same time, "
+                            f"at most {MAX_CONCURRENT_DOWNLOADS} (the server's limit for all downloads together, "
+                            "which other downloads share)",
+                        "default": min(BATCH_PARALLEL_DOWNLOADS, MAX_CONCURRENT_DOWNLOADS),
+                        "minimum": 1,
+                        "maximum": MAX_CONCURRENT_DOWNLOADS
+                    },
+                    "concurrent_fragments": {
+                        "type": "integer",
+                        "description": "Fragments downloaded at the same time per video",
+                        "default": BATCH_CONCURRENT_FRAGMENTS,
+                        "minimum": 1,
+                        "maximum": 16
+                    },
+                    "wait": {
+                        "type": "boolean",
+                        "description": "Wait for the whole batch to finish, sending progress notifications, instead of returning a batch ID right away",
+                        "default": False
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="get_download_status",
+            description="Get the status of a download job started by download_youtube_video or download_youtube_audio, "
+                "or of a batch started by download_batch.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {"type": "string", "description": "Job ID or batch ID returned when the download was queued"}
+                },
+                "required": ["job_id"]
+            }
+        ),
+        Tool(
+            name="list_downloads",
+            description="List recent download jobs with their status.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "status": {
+                        "type": "string",
+                        "description": "Only list jobs with this status",
+                        "enum": ["queued", "running", "completed", "failed", "cancelled"]
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="cancel_download",
+            description="Cancel a queued or running download job, or all unfinished items of a batch. "
+                "A running download is stopped immediately.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {"type": "string", "description": "Job ID or batch ID returned when the download was queued"}
+                },
+                "required": ["job_id"]
+            }
+        ),
+        Tool(
+            name="get_video_info",
+            description="Get detailed information about a YouTube video (title, duration, description, formats available).",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "url": {"type": "string", "description": "YouTube video URL"}
+                },
+                "required": ["url"]
+            }
+        ),
+        Tool(
+            name="get_video_info_batch",
+            description="Get information about many YouTube videos at once (e.g. to enrich search results). "
+                "Returns one JSON object per line; a URL that fails gets an 'error' field instead.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "urls": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": f"Video URLs (at most {INFO_BATCH_MAX_URLS})",
+                        "minItems": 1,
+                        "maxItems": INFO_BATCH_MAX_URLS
+                    }
+                },
+                "required": ["urls"]
+            }
+        ),
+        Tool(
+            name="get_transcript",
+            description="Get what is said in a YouTube video as text, from its subtitles or automatic captions, "
+                "without downloading the video. Long transcripts are returned in parts: ask again with 'start' "
+                "for the next part.",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "url": {"type": "string", "description": "YouTube video URL"},
-                    "resolution": {
+                    "language": {
                         "type": "string",
-                        "description": "Preferred resolution",
-                        "enum": ["best", "720p", "1080p", "1440p", "2160p", "4k"],
-                        "default": "best"
+                        "description": "Language code of the subtitles, e.g. en, de, es, pt-BR",
+                        "default": "en"
+                    },
+                    "start": {"type": "string", "description": "Only from this time on, e.g. 90, 1:30 or 1:02:03"},
+                    "end": {"type": "string", "description": "Only up to this time, same format as 'start'"},
+                    "timestamps": {
+                        "type": "boolean",
+                        "description": f"Mark the time every {TRANSCRIPT_PARAGRAPH_SECONDS} seconds",
+                        "default": True
                     }
                 },
                 "required": ["url"]
             }
         ),
         Tool(
-            name="download_youtube_audio",
-            description="Download audio from a YouTube video as MP3.",
+            name="get_server_metrics",
+            description="Show where the server spends its time: tool call latencies, yt-dlp process timings, "
+                "cookie fallbacks, download queue and bytes transferred, cache hit rate.",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "url": {"type": "string", "description": "YouTube video URL"}
+                    "format": {
+                        "type": "string",
+                        "description": "'summary' for a readable overview, 'prometheus' for the Prometheus text format",
+                        "enum": ["summary", "prometheus"],
+                        "default": "summary"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="set_bandwidth_limit",
+            description="Limit the total download bandwidth. Running and future downloads share it, "
+                "high priority ones get a bigger share. Takes effect right away.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "limit": {
+                        "type": "string",
+                        "description": "Bytes per second with an optional K/M/G suffix, e.g. '800K' or '5M'. "
+                            "'0' or 'unlimited' removes the limit"
+                    }
                 },
-                "required": ["url"]
+                "required": ["limit"]
             }
         ),
         Tool(
-            name="get_video_info",
-            description="Get detailed information about a YouTube video (title, duration, description, formats available).",
+            name="pin_download",
+            description="Keep a downloaded file: pinned files are never deleted to make room for new downloads "
+                "when the download folder is full. Also shows how much space the downloads use.",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "url": {"type": "string", "description": "YouTube video URL"}
+                    "file": {"type": "string", "description": "File name in the download folder, or the job ID of a finished download"},
+                    "pinned": {"type": "boolean", "description": "False to unpin the file again", "default": True}
                 },
-                "required": ["url"]
+                "required": ["file"]
             }
         )
     ]
@@ -275,8 +2952,50 @@ async def list_tools() -> list[Tool]:
 # ----------------------
 # 2. Handle tool call
 # ----------------------
+# Client session -> Semaphore of its concurrent tool calls, see SESSION_MAX_CONCURRENT_CALLS
+_session_call_slots = weakref.WeakKeyDictionary()
+
+def session_call_slots():
+    """The tool call limit of the session making the current request"""
+    session, _, _ = get_progress_target()
+    if session is None:
+        return contextlib.nullcontext()  # not called from an MCP request
+    slots = _session_call_slots.get(session)
+    if slots is None:
+        slots = _session_call_slots[session] = asyncio.Semaphore(SESSION_MAX_CONCURRENT_CALLS)
+    return slots
+
 @server.call_tool()
 async def call_tool(name: str, arguments: dict):
+    """
+    Run a tool, recording its latency (and a profile when it is slow, see PROFILE_SLOW_CALLS_MS).
+    A session with SESSION_MAX_CONCURRENT_CALLS calls running waits for one of them first.
+    """
+    async with session_call_slots():
+        return await timed_tool_call(name, arguments)
+
+async def timed_tool_call(name: str, arguments: dict):
+    if server_metrics.tool_names is None:
+        server_metrics.tool_names = {tool.name for tool in await list_tools()}
+    # Names come from the client: only registered ones become metric labels and profile file names
+    label = name if name in server_metrics.tool_names else "unknown"
+    started = time.perf_counter()
+    profiler = start_call_profile()
+    failed = True
+    try:
+        result = await dispatch_tool(name, arguments)
+        failed = isinstance(result, CallToolResult) and result.isError
+        return result
+    finally:
+        seconds = time.perf_counter() - started
+        finish_call_profile(profiler, label, seconds)
+        server_metrics.observe_tool(label, seconds, failed)
+
+def tool_error(text):
+    """Result of a failed tool call: the client sees isError, get_server_metrics counts it as an error"""
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=True)
+
+async def dispatch_tool(name: str, arguments: dict):
     if name == "search_youtube":
         return await handle_search(arguments)
     elif name == "download_youtube_video":
@@ -285,226 +3004,772 @@ async def call_tool(name: str, arguments: dict):
         return await handle_audio_download(arguments)
     elif name == "get_video_info":
         return await handle_video_info(arguments)
+    elif name == "download_batch":
+        return await handle_batch_download(arguments)
+    elif name == "get_video_info_batch":
+        return await handle_video_info_batch(arguments)
+    elif name == "get_transcript":
+        return await handle_transcript(arguments)
+    elif name == "get_download_status":
+        return await handle_download_status(arguments)
+    elif name == "list_downloads":
+        return await handle_list_downloads(arguments)
+    elif name == "cancel_download":
+        return await handle_cancel_download(arguments)
+    elif name == "get_server_metrics":
+        return await handle_server_metrics(arguments)
+    elif name == "set_bandwidth_limit":
+        return await handle_set_bandwidth_limit(arguments)
+    elif name == "pin_download":
+        return await handle_pin_download(arguments)
     else:
-        return [TextContent(type="text", text=f"Unknown tool: {name}")]
+        return tool_error(f"Unknown tool: {name}")
+
+class SearchBuffer:
+    """Results of one search query fetched so far. Later pages only fetch the missing slice."""
+
+    def __init__(self, key, query, entries, exhausted, fetched):
+        self.key = key
+        self.query = query
+        self.entries = entries  # without duplicates
+        self.fetched = fetched  # results fetched from the search so far, duplicates included
+        self.exhausted = exhausted  # the search has no more results
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def ensure(self, count):
+        """Make sure the first `count` results are here. Returns an error message or None"""
+        async with self.lock:
+            self.last_used = time.monotonic()
+            while len(self.entries) < count and not self.exhausted:
+                error = await self._fetch(self.fetched + count - len(self.entries))
+                if error is not None:
+                    return error
+            return None
+
+    async def _fetch(self, wanted):
+        """Fetch the results after those fetched so far, up to position `wanted` rounded up to a chunk"""
+        start = self.fetched + 1
+        end = min(MAX_SEARCH_RESULTS, -(-wanted // SEARCH_FETCH_CHUNK) * SEARCH_FETCH_CHUNK)
+        cmd_args = get_base_ytdlp_args(use_oauth=True) + [
+            "--dump-json",
+            "--flat-playlist",
+            "--playlist-start", str(start),
+            "--playlist-end", str(end),
+            f"ytsearch{end}:{self.query}"
+        ]
+        
+        returncode, entries, stderr = await run_ytdlp_json(cmd_args)
+        
+        if returncode != 0:
+            return stderr if stderr else "Unknown error"
+        
+        # Search results can shift between calls, don't list a video twice
+        seen = {video["id"] for video in self.entries}
+        for video_info in entries:
+            if video_info.get("id", "") in seen:
+                continue
+            seen.add(video_info.get("id", ""))
+            self.entries.append({
+                "title": video_info.get("title", "Unknown"),
+                "url": f"https://www.youtube.com/watch?v={video_info.get('id', '')}",
+                "duration": video_info.get("duration_string", "Unknown"),
+                "views": video_info.get("view_count", "Unknown"),
+                "uploader": video_info.get("uploader", "Unknown"),
+                "id": video_info.get("id", "")
+            })
+        self.fetched = start - 1 + len(entries)
+        if len(entries) < end - start + 1 or end >= MAX_SEARCH_RESULTS:
+            self.exhausted = True
+        
+        metadata_cache.put(
+            f"search:{self.key}",
+            {"entries": self.entries, "exhausted": self.exhausted, "fetched": self.fetched},
+            SEARCH_CACHE_TTL
+        )
+        return None
+
+search_buffers = OrderedDict()  # search cache key -> SearchBuffer, least recently used first
+
+def get_search_buffer(query):
+    """The result buffer of a query, seeded from the metadata cache when it is new"""
+    now = time.monotonic()
+    for key in [key for key, buffer in search_buffers.items() if now - buffer.last_used > SEARCH_BUFFER_IDLE_SECONDS]:
+        del search_buffers[key]
+    
+    key = search_cache_key(query)
+    buffer = search_buffers.get(key)
+    if buffer is None:
+        cached = metadata_cache.get(f"search:{key}") or {"entries": [], "exhausted": False}
+        buffer = SearchBuffer(key, query, cached["entries"], cached["exhausted"],
+            cached.get("fetched", len(cached["entries"])))
+        search_buffers[key] = buffer
+        while len(search_buffers) > MAX_SEARCH_BUFFERS:
+            search_buffers.popitem(last=False)
+    search_buffers.move_to_end(key)
+    return buffer
 
 async def handle_search(arguments: dict):
-    """Handle YouTube search requests"""
+    """Handle YouTube search requests, one page at a time"""
     query = arguments.get("query")
     max_results = arguments.get("max_results", 5)
+    page = arguments.get("page", 1)
     
     if not query:
-        return [TextContent(type="text", text="Error: 'query' argument is required.")]
+        return tool_error("Error: 'query' argument is required.")
     
-    max_results = max(1, min(20, max_results))
+    max_results = max(1, min(MAX_SEARCH_PAGE_SIZE, max_results))
+    page = max(1, page)
+    start = (page - 1) * max_results
+    if start >= MAX_SEARCH_RESULTS:
+        return tool_error(f"Error: only the first {MAX_SEARCH_RESULTS} results of a search can be listed.")
     
     try:
-        cmd_args = get_base_ytdlp_args(use_oauth=True) + [
-            "--dump-json",
-            "--flat-playlist",
-            "--playlist-end", str(max_results),
-            f"ytsearch{max_results}:{query}"
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd_args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
+        buffer = get_search_buffer(query)
+        error_msg = await buffer.ensure(start + max_results)
+        if error_msg is not None:
+            return tool_error(f"Search failed. Error: {error_msg}")
         
-        if process.returncode != 0:
-            error_msg = stderr.decode() if stderr else "Unknown error"
-            return [TextContent(type="text", text=f"Search failed. Error: {error_msg}")]
-        
-        results = []
-        for line in stdout.decode().strip().split('\n'):
-            if line.strip():
-                try:
-                    video_info = json.loads(line)
-                    results.append({
-                        "title": video_info.get("title", "Unknown"),
-                        "url": f"https://www.youtube.com/watch?v={video_info.get('id', '')}",
-                        "duration": video_info.get("duration_string", "Unknown"),
-                        "views": video_info.get("view_count", "Unknown"),
-                        "uploader": video_info.get("uploader", "Unknown"),
-                        "id": video_info.get("id", "")
-                    })
-                except json.JSONDecodeError:
-                    continue
+        results = buffer.entries[start:start + max_results]
         
         if not results:
+            if page > 1:
+                return [TextContent(type="text", text=f"No more results for: {query}")]
             return [TextContent(type="text", text=f"No results found for: {query}")]
         
-        output = f"🔍 Found {len(results)} results for '{query}':\n\n"
-        for i, video in enumerate(results, 1):
+        if page > 1:
+            output = f"🔍 Page {page}: results {start + 1}-{start + len(results)} for '{query}':\n\n"
+        else:
+            output = f"🔍 Found {len(results)} results for '{query}':\n\n"
+        for i, video in enumerate(results, start + 1):
             views_formatted = f"{video['views']:,}" if isinstance(video['views'], int) else video['views']
             output += f"{i}. **{video['title']}**\n"
             output += f"   👤 {video['uploader']} | ⏱️ {video['duration']} | 👁️ {views_formatted} views\n"
             output += f"   🔗 {video['url']}\n\n"
         
+        if len(buffer.entries) > start + max_results or not buffer.exhausted:
+            output += f"➡️ More results available: search again with page={page + 1}\n"
+        
         return [TextContent(type="text", text=output)]
         
     except Exception as e:
-        return [TextContent(type="text", text=f"Exception during search: {str(e)}")]
+        return tool_error(f"Exception during search: {str(e)}")
+
+COOKIE_METHOD_NAMES = {
+    "custom_path": "custom browser cookies",
+    "firefox": "Firefox cookies",
+    "chrome": "Chrome cookies",
+    "edge": "Edge cookies",
+    "no_cookies": "no cookies (public video)"
+}
+
+def get_priority(arguments: dict, kind):
+    default = DEFAULT_PRIORITIES[kind]
+    return DOWNLOAD_PRIORITIES.get(arguments.get("priority", default), DOWNLOAD_PRIORITIES[default])
+
+def get_progress_target():
+    """
+    (session, progress token, request id) of the MCP request being handled; token is None if the
+    client didn't ask for progress. Notifications name the request so HTTP sends them on its stream.
+    """
+    try:
+        ctx = server.request_context
+    except LookupError:
+        return (None, None, None)  # not called from an MCP request
+    if ctx.meta is None:
+        return (ctx.session, None, str(ctx.request_id))
+    return (ctx.session, ctx.meta.progressToken, str(ctx.request_id))
+
+async def wait_for_job(job):
+    """Wait for a job to finish, forwarding its progress to the client as MCP progress notifications"""
+    session, progress_token, request_id = get_progress_target()
+    
+    last_sent = 0
+    while not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), PROGRESS_NOTIFY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        
+        # Progress must only go up, a retry with the next cookie source starts from zero again
+        transferred = job.transferred_bytes()
+        if progress_token is None or job.status != "running" or transferred <= last_sent:
+            continue
+        last_sent = transferred
+        try:
+            await session.send_progress_notification(
+                progress_token, transferred, total=job.expected_bytes(), message=job.progress_text(),
+                related_request_id=request_id
+            )
+        except Exception:
+            progress_token = None  # client went away, keep waiting without notifications
+
+async def wait_for_batch(batch):
+    """Wait for every item of a batch, sending one progress notification per finished item"""
+    session, progress_token, request_id = get_progress_target()
+    
+    waits = [asyncio.ensure_future(job.done.wait()) for job in batch.jobs]
+    for finished, wait in enumerate(asyncio.as_completed(waits), 1):
+        await wait
+        if progress_token is None:
+            continue
+        try:
+            await session.send_progress_notification(
+                progress_token, finished, total=len(batch.jobs), message=f"{finished}/{len(batch.jobs)} items finished",
+                related_request_id=request_id
+            )
+        except Exception:
+            progress_token = None
+
+async def job_response(job, arguments: dict):
+    """Tool result for a queued job: the job ID, or the final result when the client asked to wait"""
+    if arguments.get("wait"):
+        await wait_for_job(job)
+        if job.status == "failed":
+            return tool_error(job.describe())
+        return [TextContent(type="text", text=job.describe())]
+    return [TextContent(type="text", text=queued_message(job))]
+
+def indexed_message(entry):
+    return (f"✅ Already downloaded, nothing to do.\n"
+        f"📁 Saved in {os.path.dirname(entry['path'])}\n"
+        f"📄 File: {os.path.basename(entry['path'])} ({format_bytes(entry['size'])})")
+
+def queued_message(job):
+    position = download_manager.queued_count()
+    if job.requests > 1:
+        return (f"🔁 The same download is already {job.status}. Job ID: {job.id}\n"
+            f"Use get_download_status with this job ID to check progress.")
+    return (f"⏳ Download queued! Job ID: {job.id}\n"
+        f"📋 Jobs in queue: {position}\n"
+        f"Use get_download_status with this job ID to check progress, or cancel_download to stop it.")
+
+def video_format(resolution):
+    """Normalized resolution and the yt-dlp format string for it. Returns (resolution, format_str)"""
+    if resolution == "best":
+        return (resolution, "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]")
+    
+    if resolution.lower() == "4k":
+        resolution = "2160p"
+    
+    res_num = resolution.lower().replace("p", "")
+    return (resolution, f"bestvideo[height<={res_num}][ext=mp4]+bestaudio[ext=m4a]/best[height<={res_num}][ext=mp4]")
+
+def make_download_runner(kind, url, params):
+    """
+    Job runner for a download. `params` is what the journal keeps to run the job again after a
+    restart: output_path and extra_args, plus resolution and format_str for videos or
+    audio_format and bitrate for audio.
+    """
+    if kind == "audio":
+        return lambda job: run_audio_download(
+            job, url, params["output_path"], params["extra_args"], params["audio_format"], params["bitrate"]
+        )
+    return lambda job: run_video_download(
+        job, url, params["resolution"], params["format_str"], params["output_path"], params["extra_args"]
+    )
 
 async def handle_download(arguments: dict):
-    """Handle YouTube video download requests with cookie fallback chain"""
+    """Handle YouTube video download requests: validate and queue a background job"""
     url = arguments.get("url")
     resolution = arguments.get("resolution", "best")
     
     if not url:
-        return [TextContent(type="text", text="Error: 'url' argument is required.")]
+        return tool_error("Error: 'url' argument is required.")
     
     try:
         output_path = os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")
+        resolution, format_str = video_format(resolution)
         
-        if resolution == "best":
-            format_str = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]"
-        else:
-            if resolution.lower() == "4k":
-                resolution = "2160p"
-            
-            res_num = resolution.lower().replace("p", "")
-            format_str = f"bestvideo[height<={res_num}][ext=mp4]+bestaudio[ext=m4a]/best[height<={res_num}][ext=mp4]"
-        
-        # Try download with cookie fallback
-        success, stdout, stderr, method = await try_download_with_cookies(url, format_str, output_path)
-        
-        if success:
-            method_names = {
-                "custom_path": "custom browser cookies",
-                "firefox": "Firefox cookies",
-                "chrome": "Chrome cookies",
-                "edge": "Edge cookies",
-                "no_cookies": "no cookies (public video)"
-            }
-            
-            # Extract only the filename from stdout (ignore progress lines)
-            filename = None
-            for line in stdout.split('\n'):
-                if 'Merging formats into' in line or 'has already been downloaded' in line:
-                    # Extract filename from merger message
-                    if '"' in line:
-                        filename = line.split('"')[1].split('/')[-1].split('\\')[-1]
-                        break
-            
-            result_msg = f"✅ Download complete! (using {method_names.get(method, method)})\n📁 Saved in {DOWNLOAD_DIR}"
-            if filename:
-                result_msg += f"\n📄 File: {filename}"
-            
-            return [TextContent(type="text", text=result_msg)]
-        else:
-            # All methods failed
-            if "403" in stderr or "HTTP Error 403" in stderr:
-                return [TextContent(type="text", text=f"❌ Download failed with 403 Forbidden error.\n\n"
-                    f"Suggestions:\n"
-                    f"1. Make sure you're logged into YouTube in Firefox, Chrome, or Edge\n"
-                    f"2. Wait a few minutes and try again (rate limiting)\n"
-                    f"3. Update yt-dlp: pip install -U yt-dlp\n"
-                    f"4. Try watching the video in your browser first\n\n"
-                    f"Tried all cookie sources:\n"
-                    f"✗ Custom path\n"
-                    f"✗ Firefox\n"
-                    f"✗ Chrome\n"
-                    f"✗ Edge\n"
-                    f"✗ No cookies\n\n"
-                    f"Error details: {stderr}")]
-            
-            return [TextContent(type="text", text=f"❌ Download failed after trying all cookie sources.\n"
-                f"Error: {stderr}\nURL: {url}\nResolution: {resolution}")]
+        key = ("video", video_cache_key(url), resolution)
+        entry = download_index.lookup(key)
+        if entry is not None:
+            return [TextContent(type="text", text=indexed_message(entry))]
+        
+        params = {"resolution": resolution, "format_str": format_str, "output_path": output_path, "extra_args": []}
+        job = download_manager.submit("video", url, resolution, params, get_priority(arguments, "video"), key)
+        return await job_response(job, arguments)
         
     except Exception as e:
-        return [TextContent(type="text", text=f"Exception: {str(e)}")]
+        return tool_error(f"Exception: {str(e)}")
+
+async def run_video_download(job, url, resolution, format_str, output_path, extra_args=()):
+    """Video download job with cookie fallback chain. Returns (success, message)"""
+    error, info_path, selected_format = await prepare_download(job, url, format_str)
+    if error:
+        return (False, f"❌ {error}")
+    
+    success, stdout, stderr, method = await try_download_with_cookies(
+        url, selected_format, output_path, job, extra_args, info_path
+    )
+    
+    if success:
+        files = parse_output_files(stdout)
+        filename = os.path.basename(files[-1]) if files else None
+        if files:
+            job.output_path = files[-1]
+            await download_index.record(job.key, files[-1])
+        
+        result_msg = f"✅ Download complete! (using {COOKIE_METHOD_NAMES.get(method, method)})\n📁 Saved in {DOWNLOAD_DIR}"
+        if filename:
+            result_msg += f"\n📄 File: {filename}"
+        if job.cookie_report:
+            result_msg += f"\n{job.cookie_report}"
+        
+        return (True, result_msg)
+    
+    # All methods failed
+    if "403" in stderr or "HTTP Error 403" in stderr:
+        return (False, f"❌ Download failed with 403 Forbidden error.\n\n"
+            f"Suggestions:\n"
+            f"1. Make sure you're logged into YouTube in Firefox, Chrome, or Edge\n"
+            f"2. Wait a few minutes and try again (rate limiting)\n"
+            f"3. Update yt-dlp: pip install -U yt-dlp\n"
+            f"4. Try watching the video in your browser first\n\n"
+            f"Tried all cookie sources:\n"
+            f"✗ Custom path\n"
+            f"✗ Firefox\n"
+            f"✗ Chrome\n"
+            f"✗ Edge\n"
+            f"✗ No cookies\n\n"
+            f"Error details: {stderr}")
+    
+    return (False, f"❌ Download failed after trying all cookie sources.\n"
+        f"Error: {stderr}\nURL: {url}\nResolution: {resolution}")
 
 async def handle_audio_download(arguments: dict):
-    """Handle YouTube audio download requests with cookie fallback chain"""
+    """Handle YouTube audio download requests: validate and queue a background job"""
     url = arguments.get("url")
     
     if not url:
-        return [TextContent(type="text", text="Error: 'url' argument is required.")]
+        return tool_error("Error: 'url' argument is required.")
     
     try:
         output_path = os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")
+        audio_format, bitrate, label = audio_options(arguments.get("format"), arguments.get("bitrate"))
         
-        # Try download with cookie fallback
-        success, stdout, stderr, method = await try_audio_download_with_cookies(url, output_path)
+        key = ("audio", video_cache_key(url), label)
+        entry = download_index.lookup(key)
+        if entry is not None:
+            return [TextContent(type="text", text=indexed_message(entry))]
         
-        if success:
-            method_names = {
-                "custom_path": "custom browser cookies",
-                "firefox": "Firefox cookies",
-                "chrome": "Chrome cookies",
-                "edge": "Edge cookies",
-                "no_cookies": "no cookies (public video)"
-            }
-            
-            # Extract only the filename from stdout
-            filename = None
-            for line in stdout.split('\n'):
-                if 'Destination:' in line or 'has already been downloaded' in line:
-                    if '/' in line or '\\' in line:
-                        filename = line.split('/')[-1].split('\\')[-1].strip()
-                        break
-            
-            result_msg = f"🎵 Audio download complete! (using {method_names.get(method, method)})\n📁 Saved in {DOWNLOAD_DIR}"
-            if filename:
-                result_msg += f"\n📄 File: {filename}"
-            
-            return [TextContent(type="text", text=result_msg)]
-        else:
-            return [TextContent(type="text", text=f"❌ Audio download failed after trying all cookie sources.\n"
-                f"Error: {stderr}")]
+        params = {"audio_format": audio_format, "bitrate": bitrate, "output_path": output_path, "extra_args": []}
+        job = download_manager.submit("audio", url, label, params, get_priority(arguments, "audio"), key)
+        return await job_response(job, arguments)
         
     except Exception as e:
-        return [TextContent(type="text", text=f"Exception: {str(e)}")]
+        return tool_error(f"Exception: {str(e)}")
 
-async def handle_video_info(arguments: dict):
-    """Get detailed information about a YouTube video"""
-    url = arguments.get("url")
+def audio_options(audio_format, bitrate):
+    """Validated (format, bitrate or None, job label) for an audio download; the label is also its index variant"""
+    audio_format = audio_format if audio_format in AUDIO_FORMATS else "mp3"
+    bitrate = bitrate if bitrate in AUDIO_BITRATES else None
+    return (audio_format, bitrate, f"{audio_format} {bitrate}k" if bitrate else audio_format)
+
+async def run_audio_download(job, url, output_path, extra_args=(), audio_format="mp3", bitrate=None):
+    """
+    Audio download job with cookie fallback chain: download the audio stream, then convert
+    it if needed. Conversion runs after giving the download worker to the next job.
+    Returns (success, message)
+    """
+    if job.stream_path and os.path.exists(job.stream_path):
+        # Downloaded before the server restarted, only the conversion is left.
+        # YouTube's audio streams are opus in WebM or AAC in m4a.
+        path, method = job.stream_path, job.cookie_method
+        acodec = {"webm": "opus", "m4a": "mp4a"}.get(os.path.splitext(path)[1].lstrip(".").lower())
+    else:
+        error, info_path, selected_format = await prepare_download(
+            job, url, AUDIO_FORMAT_SELECTORS[audio_format], audio_format, bitrate
+        )
+        if error:
+            return (False, f"❌ {error}")
+        
+        success, stdout, stderr, method = await try_audio_download_with_cookies(
+            url, output_path, job, extra_args, audio_format, selected_format, info_path
+        )
+        
+        if not success:
+            return (False, f"❌ Audio download failed after trying all cookie sources.\n"
+                f"Error: {stderr}")
+        
+        files = parse_output_files(stdout)
+        if not files:
+            return (False, "❌ Audio download failed: yt-dlp did not report the downloaded file.")
+        path = files[-1]
+        acodecs = parse_printed_values(stdout, "[acodec]")
+        acodec = acodecs[-1] if acodecs else None
     
-    if not url:
-        return [TextContent(type="text", text="Error: 'url' argument is required.")]
+    codec_args = audio_codec_args(path, acodec, audio_format, bitrate)
+    converted = codec_args is not None
+    if converted:
+        download_journal.update(job.id, output_path=path)
+        job.detach()
+        source_path = path
+        path, error = await convert_audio(job, source_path, audio_format, codec_args)
+        if error:
+            return (False, f"❌ Converting the audio to {audio_format} failed.\nError: {error}\n"
+                f"📁 The downloaded audio stream was kept: {source_path}")
+    
+    job.output_path = path
+    await download_index.record(job.key, path)
+    
+    result_msg = f"🎵 Audio download complete! (using {COOKIE_METHOD_NAMES.get(method, method)})\n📁 Saved in {DOWNLOAD_DIR}"
+    result_msg += f"\n📄 File: {os.path.basename(path)}"
+    if not converted:
+        result_msg += "\n⚡ No conversion needed"
+    if job.cookie_report:
+        result_msg += f"\n{job.cookie_report}"
+    
+    return (True, result_msg)
+
+async def expand_playlist(playlist_url, max_items):
+    """
+    Video URLs of a playlist (or channel, or a single video) without extracting each video.
+    Returns: (urls: list[str], error: str or None)
+    """
+    cmd_args = get_base_ytdlp_args(use_oauth=True) + [
+        "--dump-json",
+        "--flat-playlist",
+        "--playlist-end", str(max_items),
+        playlist_url
+    ]
+    
+    returncode, entries, stderr = await run_ytdlp_json(cmd_args)
+    
+    if returncode != 0 and not entries:
+        return ([], stderr if stderr else "Unknown error")
+    
+    urls = []
+    for entry in entries:
+        url = entry.get("webpage_url") or entry.get("url")
+        if not url and entry.get("id") and entry.get("ie_key") == "Youtube":
+            url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if url:
+            urls.append(url)
+    return (urls, None)
+
+async def handle_batch_download(arguments: dict):
+    """Download a list of URLs and/or every video of a playlist as one batch"""
+    urls = arguments.get("urls") or []
+    playlist_url = arguments.get("playlist_url")
+    kind = arguments.get("kind", "video")
+    max_items = max(1, min(MAX_BATCH_ITEMS, arguments.get("max_items", MAX_BATCH_ITEMS)))
+    parallel = max(1, min(MAX_CONCURRENT_DOWNLOADS, arguments.get("parallel", BATCH_PARALLEL_DOWNLOADS)))
+    fragments = max(1, min(16, arguments.get("concurrent_fragments", BATCH_CONCURRENT_FRAGMENTS)))
+    
+    if not urls and not playlist_url:
+        return tool_error("Error: 'urls' or 'playlist_url' argument is required.")
     
     try:
-        cmd_args = get_base_ytdlp_args(use_oauth=False) + [
-            "--dump-json",
-            "--no-playlist",
-            url
-        ]
+        if playlist_url:
+            playlist_urls, error = await expand_playlist(playlist_url, max_items)
+            if error:
+                return tool_error(f"Failed to read playlist. Error: {error}")
+            urls = list(urls) + playlist_urls
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd_args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        urls = list(dict.fromkeys(urls))[:max_items]  # drop duplicates, keep order
+        if not urls:
+            return [TextContent(type="text", text=f"No videos found in: {playlist_url}")]
+        
+        output_path = os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")
+        resolution, format_str = video_format(arguments.get("resolution", "best"))
+        audio_format, bitrate, audio_label = audio_options(arguments.get("audio_format"), arguments.get("bitrate"))
+        extra_args = ["--no-playlist", "--concurrent-fragments", str(fragments)]
+        
+        items = []
+        for url in urls:
+            if kind == "audio":
+                key = ("audio", video_cache_key(url), audio_label)
+                label = audio_label
+                params = {"audio_format": audio_format, "bitrate": bitrate, "output_path": output_path, "extra_args": extra_args}
+            else:
+                key = ("video", video_cache_key(url), resolution)
+                label = resolution
+                params = {"resolution": resolution, "format_str": format_str, "output_path": output_path, "extra_args": extra_args}
+            
+            entry = download_index.lookup(key)
+            if entry is not None:
+                job = download_manager.add_finished(kind, url, label, indexed_message(entry))
+                job.output_path = entry["path"]
+                items.append(job)
+            else:
+                items.append((kind, url, label, params, key))
         
-        stdout, stderr = await process.communicate()
+        batch = download_manager.submit_batch(items, parallel)
         
-        if process.returncode != 0:
-            error_msg = stderr.decode() if stderr else "Unknown error"
-            return [TextContent(type="text", text=f"Failed to get video info. Error: {error_msg}")]
+        if arguments.get("wait"):
+            await wait_for_batch(batch)
+            return [TextContent(type="text", text=batch.describe())]
         
-        video_info = json.loads(stdout.decode())
+        return [TextContent(type="text", text=f"⏳ Batch of {len(batch.jobs)} downloads started! Batch ID: {batch.id}\n"
+            f"Use get_download_status with the batch ID for per-item results, or cancel_download to stop it.")]
         
-        title = video_info.get("title", "Unknown")
-        uploader = video_info.get("uploader", "Unknown")
-        duration = video_info.get("duration_string", "Unknown")
-        views = video_info.get("view_count", 0)
-        likes = video_info.get("like_count", 0)
-        description = video_info.get("description", "No description")[:500]
-        upload_date = video_info.get("upload_date", "Unknown")
+    except Exception as e:
+        return tool_error(f"Exception: {str(e)}")
+
+async def handle_download_status(arguments: dict):
+    """Report the state of one download job"""
+    job_id = arguments.get("job_id")
+    
+    if not job_id:
+        return tool_error("Error: 'job_id' argument is required.")
+    
+    batch = download_manager.get_batch(job_id)
+    if batch is not None:
+        return [TextContent(type="text", text=batch.describe())]
+    
+    job = download_manager.get(job_id)
+    if job is None:
+        return tool_error(f"Unknown download job: {job_id}")
+    
+    return [TextContent(type="text", text=job.describe())]
+
+async def handle_list_downloads(arguments: dict):
+    """List recent download jobs, newest first"""
+    status = arguments.get("status")
+    
+    jobs = [job for job in reversed(download_manager.jobs.values()) if not status or job.status == status]
+    if not jobs:
+        return [TextContent(type="text", text="No download jobs." if not status else f"No {status} download jobs.")]
+    
+    output = f"📋 {len(jobs)} download job(s):\n\n"
+    for job in jobs:
+        output += f"• {job.id} | {job.kind} {job.label} | {job.status} | {job.url}\n"
+    
+    return [TextContent(type="text", text=output)]
+
+async def handle_server_metrics(arguments: dict):
+    """Metrics collected since the server started"""
+    if arguments.get("format") == "prometheus":
+        return [TextContent(type="text", text=server_metrics.render_prometheus())]
+    
+    m = server_metrics
+    uptime = int(time.time() - m.started_at)
+    output = f"📈 Server metrics (up {uptime // 3600}h {uptime % 3600 // 60}m)\n\n"
+    
+    output += "🛠️ Tool calls:\n"
+    for name, hist in sorted(m.tool_latency.items()):
+        output += (f"   {name}: {hist.count} calls, {m.tool_errors.get(name, 0)} errors, "
+            f"p50 {format_ms(hist.quantile(0.5))}, p95 {format_ms(hist.quantile(0.95))}, "
+            f"mean {format_ms(hist.sum / hist.count)}\n")
+    if not m.tool_latency:
+        output += "   none yet\n"
+    
+    output += "\n⚙️ Processes (yt-dlp, ffmpeg):\n"
+    for kind, hist in sorted(m.process_runtime.items()):
+        spawn = m.process_spawn.get(kind)
+        output += (f"   {kind}: {hist.count} run, {m.process_failures.get(kind, 0)} failed, "
+            f"start p50 {format_ms(spawn.quantile(0.5) if spawn else None)}, "
+            f"runtime p50 {format_ms(hist.quantile(0.5))}, p95 {format_ms(hist.quantile(0.95))}\n")
+        for warm, label in ((True, "warm worker"), (False, "cold start")):
+            first = m.process_first_output.get((kind, warm))
+            if first:
+                output += f"      first output, {label}: p50 {format_ms(first.quantile(0.5))} ({first.count} runs)\n"
+    pool = ytdlp_workers
+    if pool.started:
+        output += (f"   yt-dlp workers: {pool.size} running ({len(pool.idle)} idle), {pool.started} started, "
+            f"{pool.recycled} recycled, {pool.overflows} runs without a free worker\n")
+    if m.extractions.count:
+        output += (f"   in-process extractions: {m.extractions.count}, "
+            f"p50 {format_ms(m.extractions.quantile(0.5))}, p95 {format_ms(m.extractions.quantile(0.95))}\n")
+    
+    stats = cookie_fallback_stats
+    output += (f"\n🍪 Cookie fallback: {stats['downloads']} downloads, {stats['attempts']} attempts "
+        f"({stats['probes']} probes), {stats['first_try_successes']} worked first try, "
+        f"{stats['fallback_seconds']:.1f}s lost on sources that didn't work\n")
+    jars = cookie_jars.counters
+    if jars["exports"] or jars["failures"]:
+        output += (f"   browser cookies exported {jars['exports']} time(s), export reused {jars['reuses']} time(s), "
+            f"{jars['failures']} export(s) failed\n")
+    
+    running = sum(1 for job in download_manager.jobs.values() if job.status == "running")
+    results = ", ".join(f"{n} {kind} {status}" for (kind, status), n in sorted(m.download_results.items()))
+    output += (f"\n⬇️ Downloads: {download_manager.queued_count()} queued, {running} running, "
+        f"{format_bytes(sum(m.download_bytes.values()))} transferred\n")
+    if bandwidth_scheduler.limit:
+        output += (f"   limited to {format_bytes(bandwidth_scheduler.limit)}/s, "
+            f"{bandwidth_scheduler.restarts} restart(s) for new shares\n")
+    if results:
+        output += f"   {results}\n"
+    if m.download_speed.count:
+        output += f"   speed p50 {format_bytes(m.download_speed.quantile(0.5))}/s\n"
+    
+    output += f"\n{storage_usage_text()}\n"
+    if storage_manager.evictions or storage_manager.rejections:
+        output += (f"   {storage_manager.evictions} file(s) deleted to make room ({format_bytes(storage_manager.evicted_bytes)}), "
+            f"{storage_manager.rejections} download(s) refused for lack of space\n")
+    
+    cache = metadata_cache.stats()
+    output += (f"\n🗄️ Metadata cache: {cache['hit_rate']:.0%} hit rate "
+        f"({cache['memory_hits']} memory, {cache['disk_hits']} disk, {cache['misses']} misses)\n")
+    kept = info_json_store.counters
+    if kept["hits"] or kept["misses"]:
+        output += (f"   {kept['hits']} download(s) used a kept info document, "
+            f"{kept['misses']} had to extract the video\n")
+    if m.slow_call_profiles:
+        output += f"\n🐢 {m.slow_call_profiles} slow call profile(s) in {PROFILE_DIR}\n"
+    
+    return [TextContent(type="text", text=output)]
+
+def parse_rate(text):
+    """'5M', '800K', '1.5m', '2000000' -> bytes/s, '0' or 'unlimited' -> 0, None when invalid"""
+    text = str(text).strip().lower()
+    if text in ("unlimited", "none", "off"):
+        return 0
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmg]?)i?b?(?:/s)?", text)
+    if not match:
+        return None
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmg".index(unit or " "))
+
+async def handle_set_bandwidth_limit(arguments: dict):
+    """Change the bandwidth budget, running downloads are rebalanced right away"""
+    limit = parse_rate(arguments.get("limit", ""))
+    if limit is None:
+        return tool_error("Error: 'limit' must be like '800K', '5M' or 'unlimited'.")
+    
+    bandwidth_scheduler.set_limit(limit)
+    if not limit:
+        output = "🚦 Bandwidth limit removed.\n"
+    else:
+        output = f"🚦 Bandwidth limited to {format_bytes(limit)}/s.\n"
+    
+    shares = bandwidth_scheduler.rates
+    if shares and limit:
+        output += f"\nShared by {len(shares)} running download(s):\n"
+        for job, share in shares.items():
+            output += f"• {job.id} | {job.kind} {job.label} | {format_bytes(share)}/s\n"
+    
+    return [TextContent(type="text", text=output)]
+
+def storage_usage_text():
+    used, count, pinned = storage_manager.usage()
+    text = f"💾 Downloads use {format_bytes(used)}"
+    if storage_manager.quota:
+        text += f" of {format_bytes(storage_manager.quota)}"
+    return text + f" ({count} files, {pinned} pinned)"
+
+async def handle_pin_download(arguments: dict):
+    """Pin or unpin a downloaded file"""
+    name = arguments.get("file")
+    pinned = arguments.get("pinned", True)
+    
+    if not name:
+        return tool_error("Error: 'file' argument is required.")
+    
+    job = download_manager.get(name)
+    if job is not None:
+        if not job.output_path:
+            return tool_error(f"Job {job.id} has no downloaded file ({job.status}).")
+        path = job.output_path
+    else:
+        path = os.path.join(DOWNLOAD_DIR, os.path.basename(name))
+    
+    if not os.path.isfile(path):
+        return tool_error(f"No such file in {DOWNLOAD_DIR}: {os.path.basename(path)}")
+    
+    storage_manager.pin(path, pinned)
+    if pinned:
+        output = f"📌 Pinned {os.path.basename(path)}, it won't be deleted to make room for new downloads.\n"
+    else:
+        output = f"📍 Unpinned {os.path.basename(path)}.\n"
+    output += storage_usage_text()
+    
+    return [TextContent(type="text", text=output)]
+
+async def handle_cancel_download(arguments: dict):
+    """Cancel a queued or running download job"""
+    job_id = arguments.get("job_id")
+    
+    if not job_id:
+        return tool_error("Error: 'job_id' argument is required.")
+    
+    batch = download_manager.get_batch(job_id)
+    if batch is not None:
+        cancelled = [job for job in batch.jobs if job.status in ("queued", "running")]
+        for job in cancelled:
+            download_manager.cancel(job.id)
+        return [TextContent(type="text", text=f"🚫 Batch {batch.id}: {len(cancelled)} unfinished item(s) cancelled.")]
+    
+    job = download_manager.cancel(job_id)
+    if job is None:
+        return tool_error(f"Unknown download job: {job_id}")
+    if job.status != "cancelled":
+        return [TextContent(type="text", text=f"Job {job.id} already {job.status}, nothing to cancel.")]
+    
+    return [TextContent(type="text", text=f"🚫 Job {job.id} cancelled.")]
+
+def info_output_args():
+    """yt-dlp arguments that print one JSON document per video for keep_video_info()"""
+    # In process the transform sees the whole document anyway and it can be kept for downloads.
+    # Out of process a projected document isn't kept, printing it in full would cost more.
+    if INFO_PROJECTION:
+        return ["--print", INFO_PROJECTION_TEMPLATE]
+    return ["--dump-json"]
+
+def summarize_video_info(video_info):
+    """Keep only the fields get_video_info shows, this is what gets cached"""
+    upload_date = video_info.get("upload_date", "Unknown")
+    if upload_date != "Unknown" and len(upload_date) == 8:
+        upload_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]}"
+    
+    # A projected document (INFO_PROJECTION) carries just the heights
+    heights = video_info.get("formats.:.height")
+    if heights is None:
+        heights = (fmt.get("height") for fmt in video_info.get("formats") or [])
+    resolutions = {f"{height}p" for height in heights if height}
+    
+    return {
+        "id": video_info.get("id", ""),
+        "title": video_info.get("title", "Unknown"),
+        "uploader": video_info.get("uploader", "Unknown"),
+        "duration": video_info.get("duration_string", "Unknown"),
+        "views": video_info.get("view_count", 0),
+        "likes": video_info.get("like_count", 0),
+        "description": (video_info.get("description") or "No description")[:500],
+        "upload_date": upload_date,
+        "resolutions": sorted(resolutions, key=lambda x: int(x.replace('p', '')), reverse=True),
+    }
+
+def keep_video_info(video_info):
+    """summarize_video_info(), keeping the whole document for a download of the same video"""
+    info_json_store.save(video_info)
+    return summarize_video_info(video_info)
+
+async def handle_video_info(arguments: dict):
+    """Get detailed information about a YouTube video"""
+    url = arguments.get("url")
+    
+    if not url:
+        return tool_error("Error: 'url' argument is required.")
+    
+    try:
+        cache_key = f"info:{video_cache_key(url)}"
+        summary = metadata_cache.get(cache_key)
         
-        if upload_date != "Unknown" and len(upload_date) == 8:
-            upload_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]}"
+        if summary is None:
+            cmd_args = get_base_ytdlp_args(use_oauth=False) + info_output_args() + [
+                "--no-playlist",
+                url
+            ]
+            
+            returncode, entries, stderr = await run_ytdlp_json(cmd_args, transform=keep_video_info)
+            
+            if returncode != 0 or not entries:
+                error_msg = stderr if stderr else "Unknown error"
+                return tool_error(f"Failed to get video info. Error: {error_msg}")
+            
+            summary = entries[0]
+            metadata_cache.put(cache_key, summary, INFO_CACHE_TTL)
         
-        formats = video_info.get("formats", [])
-        resolutions = set()
-        for fmt in formats:
-            height = fmt.get("height")
-            if height:
-                resolutions.add(f"{height}p")
+        title = summary["title"]
+        uploader = summary["uploader"]
+        duration = summary["duration"]
+        views = summary["views"]
+        likes = summary["likes"]
+        description = summary["description"]
+        upload_date = summary["upload_date"]
+        resolutions = summary["resolutions"]
         
         output = f"📹 **{title}**\n\n"
         output += f"👤 Uploader: {uploader}\n"
@@ -512,24 +3777,352 @@ async def handle_video_info(arguments: dict):
         output += f"⏱️ Duration: {duration}\n"
         output += f"👁️ Views: {views:,}\n"
         output += f"👍 Likes: {likes:,}\n"
-        output += f"🎬 Available Resolutions: {', '.join(sorted(resolutions, key=lambda x: int(x.replace('p', '')), reverse=True))}\n\n"
+        output += f"🎬 Available Resolutions: {', '.join(resolutions)}\n\n"
         output += f"📝 Description (preview):\n{description}...\n"
         
         return [TextContent(type="text", text=output)]
         
     except Exception as e:
-        return [TextContent(type="text", text=f"Exception: {str(e)}")]
+        return tool_error(f"Exception: {str(e)}")
+
+async def handle_video_info_batch(arguments: dict):
+    """Get information about many videos, one JSON object per line in the order they finish"""
+    urls = list(dict.fromkeys(arguments.get("urls") or []))
+    
+    if not urls:
+        return tool_error("Error: 'urls' argument is required.")
+    if len(urls) > INFO_BATCH_MAX_URLS:
+        return tool_error(f"Error: at most {INFO_BATCH_MAX_URLS} URLs per call.")
+    
+    try:
+        session, progress_token, request_id = get_progress_target()
+        lines = []
+        
+        async def emit(url, summary, error):
+            line = json.dumps({"url": url, **summary} if summary else {"url": url, "error": error}, ensure_ascii=False)
+            lines.append(line)
+            if progress_token is None:
+                return
+            try:
+                await session.send_progress_notification(
+                    progress_token, len(lines), total=len(urls), message=line, related_request_id=request_id
+                )
+            except Exception:
+                pass
+        
+        # Cached videos first, everything else in one extraction pass
+        misses = []
+        for url in urls:
+            summary = metadata_cache.get(f"info:{video_cache_key(url)}")
+            if summary is None:
+                misses.append(url)
+            else:
+                await emit(url, summary, None)
+        
+        if misses:
+            cmd_args = get_base_ytdlp_args(use_oauth=False) + info_output_args() + ["--no-playlist"]
+            async for url, summary, error in extract_many(cmd_args, misses, keep_video_info, INFO_BATCH_SESSIONS):
+                if summary is not None:
+                    metadata_cache.put(f"info:{video_cache_key(url)}", summary, INFO_CACHE_TTL)
+                await emit(url, summary, error)
+        
+        return [TextContent(type="text", text="\n".join(lines))]
+        
+    except Exception as e:
+        return tool_error(f"Exception: {str(e)}")
+
+CUE_TIMING_RE = re.compile(r"((?:\d+:)?\d+:\d+[.,]\d+)\s*-->\s*((?:\d+:)?\d+:\d+[.,]\d+)")
+CUE_MARKUP_RE = re.compile(r"<[^>]*>")
+LANGUAGE_RE = re.compile(r"[A-Za-z]{2,3}(-[A-Za-z0-9]+)*")
+
+def parse_timestamp(value):
+    """Seconds from 90, "90", "1:30", "1:02:03" or "00:01:30.500" (also SRT's "00:01:30,500"), None if invalid"""
+    if isinstance(value, (int, float)):
+        parts = [float(value)]
+    else:
+        try:
+            parts = [float(part) for part in str(value).strip().replace(",", ".").split(":")]
+        except ValueError:
+            return None
+    if len(parts) > 3 or not all(math.isfinite(part) and part >= 0 for part in parts):
+        return None
+    return sum(part * 60 ** i for i, part in enumerate(reversed(parts)))
+
+def format_timestamp(seconds):
+    """1:02:03 or 2:03"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def iter_subtitle_cues(lines):
+    """
+    (start, end, text) for each line of text in a WebVTT or SRT file, read line by line.
+    Markup is removed, and the lines YouTube's automatic captions repeat from the previous
+    cue (they scroll up line by line) are only yielded once.
+    """
+    timing = None
+    previous = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        match = CUE_TIMING_RE.search(line)
+        if match:
+            timing = (parse_timestamp(match.group(1)), parse_timestamp(match.group(2)))
+            continue
+        if not line:
+            timing = None  # end of the cue
+            continue
+        if timing is None:
+            continue  # WEBVTT header, NOTE and STYLE blocks, SRT cue numbers
+        text = " ".join(html.unescape(CUE_MARKUP_RE.sub("", line)).split())
+        if text and text != previous:
+            previous = text
+            yield (timing[0], timing[1], text)
+
+def transcript_path(url, language):
+    key_hash = hashlib.sha1(video_cache_key(url).encode("utf-8")).hexdigest()[:20]
+    return os.path.join(TRANSCRIPT_DIR, f"{key_hash}.{language}.tsv")
+
+def subtitle_languages(info_path):
+    """(subtitle languages, automatic caption languages) listed in an info document"""
+    try:
+        with open(info_path, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return ([], [])
+    return (sorted(info.get("subtitles") or {}), sorted(info.get("automatic_captions") or {}))
+
+async def fetch_transcript(url, language, path):
+    """
+    Fetch the subtitles (or else automatic captions) of `url` in `language` without the media and
+    convert them into `path`, one "start<TAB>end<TAB>text" line per line of text.
+    A kept info document of the video is used instead of extracting it again; an extraction
+    here keeps its document, like get_video_info. Returns an error message or None.
+    """
+    work_dir = os.path.join(TRANSCRIPT_DIR, f"fetch-{uuid.uuid4().hex[:8]}")
+    os.makedirs(work_dir)
+    try:
+        cmd_args = get_base_ytdlp_args() + [
+            "--skip-download", "--write-subs", "--write-auto-subs",
+            "--sub-langs", language, "--sub-format", "vtt/srt/best",
+            "-o", "subtitle:" + os.path.join(work_dir, "transcript.%(ext)s"),
+        ]
+        info_path = info_json_store.lookup(url)
+        if info_path is not None:
+            cmd_args += ["--load-info-json", info_path]
+        else:
+            cmd_args += ["--write-info-json", "-o", "infojson:" + os.path.join(work_dir, "video.%(ext)s"),
+                "--no-playlist", url]
+        
+        errors = deque(maxlen=OUTPUT_TAIL_LINES)
+        returncode = await run_ytdlp_lines(cmd_args, lambda line: None, errors.append, kind="transcript")
+        
+        written = os.path.join(work_dir, "video.info.json")
+        if info_path is None and os.path.exists(written):
+            with open(written, encoding="utf-8") as f:
+                info_path = info_json_store.save(json.load(f)) or written
+        
+        files = [name for name in os.listdir(work_dir) if name.startswith("transcript.")]
+        if not files:
+            if returncode != 0:
+                error_lines = [line for line in errors if line.startswith("ERROR")] or list(errors)
+                return "\n".join(error_lines) or f"yt-dlp exited with code {returncode}"
+            subtitles, captions = subtitle_languages(info_path) if info_path else ([], [])
+            if not subtitles and not captions:
+                return "This video has no subtitles or automatic captions."
+            message = f"No subtitles in '{language}'."
+            if subtitles:
+                message += f"\nSubtitles: {', '.join(subtitles)}"
+            if captions:
+                message += f"\nAutomatic captions: {', '.join(captions[:40])}" + (" ..." if len(captions) > 40 else "")
+            return message
+        if not files[0].endswith((".vtt", ".srt")):
+            return f"Subtitles are only available as {files[0].rsplit('.', 1)[-1]}, which can't be converted to text."
+        
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(os.path.join(work_dir, files[0]), encoding="utf-8", errors="replace") as source, \
+                open(temp_path, "w", encoding="utf-8") as target:
+            for start, end, text in iter_subtitle_cues(source):
+                target.write(f"{start:.3f}\t{end:.3f}\t{text}\n")
+        os.replace(temp_path, path)
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        prune_transcripts()
+
+def prune_transcripts():
+    """Drop the oldest kept transcripts above TRANSCRIPT_CACHE_FILES"""
+    try:
+        entries = [entry for entry in os.scandir(TRANSCRIPT_DIR) if entry.name.endswith(".tsv")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:max(0, len(entries) - TRANSCRIPT_CACHE_FILES)]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+def read_transcript(path, start, end, timestamps):
+    """
+    Text of a kept transcript from `start` to `end` (seconds, None for open ends), reading it line
+    by line and stopping after TRANSCRIPT_MAX_CHARS characters.
+    Returns (text, time of the first and last line included, time to continue at or None)
+    """
+    parts = []
+    size = 0
+    first = last = paragraph_at = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            cue_start, _, text = line.rstrip("\n").split("\t", 2)
+            cue_start = float(cue_start)
+            if start is not None and cue_start < start:
+                continue
+            if end is not None and cue_start >= end:
+                break
+            if paragraph_at is None or cue_start - paragraph_at >= TRANSCRIPT_PARAGRAPH_SECONDS:
+                paragraph_at = cue_start
+                prefix = f"[{format_timestamp(cue_start)}] " if timestamps else ""
+                piece = ("\n\n" if parts else "") + prefix + text
+            else:
+                piece = " " + text
+            if size + len(piece) > TRANSCRIPT_MAX_CHARS and parts:
+                return ("".join(parts), first, last, cue_start)
+            parts.append(piece)
+            size += len(piece)
+            first = cue_start if first is None else first
+            last = cue_start
+    return ("".join(parts), first, last, None)
+
+_transcript_fetches = {}  # transcript path -> task of fetch_transcript() running for it
+
+async def handle_transcript(arguments: dict):
+    """Get the transcript of a video from its subtitles, converting and keeping them on first use"""
+    url = arguments.get("url")
+    language = str(arguments.get("language") or "en").strip()
+    
+    if not url:
+        return tool_error("Error: 'url' argument is required.")
+    if not LANGUAGE_RE.fullmatch(language):
+        return tool_error("Error: 'language' must be a language code like en, de or pt-BR.")
+    
+    bounds = []
+    for name in ("start", "end"):
+        value = arguments.get(name)
+        seconds = parse_timestamp(value) if value not in (None, "") else None
+        if value not in (None, "") and seconds is None:
+            return tool_error(f"Error: '{name}' must be a time like 90, 1:30 or 1:02:03.")
+        bounds.append(seconds)
+    start, end = bounds
+    
+    try:
+        os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+        path = transcript_path(url, language)
+        try:
+            fresh = time.time() - os.path.getmtime(path) < TRANSCRIPT_CACHE_TTL
+        except OSError:
+            fresh = False
+        if not fresh:
+            # Calls for the same transcript while it is being fetched wait for that fetch
+            fetch = _transcript_fetches.get(path)
+            if fetch is None:
+                fetch = _transcript_fetches[path] = asyncio.ensure_future(fetch_transcript(url, language, path))
+                fetch.add_done_callback(lambda _: _transcript_fetches.pop(path, None))
+            error = await asyncio.shield(fetch)
+            if error:
+                return tool_error(f"Failed to get the transcript. {error}")
+        
+        text, first, last, continue_at = read_transcript(path, start, end, arguments.get("timestamps", True))
+        if first is None:
+            return [TextContent(type="text", text=f"📝 The transcript ({language}) has no text in that time range.")]
+        
+        output = f"📝 Transcript ({language}), {format_timestamp(first)} - {format_timestamp(last)}\n\n{text}\n"
+        if continue_at is not None:
+            # In seconds as kept (to the millisecond): a rounded time would repeat or skip a line
+            resume = f"{continue_at:.3f}".rstrip("0").rstrip(".")
+            output += (f"\n✂️ The transcript continues at {format_timestamp(continue_at)} - ask again with "
+                f"start={resume} for the next part.\n")
+        return [TextContent(type="text", text=output)]
+        
+    except Exception as e:
+        return tool_error(f"Exception: {str(e)}")
 
 # ----------------------
 # 3. Entry point
 # ----------------------
-async def main():
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            server.create_initialization_options()
+class _MCPEndpoint:
+    """ASGI endpoint handing MCP requests to the session manager"""
+
+    def __init__(self, session_manager):
+        self.session_manager = session_manager
+
+    async def __call__(self, scope, receive, send):
+        await self.session_manager.handle_request(scope, receive, send)
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(server_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+async def serve_http(host, port):
+    """
+    Serve MCP over streamable HTTP (responses and notifications as SSE streams) at
+    http://host:port/mcp, and Prometheus metrics at /metrics. All client sessions share this
+    process. On Ctrl+C / SIGTERM no new requests are accepted, then running downloads are
+    drained (see DownloadManager.drain).
+    """
+    security = None
+    if host in ("127.0.0.1", "localhost", "::1"):
+        # Reject requests from web pages that got a DNS name pointed at this machine
+        security = TransportSecuritySettings(
+            allowed_hosts=["127.0.0.1:*", "localhost:*", "[::1]:*"],
+            allowed_origins=["http://127.0.0.1:*", "http://localhost:*", "http://[::1]:*"],
         )
+    session_manager = StreamableHTTPSessionManager(app=server, security_settings=security)
+    
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        async with session_manager.run():
+            yield
+        finished, interrupted = await download_manager.drain(DRAIN_TIMEOUT)
+        if finished or interrupted:
+            print(f"Drained downloads: {finished} finished, {interrupted} interrupted (resumed on next start)",
+                file=sys.stderr)
+    
+    app = Starlette(
+        routes=[
+            Route("/mcp", endpoint=_MCPEndpoint(session_manager)),
+            Route("/metrics", endpoint=metrics_endpoint),
+        ],
+        lifespan=lifespan,
+    )
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", timeout_graceful_shutdown=5)
+    await uvicorn.Server(config).serve()
+
+async def main(transport=TRANSPORT, host=HTTP_HOST, port=HTTP_PORT):
+    warm_up_extraction_engine()
+    # Keep references, the event loop only holds weak ones to tasks
+    resume_task = asyncio.create_task(resume_interrupted_downloads())
+    metrics_task = asyncio.create_task(metrics_textfile_loop()) if METRICS_TEXTFILE else None
+    ytdlp_workers.fill()
+    try:
+        if transport == "http":
+            await serve_http(host, port)
+            return
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                server.create_initialization_options()
+            )
+    finally:
+        background = [task for task in (resume_task, metrics_task) if task is not None]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="yt-dlp MCP server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default=TRANSPORT)
+    parser.add_argument("--host", default=HTTP_HOST)
+    parser.add_argument("--port", type=int, default=HTTP_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.transport, args.host, args.port))
+    except KeyboardInterrupt:
+        pass  # Ctrl+C, the HTTP server has drained by now
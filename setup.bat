@@ -43,21 +43,21 @@ for /f "tokens=2" %%i in ('python --version 2^>^&1') do set PYTHON_VERSION=%%i
 echo [+] Python %PYTHON_VERSION% is installed
 echo.
 
-:: Check Python version (need 3.8+)
+:: Check Python version (need 3.10+, the mcp package requires it)
 for /f "tokens=1,2 delims=." %%a in ("%PYTHON_VERSION%") do (
     set MAJOR=%%a
     set MINOR=%%b
 )
 
 if %MAJOR% LSS 3 (
-    echo [!] Python 3.8 or higher is required. You have Python %PYTHON_VERSION%
+    echo [!] Python 3.10 or higher is required. You have Python %PYTHON_VERSION%
     echo Please upgrade Python from: https://www.python.org/downloads/
     pause
     exit /b 1
 )
 
-if %MAJOR% EQU 3 if %MINOR% LSS 8 (
-    echo [!] Python 3.8 or higher is required. You have Python %PYTHON_VERSION%
+if %MAJOR% EQU 3 if %MINOR% LSS 10 (
+    echo [!] Python 3.10 or higher is required. You have Python %PYTHON_VERSION%
     echo Please upgrade Python from: https://www.python.org/downloads/
     pause
     exit /b 1
@@ -125,7 +125,7 @@ python -m pip install --upgrade pip >nul 2>&1
 
 :: Install required packages
 echo [*] Installing mcp...
-python -m pip install mcp >nul 2>&1
+python -m pip install "mcp>=1.30,<2" uvicorn starlette >nul 2>&1
 
 echo [*] Installing yt-dlp...
 python -m pip install yt-dlp >nul 2>&1
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# my_mcp creates its download and state folders under ~ when it is imported
+os.environ["HOME"] = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
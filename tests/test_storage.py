@@ -0,0 +1,58 @@
+import asyncio
+import os
+import shutil
+import time
+
+import my_mcp
+
+
+def write_file(path, size, age=0):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if age:
+        os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def make_storage(tmp_path, monkeypatch, quota, min_free):
+    root = tmp_path / "downloads"
+    root.mkdir()
+    storage = my_mcp.StorageManager(str(tmp_path / "storage.sqlite3"), str(root), quota, min_free)
+    index = my_mcp.DownloadIndex(str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr(my_mcp, "storage_manager", storage)
+    monkeypatch.setattr(my_mcp, "download_index", index)
+    # A file of the user's, older than anything the server downloaded
+    user_file = write_file(str(root / "holiday.mp4"), 4000, age=30 * 24 * 3600)
+    downloaded = write_file(str(root / "video.mp4"), 3000)
+    asyncio.run(index.record(("video", "youtube:abc", "720p"), downloaded))
+    return storage, user_file, downloaded
+
+
+def test_no_quota_refuses_instead_of_deleting(tmp_path, monkeypatch):
+    # 1000 bytes short of the free space to keep: deleting either file would make room
+    usage = shutil.disk_usage(str(tmp_path))
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: usage._replace(free=10 ** 6))
+    storage, user_file, downloaded = make_storage(tmp_path, monkeypatch, 0, 10 ** 6 + 1000)
+
+    error = storage.reserve(my_mcp.DownloadJob("job1", "video", "url", "720p", 1, None), None)
+
+    assert error is not None and error.startswith("Not enough space")
+    assert os.path.exists(user_file)
+    assert os.path.exists(downloaded)
+
+
+def test_quota_deletes_only_recorded_downloads(tmp_path, monkeypatch):
+    storage, user_file, downloaded = make_storage(tmp_path, monkeypatch, 9000, 0)
+
+    # 7000 bytes used, room for 2000 more: 3000 only fit without the recorded download
+    error = storage.reserve(my_mcp.DownloadJob("job1", "video", "url", "720p", 1, None), 3000)
+
+    assert error is None
+    assert os.path.exists(user_file)
+    assert not os.path.exists(downloaded)
+
+    # The user's file is never deleted, even when that is the only way to make room
+    error = storage.reserve(my_mcp.DownloadJob("job2", "video", "url", "720p", 1, None), 6000)
+
+    assert error is not None and error.startswith("Not enough space")
+    assert os.path.exists(user_file)
@@ -0,0 +1,29 @@
+import asyncio
+import os
+import re
+
+import my_mcp
+
+URL = "https://www.youtube.com/watch?v=abcdefghijk"
+
+
+def test_pages_continue_without_repeating_lines(monkeypatch):
+    # Lines starting between whole seconds, so a page can end in the middle of a second
+    cues = [(i * 0.4, f"line{i:03d}") for i in range(60)]
+    os.makedirs(my_mcp.TRANSCRIPT_DIR, exist_ok=True)
+    with open(my_mcp.transcript_path(URL, "en"), "w", encoding="utf-8") as f:
+        for start, text in cues:
+            f.write(f"{start:.3f}\t{start + 0.4:.3f}\t{text}\n")
+    monkeypatch.setattr(my_mcp, "TRANSCRIPT_MAX_CHARS", 50)
+
+    seen = []
+    arguments = {"url": URL, "timestamps": False}
+    for _ in range(len(cues)):
+        text = asyncio.run(my_mcp.handle_transcript(arguments))[0].text
+        seen += re.findall(r"line\d{3}", text)
+        resume = re.search(r"start=(\S+)", text)
+        if resume is None:
+            break
+        arguments = {"url": URL, "timestamps": False, "start": resume.group(1)}
+
+    assert seen == [text for _, text in cues]